@@ -1,20 +1,16 @@
 import os
-import pandas as pd
 import plotly.express as px
 import dash
 from dash import dcc
 from dash import html
+from dash import ctx
 import dash_bootstrap_components as dbc
 from plotly.subplots import make_subplots
 from dash.dependencies import Input, Output
 from dash_bootstrap_templates import load_figure_template
 
+from downsampling import downsample_window, relayout_range
 
-#read parquet
-def read_parquet_files(subfolder_path):
-    files = [f for f in os.listdir(subfolder_path) if f.endswith('.parquet')]
-    dataframes = [pd.read_parquet(os.path.join(subfolder_path, f)) for f in files]
-    return pd.concat(dataframes, ignore_index=True)
 
 #dropdown for layout
 def get_dropdown_options(main_folders, sub_folders, subsub_folder):
@@ -32,32 +28,23 @@ def get_dropdown_options(main_folders, sub_folders, subsub_folder):
     return [{'label': folder, 'value': folder} for folder in subsubsubfolders]
 
 
-# convert timestamp
-def convert_timestamp(df):
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-    return df
-
-
-# downsample data using plotly resampler
-def downsample_data(df):
-    df = df.set_index('timestamp')
-    df_resampled = df.resample('6H').mean()
-    df_resampled = df_resampled.reset_index()
-    return df_resampled
-
-
 # update plot
-def update_line_plot(selected_subfolder, main_folders, sub_folders, subsub_folder):
+def update_line_plot(selected_subfolder, main_folders, sub_folders, subsub_folder, relayout_data=None):
     if selected_subfolder is None:
         return px.line()
 
+    x_range = relayout_range(relayout_data) if relayout_data else (None, None)
+    if x_range is None:
+        return dash.no_update
+
+    # resolution fitting the visible window and the graph width
     subfolder_path = os.path.join(main_folders, sub_folders, subsub_folder, selected_subfolder)
-    df = read_parquet_files(subfolder_path)
-    df = convert_timestamp(df)
-    df = downsample_data(df)
+    df = downsample_window(subfolder_path, *x_range)
 
     fig = make_subplots(specs=[[{'secondary_y': True}]])
     fig.add_trace(px.line(df, x='timestamp', y='data').data[0])
+    # keeps the user's zoom while the data is replaced
+    fig.update_layout(uirevision=subfolder_path)
 
     return fig
 
@@ -135,30 +122,46 @@ app.layout = create_layout(main_folder, sub_folder, subsub_folder_1, sub_folder2
 
 #callback for plots individually
 @app.callback(Output('line-plot-1', 'figure'),
-              [Input('subfolder-dropdown', 'value')])
-def update_graph_1(selected_subfolder):
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1)
+              [Input('subfolder-dropdown', 'value'),
+               Input('line-plot-1', 'relayoutData')])
+def update_graph_1(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-1':
+        relayout_data = None
+    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1, relayout_data)
     return fig
 
 
 @app.callback(Output('line-plot-2', 'figure'),
-              [Input('subfolder-dropdown-2', 'value')])
-def update_graph_2(selected_subfolder):
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2)
+              [Input('subfolder-dropdown-2', 'value'),
+               Input('line-plot-2', 'relayoutData')])
+def update_graph_2(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-2':
+        relayout_data = None
+    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2, relayout_data)
     return fig
 
 
 @app.callback(Output('line-plot-3', 'figure'),
-              [Input('subfolder-dropdown-3', 'value')])
-def update_graph_3(selected_subfolder):
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3)
+              [Input('subfolder-dropdown-3', 'value'),
+               Input('line-plot-3', 'relayoutData')])
+def update_graph_3(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-3':
+        relayout_data = None
+    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3, relayout_data)
     return fig
 
 
 @app.callback(Output('line-plot-4', 'figure'),
-              [Input('subfolder-dropdown-4', 'value')])
-def update_graph_3(selected_subfolder):
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4)
+              [Input('subfolder-dropdown-4', 'value'),
+               Input('line-plot-4', 'relayoutData')])
+def update_graph_3(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-4':
+        relayout_data = None
+    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4, relayout_data)
     return fig
 
 
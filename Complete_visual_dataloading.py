@@ -1,46 +1,22 @@
-import datetime
 import os
 import time
-import pandas as pd
 import plotly.graph_objects as go
 import dash
-from dateutil.relativedelta import relativedelta
 from dash import dcc
 from dash import html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 from dash_bootstrap_templates import load_figure_template
-import pyarrow.parquet as pq
 from pathlib import Path
 
+from data import table_to_arrays
+from tail import TailFollower, extend_data
 
-def load_parquet_data(property_path, start_dt=None, stop_dt=None):
-    start_timestamp = datetime.datetime.timestamp(start_dt) if start_dt else None
-    stop_timestamp = datetime.datetime.timestamp(stop_dt) if stop_dt else None
+# refresh period of the live graphs in milliseconds
+LIVE_INTERVAL_MS = 5000
 
-    required_months = []
-    tmp_dt = start_dt.replace(day=1) if start_dt else datetime.datetime.now()
-    while tmp_dt < stop_dt if stop_dt else datetime.datetime.now():
-        file_path = tmp_dt.strftime("%Y-%m")
-        required_months.append(file_path)
-        tmp_dt += relativedelta(months=1)
-
-    if not isinstance(property_path, list):
-        property_path = [property_path]
-
-    parquet_data = {}
-    for p in property_path:
-        parquet_files = [Path(p).joinpath(f"{i}.parquet") for i in required_months]
-        available_files = [i for i in parquet_files if i.is_file()]
-        pq_dataset = pq.ParquetDataset(available_files, filters=[('timestamp', '>=', start_timestamp),
-                                                                 ('timestamp', '<=', stop_timestamp)])
-
-        pq_table = pq_dataset.read()
-        df = pq_table.to_pandas()
-
-        parquet_data[str(p)] = df
-
-    return parquet_data, start_dt, stop_dt
+# reads what was appended since the cursor of a graph, the cursors are kept in the page (live-cursor-N)
+follower = TailFollower()
 
 
 def get_dropdown_options(main_folders, sub_folders, subsub_folder):
@@ -58,37 +34,30 @@ def get_dropdown_options(main_folders, sub_folders, subsub_folder):
     return [{'label': folder, 'value': folder} for folder in subsubsubfolders]
 
 
-def convert_timestamp(df):
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-    return df
-
-
-def downsample_data(df, timestamp_col='timestamp', value_col='data'):
-    df_resampled = df.groupby(pd.Grouper(key=timestamp_col, freq='6h'))[value_col].mean().reset_index()
-    return df_resampled
-
-
-def update_line_plot(selected_subfolder, main_folders, sub_folders, subsub_folder, start_dt, stop_dt):
+def start_live_plot(selected_subfolder, main_folders, sub_folders, subsub_folder):
     if selected_subfolder is None:
-        return go.Figure()
-    start = time.perf_counter()
-    now = datetime.datetime.now().strftime("%H:%M:%S")
-    print("Read Parquet started : ", now)
+        return go.Figure(), None
 
-    subfolder_path = os.path.join(main_folders, sub_folders, subsub_folder, selected_subfolder)
-    parquet_data = load_parquet_data(subfolder_path, start_dt, stop_dt)
-    df = parquet_data[selected_subfolder]  # Use selected_subfolder directly as the key
-    now = datetime.datetime.now().strftime("%H:%M:%S")
-    print("Read Parquet completed at : ", now)
-    df = convert_timestamp(df)
-    df = downsample_data(df)
+    # a new cursor, the graph starts with the history window
+    table, cursor = follower.poll(Path(main_folders, sub_folders, subsub_folder, selected_subfolder))
+    x, y = table_to_arrays(table) if table is not None else ([], [])
 
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=df['timestamp'], y=df['data'], mode='lines'))
-    end = time.perf_counter()
-    print(f'Update Line Plot Function Completed in {round(end - start, 2)} seconds')
+    fig.add_trace(go.Scatter(x=x, y=y, mode='lines'))
+    return fig, cursor
+
 
-    return fig
+def extend_live_plot(selected_subfolder, main_folders, sub_folders, subsub_folder, cursor):
+    subfolder_path = Path(main_folders, sub_folders, subsub_folder, selected_subfolder or '')
+    if selected_subfolder is None or cursor is None or cursor['property'] != str(subfolder_path):
+        # nothing selected, or the graph of a newly selected property is still being drawn
+        return dash.no_update, dash.no_update
+
+    # only the row groups appended since the cursor of this graph are read and sent to the browser
+    table, cursor = follower.poll(subfolder_path, cursor)
+    if table is None:
+        return dash.no_update, cursor
+    return extend_data(table), cursor
 
 
 def create_layout(main_folders, sub_folders, subsub_folders_1, sub_folders2, subsub_folders_2, subsub_folders_3,
@@ -116,8 +85,10 @@ def create_layout(main_folders, sub_folders, subsub_folders_1, sub_folders2, sub
                 ], width=6),
             ]),
             dbc.Row([
-                dbc.Col(dcc.Loading(dcc.Graph(id='line-plot-1', config={'displayModeBar': False})), width=6),
-                dbc.Col(dcc.Loading(dcc.Graph(id='line-plot-2', config={'displayModeBar': False})), width=6),
+                dbc.Col([dcc.Loading(dcc.Graph(id='line-plot-1', config={'displayModeBar': False})),
+                         dcc.Store(id='live-cursor-1')], width=6),
+                dbc.Col([dcc.Loading(dcc.Graph(id='line-plot-2', config={'displayModeBar': False})),
+                         dcc.Store(id='live-cursor-2')], width=6),
             ]),
         ]),
         html.Div([
@@ -141,10 +112,13 @@ def create_layout(main_folders, sub_folders, subsub_folders_1, sub_folders2, sub
                 ], width=6),
             ]),
             dbc.Row([
-                dbc.Col(dcc.Loading(dcc.Graph(id='line-plot-3', config={'displayModeBar': False})), width=6),
-                dbc.Col(dcc.Loading(dcc.Graph(id='line-plot-4', config={'displayModeBar': False})), width=6),
+                dbc.Col([dcc.Loading(dcc.Graph(id='line-plot-3', config={'displayModeBar': False})),
+                         dcc.Store(id='live-cursor-3')], width=6),
+                dbc.Col([dcc.Loading(dcc.Graph(id='line-plot-4', config={'displayModeBar': False})),
+                         dcc.Store(id='live-cursor-4')], width=6),
             ]),
         ]),
+        dcc.Interval(id='live-interval', interval=LIVE_INTERVAL_MS),
     ], style={'width': '80%', 'margin': 'auto', 'display': 'block'})
 
 
@@ -162,82 +136,100 @@ app.layout = create_layout(main_folder, sub_folder, subsub_folder_1, sub_folder2
                            subsub_folder_4)
 
 
-@app.callback(Output('line-plot-1', 'figure'),
+@app.callback([Output('line-plot-1', 'figure'),
+               Output('live-cursor-1', 'data')],
               [Input('subfolder-dropdown', 'value')])
 def update_graph_1(selected_subfolder):
     start = time.perf_counter()
 
-    start_dt = datetime.datetime.now()
-
-    parquet_data, start_dt, stop_dt = load_parquet_data(main_folder, start_dt=start_dt)
-
-    if stop_dt is None:
-        stop_dt = datetime.datetime.now()
-
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1, start_dt, stop_dt)
+    fig, cursor = start_live_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1)
 
     end = time.perf_counter()
     print(f'Update Graph1 Plot Function Completed in {round(end - start, 2)} seconds')
 
-    return fig
+    return fig, cursor
 
 
-@app.callback(Output('line-plot-2', 'figure'),
+@app.callback([Output('line-plot-1', 'extendData'),
+               Output('live-cursor-1', 'data', allow_duplicate=True)],
+              [Input('live-interval', 'n_intervals')],
+              [State('subfolder-dropdown', 'value'),
+               State('live-cursor-1', 'data')],
+              prevent_initial_call=True)
+def extend_graph_1(n_intervals, selected_subfolder, cursor):
+    return extend_live_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1, cursor)
+
+
+@app.callback([Output('line-plot-2', 'figure'),
+               Output('live-cursor-2', 'data')],
               [Input('subfolder-dropdown-2', 'value')])
 def update_graph_2(selected_subfolder):
     start = time.perf_counter()
 
-    start_dt = datetime.datetime.now()
-    parquet_data, start_dt, stop_dt = load_parquet_data(main_folder, start_dt=start_dt)
-
-    if stop_dt is None:
-        stop_dt = datetime.datetime.now()
-
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2, start_dt, stop_dt)
+    fig, cursor = start_live_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2)
 
     end = time.perf_counter()
     print(f'Update Graph2 Plot Function Completed in {round(end - start, 2)} seconds')
 
-    return fig
+    return fig, cursor
 
 
-@app.callback(Output('line-plot-3', 'figure'),
+@app.callback([Output('line-plot-2', 'extendData'),
+               Output('live-cursor-2', 'data', allow_duplicate=True)],
+              [Input('live-interval', 'n_intervals')],
+              [State('subfolder-dropdown-2', 'value'),
+               State('live-cursor-2', 'data')],
+              prevent_initial_call=True)
+def extend_graph_2(n_intervals, selected_subfolder, cursor):
+    return extend_live_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2, cursor)
+
+
+@app.callback([Output('line-plot-3', 'figure'),
+               Output('live-cursor-3', 'data')],
               [Input('subfolder-dropdown-3', 'value')])
 def update_graph_3(selected_subfolder):
     start = time.perf_counter()
-    start_dt = datetime.datetime.now()
-
-    parquet_data, start_dt, stop_dt = load_parquet_data(main_folder, start_dt=start_dt)
-
-    if stop_dt is None:
-        stop_dt = datetime.datetime.now()
 
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3, start_dt, stop_dt)
+    fig, cursor = start_live_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3)
 
     end = time.perf_counter()
     print(f'Update Graph3 Plot Function Completed in {round(end - start, 2)} seconds')
 
-    return fig
+    return fig, cursor
 
 
-@app.callback(Output('line-plot-4', 'figure'),
+@app.callback([Output('line-plot-3', 'extendData'),
+               Output('live-cursor-3', 'data', allow_duplicate=True)],
+              [Input('live-interval', 'n_intervals')],
+              [State('subfolder-dropdown-3', 'value'),
+               State('live-cursor-3', 'data')],
+              prevent_initial_call=True)
+def extend_graph_3(n_intervals, selected_subfolder, cursor):
+    return extend_live_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3, cursor)
+
+
+@app.callback([Output('line-plot-4', 'figure'),
+               Output('live-cursor-4', 'data')],
               [Input('subfolder-dropdown-4', 'value')])
 def update_graph_4(selected_subfolder):
     start = time.perf_counter()
 
-    start_dt = datetime.datetime.now()
-
-    parquet_data, start_dt, stop_dt = load_parquet_data(main_folder, start_dt=start_dt)
-
-    if stop_dt is None:
-        stop_dt = datetime.datetime.now()
-
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4, start_dt, stop_dt)
+    fig, cursor = start_live_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4)
 
     end = time.perf_counter()
     print(f'Update Graph4 Plot Function Completed in {round(end - start, 2)} seconds')
 
-    return fig
+    return fig, cursor
+
+
+@app.callback([Output('line-plot-4', 'extendData'),
+               Output('live-cursor-4', 'data', allow_duplicate=True)],
+              [Input('live-interval', 'n_intervals')],
+              [State('subfolder-dropdown-4', 'value'),
+               State('live-cursor-4', 'data')],
+              prevent_initial_call=True)
+def extend_graph_4(n_intervals, selected_subfolder, cursor):
+    return extend_live_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4, cursor)
 
 
 if __name__ == '__main__':
@@ -1,22 +1,15 @@
 import os
 import time
-import pandas as pd
 import plotly.graph_objects as go
 import dash
 from dash import dcc
 from dash import html
+from dash import ctx
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output
 from dash_bootstrap_templates import load_figure_template
-import pyarrow.parquet as pq
-import pyarrow as pa
 
-
-def load_parquet_data(subfolder_path):
-    files = [f for f in os.listdir(subfolder_path) if f.endswith('.parquet')]
-    tables = [pq.read_table(os.path.join(subfolder_path, f)) for f in files]
-    concatenated_table = pa.concat_tables(tables)
-    return concatenated_table.to_pandas()
+from downsampling import downsample_window, relayout_range
 
 
 def get_dropdown_options(main_folders, sub_folders, subsub_folder):
@@ -34,27 +27,22 @@ def get_dropdown_options(main_folders, sub_folders, subsub_folder):
     return [{'label': folder, 'value': folder} for folder in subsubsubfolders]
 
 
-def convert_timestamp(df):
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-    return df
-
-
-def downsample_data(df, timestamp_col='timestamp', value_col='data'):
-    df_resampled = df.groupby(pd.Grouper(key=timestamp_col, freq='6h'))[value_col].mean().reset_index()
-    return df_resampled
-
-
-def update_line_plot(selected_subfolder, main_folders, sub_folders, subsub_folder):
+def update_line_plot(selected_subfolder, main_folders, sub_folders, subsub_folder, relayout_data=None):
     if selected_subfolder is None:
         return go.Figure()
 
+    x_range = relayout_range(relayout_data) if relayout_data else (None, None)
+    if x_range is None:
+        return dash.no_update
+
+    # resolution fitting the visible window and the graph width
     subfolder_path = os.path.join(main_folders, sub_folders, subsub_folder, selected_subfolder)
-    df = load_parquet_data(subfolder_path)
-    df = convert_timestamp(df)
-    df = downsample_data(df)
+    df = downsample_window(subfolder_path, *x_range)
 
     fig = go.Figure()
     fig.add_trace(go.Scatter(x=df['timestamp'], y=df['data'], mode='lines'))
+    # keeps the user's zoom while the data is replaced
+    fig.update_layout(uirevision=subfolder_path)
 
     return fig
 
@@ -131,10 +119,14 @@ app.layout = create_layout(main_folder, sub_folder, subsub_folder_1, sub_folder2
 
 
 @app.callback(Output('line-plot-1', 'figure'),
-              [Input('subfolder-dropdown', 'value')])
-def update_graph_1(selected_subfolder):
+              [Input('subfolder-dropdown', 'value'),
+               Input('line-plot-1', 'relayoutData')])
+def update_graph_1(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-1':
+        relayout_data = None
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1)
+    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1, relayout_data)
     end = time.perf_counter()
     print(f'Update Graph1 Plot Function Completed in {round(end - start, 2)} seconds')
 
@@ -142,10 +134,14 @@ def update_graph_1(selected_subfolder):
 
 
 @app.callback(Output('line-plot-2', 'figure'),
-              [Input('subfolder-dropdown-2', 'value')])
-def update_graph_2(selected_subfolder):
+              [Input('subfolder-dropdown-2', 'value'),
+               Input('line-plot-2', 'relayoutData')])
+def update_graph_2(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-2':
+        relayout_data = None
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2)
+    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2, relayout_data)
     end = time.perf_counter()
     print(f'Update Graph2 Plot Function Completed in {round(end - start, 2)} seconds')
 
@@ -153,10 +149,14 @@ def update_graph_2(selected_subfolder):
 
 
 @app.callback(Output('line-plot-3', 'figure'),
-              [Input('subfolder-dropdown-3', 'value')])
-def update_graph_3(selected_subfolder):
+              [Input('subfolder-dropdown-3', 'value'),
+               Input('line-plot-3', 'relayoutData')])
+def update_graph_3(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-3':
+        relayout_data = None
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3)
+    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3, relayout_data)
     end = time.perf_counter()
     print(f'Update Graph3 Plot Function Completed in {round(end - start, 2)} seconds')
 
@@ -164,10 +164,14 @@ def update_graph_3(selected_subfolder):
 
 
 @app.callback(Output('line-plot-4', 'figure'),
-              [Input('subfolder-dropdown-4', 'value')])
-def update_graph_4(selected_subfolder):
+              [Input('subfolder-dropdown-4', 'value'),
+               Input('line-plot-4', 'relayoutData')])
+def update_graph_4(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-4':
+        relayout_data = None
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4)
+    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4, relayout_data)
     end = time.perf_counter()
     print(f'Update Graph4 Plot Function Completed in {round(end - start, 2)} seconds')
 
@@ -1,15 +1,14 @@
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
-from data import load_parquet_data, get_doocs_properties
+from data import get_doocs_properties, normalize_timestamps
+from rollups import load_rollup_data
 import plotly.graph_objects as go
 from pathlib import Path
 from datetime import datetime
 import time
-import pandas as pd
 
 # Load data from data.py
-online_data = {}
 doocs_properties = get_doocs_properties(Path("C:/Users/pmahad/PycharmProjects/pythonProject/Database"))
 
 app = dash.Dash(__name__)
@@ -49,19 +48,12 @@ def load_and_plot_data(n_clicks, selected_properties):
     if n_clicks > 0 and selected_properties:
         for selected_property in selected_properties:
             prop_path = Path(selected_property)
-            loaded_data = load_parquet_data(prop_path, datetime(2023, 10, 15, 17, 30), datetime(2023, 11, 15, 17, 30))
-            online_data[doocs_properties[str(prop_path)]] = loaded_data[prop_path]
+            # Precomputed rollup instead of resampling the raw data
+            rollup_data = load_rollup_data(prop_path, datetime(2023, 10, 15, 17, 30), datetime(2023, 11, 15, 17, 30))
 
             # Get data for the selected property
-            data_table = online_data[doocs_properties[str(prop_path)]]
-            data_df = data_table.to_pandas()
-
-            # Convert timestamp column to datetime
-            data_df['timestamp'] = pd.to_datetime(data_df['timestamp'], unit='s')
-
-            # Downsample the data
-            data_df.set_index('timestamp', inplace=True)
-            data_resampled = data_df.resample('1d').mean().reset_index()
+            data_table = rollup_data[prop_path]
+            data_resampled = normalize_timestamps(data_table).to_pandas()
 
             # Create graph
             fig = go.Figure()
@@ -102,6 +94,7 @@ app.layout = html.Div([
     html.Div(id='property-graph-container'),
 ])
 
+
 # Run the app
 if __name__ == '__main__':
     app.run_server(debug=True)
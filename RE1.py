@@ -16,6 +16,8 @@ from dash_extensions.enrich import DashProxy, Serverside, ServersideOutputTransf
 from plotly_resampler import FigureResampler
 from trace_updater import TraceUpdater
 
+from downsampling import downsample_data
+
 
 # Function to read Parquet files.
 def read_parquet_files(subfolder_path):
@@ -47,12 +49,6 @@ def convert_timestamp(df):
     return df
 
 
-# Function to downsample data.
-def downsample_data(df, timestamp_col='timestamp', value_col='data'):
-    df_resampled = df.groupby(pd.Grouper(key=timestamp_col, freq='6h'))[value_col].mean().reset_index()
-    return df_resampled
-
-
 # Function to update line plot.
 def update_line_plot(selected_subfolder, main_folders, sub_folders, subsub_folder):
     if selected_subfolder is None:
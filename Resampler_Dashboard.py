@@ -1,11 +1,15 @@
-from data_arne import get_doocs_properties, load_parquet_data
+from catalog import load_catalog, property_time_range
+from data import get_doocs_properties, load_parquet_data, table_to_arrays, DEFAULT_MAX_WORKERS
+from prefetch import Prefetcher
+from spectrogram import spectrogram_window
+from session_store import new_session_id, session_store
+from downsampling import relayout_range
 from pathlib import Path
 from datetime import datetime, timedelta
 
 from typing import List
-import pandas as pd
 import plotly.graph_objects as go
-from dash import MATCH, Input, Output, State, dcc, html, no_update, ClientsideFunction
+from dash import MATCH, Input, Output, State, ctx, dcc, html, no_update, ClientsideFunction
 from dash_extensions.enrich import (
     DashProxy,
     Serverside,
@@ -18,18 +22,17 @@ from trace_updater import TraceUpdater
 from plotly_resampler import FigureResampler
 from plotly_resampler.aggregation import MinMaxLTTB
 from os.path import relpath
-import numpy as np
-from scipy import signal
 from plotly.subplots import make_subplots
 
-# Data that will be used for the plotly-resampler figures
-online_data = {}
+# warms the table cache with the neighbouring months and the sibling properties after every load, one round per session
+prefetcher = Prefetcher()
 
-doocs_properties = get_doocs_properties(Path("C:/Users/pmahad/PycharmProjects/pythonProject/Database"))
+base_path = Path("C:/Users/pmahad/PycharmProjects/pythonProject/Database")
+doocs_properties = get_doocs_properties(base_path)
 app = DashProxy(__name__, transforms=[ServersideOutputTransform(), TriggerTransform()])
 
 # app layout
-app.layout = html.Div([
+layout = html.Div([
     dcc.Tabs(id="tabs", value='XTIN', children=[
         dcc.Tab(label='XTIN', value='XTIN'),
         dcc.Tab(label='XHEXP1', value='XHEXP1'),
@@ -59,6 +62,14 @@ app.layout = html.Div([
     html.Div(id="container", children=[]),
 ])
 
+
+def serve_layout():
+    # every page load gets a session id, the loaded data is kept per session in session_store
+    return html.Div([dcc.Store(id="session-id", data=new_session_id(), storage_type="session"), layout])
+
+
+app.layout = serve_layout
+
 @app.callback(
     Output('property-selecter', 'options'),
     Output('property-selecter1', 'options'),
@@ -92,6 +103,25 @@ def generate_dropdown_options(properties=None, properties1=None, properties2=Non
     return dropdown_options,dropdown_options1, dropdown_options2
 
 
+@app.callback(
+    Output('date-picker', 'min_date_allowed'),
+    Output('date-picker', 'max_date_allowed'),
+    Input('property-selecter', 'value'),
+    Input('property-selecter1', 'value'),
+    Input('property-selecter2', 'value'),
+)
+def update_date_limits(laser_files, link_files, climate_files):
+    # the days holding data of the selected properties, from the timestamp statistics in the catalog
+    selected_properties = [*(laser_files or []), *(link_files or []), *(climate_files or [])]
+    catalog = load_catalog(base_path)
+    ranges = [property_time_range(catalog, prop) for prop in selected_properties]
+    ranges = [r for r in ranges if r[0] is not None]
+    if not ranges:
+        return no_update, no_update
+    return (datetime.fromtimestamp(min(r[0] for r in ranges)).date(),
+            datetime.fromtimestamp(max(r[1] for r in ranges)).date())
+
+
 @app.callback(
     Output("container", "children"),
     Input("load-plot", "n_clicks"),
@@ -101,15 +131,17 @@ def generate_dropdown_options(properties=None, properties1=None, properties2=Non
     State("date-picker", "start_date"),
     State("date-picker", "end_date"),
     State("time-range", "value"),
+    State("session-id", "data"),
     prevent_initial_call=True,
 )
-def add_graph_div(n_clicks, laser_files, link_files, climate_files, start_date, end_date, time_range):
+def add_graph_div(n_clicks, laser_files, link_files, climate_files, start_date, end_date, time_range, session_id):
     selected_properties = []
     selected_properties.extend(laser_files if laser_files else [])
     selected_properties.extend(link_files if link_files else [])
     selected_properties.extend(climate_files if climate_files else [])
 
     if not selected_properties:  # Check if no properties are selected
+        session_store.release(session_id)
         return []
 
     props = [Path(prop) for prop in selected_properties]
@@ -123,18 +155,32 @@ def add_graph_div(n_clicks, laser_files, link_files, climate_files, start_date,
     end_dt = end_dt.replace(hour=int(end_time), minute=int((end_time - int(end_time)) * 60))
 
 
-    loaded_data = load_parquet_data(props, start_dt, end_dt)
+    load_times = {}
+    prefetcher.record_request(props, start_dt, end_dt)
+    loaded_data = load_parquet_data(props, start_dt, end_dt, max_workers=DEFAULT_MAX_WORKERS, timings=load_times)
+    for key, seconds in load_times.items():
+        print(f"Loaded {doocs_properties.get(str(key), key)} in {round(seconds, 2)} seconds")
+    prefetcher.prefetch(props, start_dt, end_dt, session=session_id)
 
     # Clear previous graph divs
     div_children = []
+    uids = []
 
     for key, item in loaded_data.items():
         uid = doocs_properties.get(str(key), f"graph-{len(div_children)}")  # Generate a unique ID
-        online_data[uid] = item  # Assuming `online_data` and `doocs_properties` are defined elsewhere
+        uids.append(uid)
+        # sessions showing the same property and range share one copy of it
+        session_store.put(session_id, uid, item, source=(str(key), start_dt.isoformat(), end_dt.isoformat()))
 
         new_child = html.Div(
             children=[
                 dcc.Graph(id={"type": "dynamic-graph", "index": uid}, figure=go.Figure()),
+                dcc.Graph(id={"type": "spectrogram-graph", "index": uid}, figure=go.Figure()),
+                # property and loaded range of the spectrogram, in the page so every worker can serve it
+                dcc.Store(id={"type": "spectrogram-source", "index": uid},
+                          data={"path": str(key), "start": start_dt.isoformat(), "end": end_dt.isoformat()}),
+                # the window the spectrogram shows, kept in the page like its source
+                dcc.Store(id={"type": "spectrogram-view", "index": uid}),
                 dcc.Loading(dcc.Store(id={"type": "store", "index": uid})),
                 TraceUpdater(id={"type": "dynamic-updater", "index": uid}, gdID=f"{uid}"),
                 dcc.Interval(
@@ -144,15 +190,21 @@ def add_graph_div(n_clicks, laser_files, link_files, climate_files, start_date,
         )
         div_children.append(new_child)
 
+    # the graphs of the previous selection are gone from the container
+    session_store.retain(session_id, uids)
     return div_children
 
 
 @app.callback(
     Output("container", "children", allow_duplicate=True),
     Input("tabs", "value"),
+    State("session-id", "data"),
     prevent_initial_call=True,
 )
-def update_container(tab):
+def update_container(tab, session_id):
+    # the prefetched properties belong to the previous tab, other sessions keep their rounds
+    prefetcher.cancel(session_id)
+    session_store.release(session_id)
     if tab != tab:
         return []
 
@@ -161,12 +213,13 @@ def update_container(tab):
     Output({"type": "store", "index": MATCH}, "data"),
     State("load-plot", "n_clicks"),
     State({"type": "dynamic-graph", "index": MATCH}, "id"),
+    State("session-id", "data"),
     Trigger({"type": "interval", "index": MATCH}, "n_intervals"),
     prevent_initial_call=True,
 )
-def construct_display_graph(n_clicks, analysis) -> FigureResampler:
+def construct_display_graph(n_clicks, analysis, session_id) -> FigureResampler:
     fig = FigureResampler(make_subplots(
-        rows=2, cols=2, horizontal_spacing=0.03,
+        rows=2, cols=1,
         row_heights=[5.0, 0.4],
         #shared_xaxes=True,
         #shared_yaxes=True
@@ -176,19 +229,17 @@ def construct_display_graph(n_clicks, analysis) -> FigureResampler:
         default_n_shown_samples=2_000,
         default_downsampler=MinMaxLTTB(parallel=True),
     )
-    data = online_data[analysis['index']]
+    data = session_store.get(session_id, analysis['index'])
+    if data is None:
+        # released or evicted (expired, session or store memory limit), the user loads again
+        return no_update, no_update
     print(analysis)
-    timestamps = pd.to_datetime(data["timestamp"], unit='s')
+    # datetime64/float64 numpy arrays straight from the Arrow buffers
+    timestamps, values = table_to_arrays(data)
     sigma = n_clicks * 1e-6
 
     # First graph (line plot)
-    fig.add_trace(go.Scatter(x=timestamps, y=data["data"], name="new", legend='legend1'), row=1, col=1)
-
-    # Second graph (spectrogram)
-    data_array = np.array(data["data"].to_numpy())
-    spec_data, freqs, times = get_spectrogram(data_array, fs=10)
-    fig.add_trace(go.Heatmap(z=spec_data, x=times, y=freqs, colorscale='Viridis', name="spect", legend='legend2'),
-                  row=1, col=2)
+    fig.add_trace(go.Scatter(name="new", legend='legend1'), hf_x=timestamps, hf_y=values, row=1, col=1)
 
     fig.update_layout(title=f"<b>{analysis['index']}</b>", title_x=0.5)
 
@@ -196,14 +247,44 @@ def construct_display_graph(n_clicks, analysis) -> FigureResampler:
 
 
 @app.callback(
-    Output({"type": "spectrogram", "index": MATCH}, "data"),
-    Input({"type": "dynamic-graph", "index": MATCH}, "data"),
+    Output({"type": "spectrogram-graph", "index": MATCH}, "figure"),
+    Output({"type": "spectrogram-view", "index": MATCH}, "data"),
+    Input({"type": "interval", "index": MATCH}, "n_intervals"),
+    Input({"type": "spectrogram-graph", "index": MATCH}, "relayoutData"),
+    State({"type": "spectrogram-graph", "index": MATCH}, "id"),
+    State({"type": "spectrogram-source", "index": MATCH}, "data"),
+    State({"type": "spectrogram-view", "index": MATCH}, "data"),
     prevent_initial_call=True,
 )
-def get_spectrogram(data, fs):
-    """Function to calculate spectrogram."""
-    f, t, Sxx = signal.spectrogram(data, fs, nperseg=256)
-    return 10 * np.log10(Sxx), f, t
+def update_spectrogram(_, relayout_data, graph_id, source, view):
+    # the spectrogram of the visible window, read from the tile pyramid at the level fitting the graph
+    uid = graph_id['index']
+    property_path = Path(source["path"])
+    start_dt, end_dt = datetime.fromisoformat(source["start"]), datetime.fromisoformat(source["end"])
+    x_view = (start_dt, end_dt)
+    y_view = None
+    if view is not None:
+        x_view = datetime.fromisoformat(view["x"][0]), datetime.fromisoformat(view["x"][1])
+        y_view = view["y"]
+    if ctx.triggered_id is not None and ctx.triggered_id["type"] == "spectrogram-graph":
+        x_range = relayout_range(relayout_data)
+        if relayout_data and relayout_data.get("yaxis.autorange"):
+            y_view = None
+        elif relayout_data and "yaxis.range[0]" in relayout_data:
+            y_view = relayout_data["yaxis.range[0]"], relayout_data["yaxis.range[1]"]
+        elif x_range is None:
+            return no_update, no_update
+        if x_range is not None:
+            # zoomed windows are clipped to the loaded range, autorange goes back to it
+            x_view = (max(x_range[0] or start_dt, start_dt), min(x_range[1] or end_dt, end_dt))
+    else:
+        x_view, y_view = (start_dt, end_dt), None
+
+    spec_data, freqs, times = spectrogram_window(property_path, *x_view, freq_range=y_view)
+    fig = go.Figure(go.Heatmap(z=spec_data, x=times, y=freqs, colorscale='Viridis', name="spect"))
+    # keeps the user's zoom while the tiles are replaced
+    fig.update_layout(title=f"<b>{uid}</b> spectrogram", title_x=0.5, uirevision=f"{uid}|{start_dt}|{end_dt}")
+    return fig, {"x": [x_view[0].isoformat(), x_view[1].isoformat()], "y": y_view}
 
 
 @app.callback(
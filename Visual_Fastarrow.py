@@ -1,21 +1,18 @@
+import datetime
 import os
 import time
-import pandas as pd
 import plotly.express as px
 import dash
 from dash import dcc
 from dash import html
+from dash import ctx
 import dash_bootstrap_components as dbc
 from plotly.subplots import make_subplots
 from dash.dependencies import Input, Output
 from dash_bootstrap_templates import load_figure_template
-import fastparquet
 
-
-def read_parquet_files(subfolder_path):
-    files = [f for f in os.listdir(subfolder_path) if f.endswith('.parquet')]
-    tables = [fastparquet.ParquetFile(os.path.join(subfolder_path, f)).to_pandas() for f in files]
-    return pd.concat(tables, ignore_index=True)
+from catalog import get_file_stats
+from downsampling import axis_datetime, downsample_window, relayout_range
 
 
 def get_dropdown_options(main_folders, sub_folders, subsub_folder):
@@ -34,48 +31,55 @@ def get_dropdown_options(main_folders, sub_folders, subsub_folder):
 
 
 def get_initial_date_range(main_folders, sub_folders, subsub_folder):
+    """
+    First and last timestamp of all properties below a location, taken from the timestamp
+    statistics of the parquet footers instead of decoding every file.
+    """
     subsubsubfolder_path = os.path.join(main_folders, sub_folders, subsub_folder)
-    files = [f for f in os.listdir(subsubsubfolder_path) if f.endswith('.parquet')]
-    if not files:
+    if not os.path.isdir(subsubsubfolder_path):
+        return None, None
+    files = [os.path.join(root, f) for root, dirs, names in os.walk(subsubsubfolder_path)
+             for f in names if f.endswith('.parquet')]
+    stats = [get_file_stats(f) for f in files]
+    stats = [s for s in stats if s is not None and s['min_ts'] is not None]
+    if not stats:
         return None, None
-    all_dates = []
-    for file in files:
-        file_path = os.path.join(subsubsubfolder_path, file)
-        df = fastparquet.ParquetFile(file_path).to_pandas()
-        all_dates.extend(df['timestamp'])
-    min_date = min(all_dates)
-    max_date = max(all_dates)
+    min_date = min(s['min_ts'] for s in stats)
+    max_date = max(s['max_ts'] for s in stats)
     return min_date, max_date
 
 
-def convert_timestamp(df):
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-    return df
-
+def get_date_picker_limits(main_folders, sub_folders, subsub_folders):
+    ranges = [get_initial_date_range(main_folders, sub_folders, subsub) for subsub in subsub_folders]
+    ranges = [r for r in ranges if r[0] is not None]
+    if not ranges:
+        return {}
+    return {
+        'min_date_allowed': datetime.datetime.fromtimestamp(min(r[0] for r in ranges)).date(),
+        'max_date_allowed': datetime.datetime.fromtimestamp(max(r[1] for r in ranges)).date(),
+    }
 
-def downsample_data(df, timestamp_col='timestamp', value_col='data'):
-    df_resampled = df.groupby(pd.Grouper(key=timestamp_col, freq='1D'))[value_col].mean().reset_index()
-    return df_resampled
 
-
-def update_line_plot(selected_subfolder, start_date, end_date, main_folders, sub_folders, subsub_folder):
+def update_line_plot(selected_subfolder, start_date, end_date, main_folders, sub_folders, subsub_folder,
+                     relayout_data=None):
     if selected_subfolder is None:
         return px.line()
 
-    subfolder_path = os.path.join(main_folders, sub_folders, subsub_folder, selected_subfolder)
-    df = read_parquet_files(subfolder_path)
+    # the zoomed window, otherwise the range of the date picker
+    x_range = relayout_range(relayout_data) if relayout_data else (None, None)
+    if x_range is None:
+        return dash.no_update
+    if x_range == (None, None):
+        x_range = (axis_datetime(start_date) if start_date else None, axis_datetime(end_date) if end_date else None)
 
-    df = convert_timestamp(df)
-    if start_date and end_date:
-        df = df[(df['timestamp'] >= start_date) & (df['timestamp'] <= end_date)]
-    elif start_date:
-        df = df[df['timestamp'] >= start_date]
-    elif end_date:
-        df = df[df['timestamp'] >= end_date]
-    df = downsample_data(df)
+    # resolution fitting the visible window and the graph width
+    subfolder_path = os.path.join(main_folders, sub_folders, subsub_folder, selected_subfolder)
+    df = downsample_window(subfolder_path, *x_range)
 
     fig = make_subplots(specs=[[{'secondary_y': True}]])
     fig.add_trace(px.line(df, x='timestamp', y='data').data[0])
+    # keeps the user's zoom while the data is replaced, a new date range resets it
+    fig.update_layout(uirevision=f'{subfolder_path}|{start_date}|{end_date}')
 
     return fig
 
@@ -91,7 +95,8 @@ def create_layout(main_folders, sub_folders, subsub_folders_1, sub_folders2, sub
                 display_format='YYYY-MM-DD',
                 start_date=None,
                 end_date=None,
-                style={'margin-bottom': '20px'}
+                style={'margin-bottom': '20px'},
+                **get_date_picker_limits(main_folders, sub_folders, [subsub_folders_1, subsub_folders_2])
             ),
             dbc.Row([
                 dbc.Col([
@@ -123,7 +128,8 @@ def create_layout(main_folders, sub_folders, subsub_folders_1, sub_folders2, sub
                 display_format='YYYY-MM-DD',
                 start_date=None,
                 end_date=None,
-                style={'margin-bottom': '20px'}
+                style={'margin-bottom': '20px'},
+                **get_date_picker_limits(main_folders, sub_folders2, [subsub_folders_3, subsub_folders_4])
             ),
             dbc.Row([
                 dbc.Col([
@@ -168,11 +174,15 @@ app.layout = create_layout(main_folder, sub_folder, subsub_folder_1, sub_folder2
 @app.callback(Output('line-plot-1', 'figure'),
               [Input('subfolder-dropdown', 'value'),
                Input('date1', 'start_date'),
-               Input('date1', 'end_date')])
-def update_graph_1(selected_subfolder, start_date, end_date):
+               Input('date1', 'end_date'),
+               Input('line-plot-1', 'relayoutData')])
+def update_graph_1(selected_subfolder, start_date, end_date, relayout_data):
+    # a new property or date range starts unzoomed, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-1':
+        relayout_data = None
     # Track time taken for execution
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, start_date, end_date, main_folder, sub_folder, subsub_folder_1)
+    fig = update_line_plot(selected_subfolder, start_date, end_date, main_folder, sub_folder, subsub_folder_1, relayout_data)
     end = time.perf_counter()
     print(f'Update Graph1 Plot Function Completed in {round(end - start, 2)} seconds')
     return fig
@@ -181,11 +191,15 @@ def update_graph_1(selected_subfolder, start_date, end_date):
 @app.callback(Output('line-plot-2', 'figure'),
               [Input('subfolder-dropdown-2', 'value'),
                Input('date1', 'start_date'),
-               Input('date1', 'end_date')])
-def update_graph_2(selected_subfolder, start_date, end_date):
+               Input('date1', 'end_date'),
+               Input('line-plot-2', 'relayoutData')])
+def update_graph_2(selected_subfolder, start_date, end_date, relayout_data):
+    # a new property or date range starts unzoomed, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-2':
+        relayout_data = None
     # Track time taken for execution
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, start_date, end_date, main_folder, sub_folder, subsub_folder_2)
+    fig = update_line_plot(selected_subfolder, start_date, end_date, main_folder, sub_folder, subsub_folder_2, relayout_data)
     end = time.perf_counter()
     print(f'Update Graph2 Plot Function Completed in {round(end - start, 2)} seconds')
     return fig
@@ -194,11 +208,15 @@ def update_graph_2(selected_subfolder, start_date, end_date):
 @app.callback(Output('line-plot-3', 'figure'),
               [Input('subfolder-dropdown-3', 'value'),
                Input('date2', 'start_date'),
-               Input('date2', 'end_date')])
-def update_graph_3(selected_subfolder, start_date, end_date):
+               Input('date2', 'end_date'),
+               Input('line-plot-3', 'relayoutData')])
+def update_graph_3(selected_subfolder, start_date, end_date, relayout_data):
+    # a new property or date range starts unzoomed, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-3':
+        relayout_data = None
     # Track time taken for execution
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, start_date, end_date, main_folder, sub_folder2, subsub_folder_3)
+    fig = update_line_plot(selected_subfolder, start_date, end_date, main_folder, sub_folder2, subsub_folder_3, relayout_data)
     end = time.perf_counter()
     print(f'Update Graph3 Plot Function Completed in {round(end - start, 2)} seconds')
     return fig
@@ -207,11 +225,15 @@ def update_graph_3(selected_subfolder, start_date, end_date):
 @app.callback(Output('line-plot-4', 'figure'),
               [Input('subfolder-dropdown-4', 'value'),
                Input('date2', 'start_date'),
-               Input('date2', 'end_date')])
-def update_graph_4(selected_subfolder, start_date, end_date):
+               Input('date2', 'end_date'),
+               Input('line-plot-4', 'relayoutData')])
+def update_graph_4(selected_subfolder, start_date, end_date, relayout_data):
+    # a new property or date range starts unzoomed, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-4':
+        relayout_data = None
     # Track time taken for execution
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, start_date, end_date, main_folder, sub_folder2, subsub_folder_4)
+    fig = update_line_plot(selected_subfolder, start_date, end_date, main_folder, sub_folder2, subsub_folder_4, relayout_data)
     end = time.perf_counter()
     print(f'Update Graph4 Plot Function Completed in {round(end - start, 2)} seconds')
     return fig
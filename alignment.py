@@ -0,0 +1,163 @@
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+
+from data import duration_seconds, iter_parquet_data
+from downsampling import aggregate_chunks
+
+# grid spacing and as-of tolerance used when nothing else is given
+DEFAULT_EVERY = "10s"
+ALIGN_METHODS = ("asof", "bucket")
+
+
+def align_properties(property_path, start_dt, stop_dt, every=DEFAULT_EVERY, tolerance=None, method="asof",
+                     how="inner", dtype=np.float64, value_column="data"):
+    """
+    Parameters
+    ----------
+    property_path : [Path]
+        paths to doocs properties, every one becomes a column of the matrix
+    start_dt : datetime.datetime
+        first datetime
+    stop_dt : datetime.datetime
+        last datetime
+    every : str
+        spacing of the common time grid, e.g. "1s" or "1min". Grid points are multiples of it since the epoch.
+    tolerance : str, optional
+        "asof" only: how old the last sample before a grid point may be, defaults to `every`
+    method : str
+        "asof" takes the last sample at or before every grid point, "bucket" the mean of the samples
+        in [grid point, grid point + every)
+    how : str
+        "inner" keeps the grid points where all properties have a value, "outer" keeps all of them (NaN padded)
+    dtype : numpy dtype
+        np.float64 or np.float32 for the matrix
+
+    Returns
+    -------
+    dict
+        "timestamp" (datetime64[ns] grid points, naive UTC), "matrix" (grid points x properties) and
+        "properties" (the column order). The month files are streamed in record batches, only the
+        matrix is materialized.
+    """
+    if not isinstance(property_path, list):
+        property_path = [property_path]
+    columns = {p: iter_parquet_data(Path(p), start_dt, stop_dt, columns=[value_column]) for p in property_path}
+    grid = time_grid(datetime.timestamp(start_dt), datetime.timestamp(stop_dt), every)
+    return align_chunks(columns, grid, every, tolerance, method, how, dtype, value_column)
+
+
+def align_tables(tables, every=DEFAULT_EVERY, tolerance=None, method="asof", how="inner", dtype=np.float64,
+                 value_column="data", start_timestamp=None, stop_timestamp=None):
+    """
+    align_properties for data that is already loaded, e.g. the dictionary of load_parquet_data.
+    The grid covers start_timestamp to stop_timestamp (epoch seconds), by default the time span of all tables.
+    """
+    if start_timestamp is None or stop_timestamp is None:
+        bounds = [(t["timestamp"][0].as_py(), t["timestamp"][-1].as_py()) for t in tables.values() if len(t)]
+        if start_timestamp is None:
+            start_timestamp = min((b[0] for b in bounds), default=0.0)
+        if stop_timestamp is None:
+            stop_timestamp = max((b[1] for b in bounds), default=0.0)
+    columns = {p: t.to_batches() for p, t in tables.items()}
+    grid = time_grid(start_timestamp, stop_timestamp, every)
+    return align_chunks(columns, grid, every, tolerance, method, how, dtype, value_column)
+
+
+def time_grid(start_timestamp, stop_timestamp, every=DEFAULT_EVERY):
+    """int64 nanoseconds of the multiples of every between two epoch timestamps (both included)."""
+    every_ns = _duration_ns(every)
+    first = -(-int(start_timestamp * 1e9) // every_ns)
+    last = int(stop_timestamp * 1e9) // every_ns
+    return np.arange(first, last + 1, dtype=np.int64) * every_ns
+
+
+def align_chunks(columns, grid, every=DEFAULT_EVERY, tolerance=None, method="asof", how="inner", dtype=np.float64,
+                 value_column="data"):
+    """
+    The engine behind align_properties and align_tables.
+
+    Parameters
+    ----------
+    columns : dict
+        property -> iterable of record batches in timestamp order
+    grid : numpy.ndarray
+        int64 nanoseconds of the grid points, e.g. from time_grid
+    """
+    if method not in ALIGN_METHODS:
+        raise ValueError(f"unknown method {method!r}, use one of {ALIGN_METHODS}")
+    if how not in ("inner", "outer"):
+        raise ValueError(f"unknown how {how!r}, use 'inner' or 'outer'")
+
+    every_ns = _duration_ns(every)
+    tolerance_ns = _duration_ns(tolerance or every)
+    matrix = np.full((grid.size, len(columns)), np.nan, dtype=dtype)
+    for i, chunks in enumerate(columns.values()):
+        if method == "asof":
+            _fill_asof(matrix[:, i], grid, chunks, tolerance_ns, value_column)
+        else:
+            _fill_bucket(matrix[:, i], grid, chunks, every, every_ns, value_column)
+
+    if how == "inner":
+        complete = ~np.isnan(matrix).any(axis=1)
+        grid, matrix = grid[complete], matrix[complete]
+    return {"timestamp": grid.view("datetime64[ns]"), "matrix": matrix, "properties": list(columns)}
+
+
+def _duration_ns(every):
+    return int(duration_seconds(every)) * 1_000_000_000
+
+
+def _fill_asof(column, grid, chunks, tolerance_ns, value_column):
+    """
+    Last sample at or before every grid point. Every chunk fills the grid points from its first
+    sample up to (excluding) its last one, its last sample is carried over to the next chunk.
+    """
+    carry = None
+    for chunk in chunks:
+        ts, values = _chunk_arrays(chunk, value_column)
+        if ts.size == 0:
+            continue
+        if carry is not None and carry[0] <= ts[0]:
+            ts = np.concatenate(([carry[0]], ts))
+            values = np.concatenate(([carry[1]], values))
+        lo, hi = np.searchsorted(grid, [ts[0], ts[-1]])
+        points = grid[lo:hi]
+        index = np.searchsorted(ts, points, side="right") - 1
+        ok = points - ts[index] <= tolerance_ns
+        column[lo:hi][ok] = values[index[ok]]
+        carry = ts[-1], values[-1]
+
+    if carry is not None:
+        lo = np.searchsorted(grid, carry[0])
+        hi = np.searchsorted(grid, carry[0] + tolerance_ns, side="right")
+        column[lo:hi] = carry[1]
+
+
+def _fill_bucket(column, grid, chunks, every, every_ns, value_column):
+    if grid.size == 0:
+        return
+    binned = aggregate_chunks(((ts.view("datetime64[ns]"), values)
+                               for ts, values in (_chunk_arrays(c, value_column) for c in chunks)),
+                              every, aggregates=("mean",))
+    index = (binned["timestamp"].view(np.int64) - grid[0]) // every_ns
+    inside = (index >= 0) & (index < grid.size)
+    column[index[inside]] = binned["mean"][inside]
+
+
+def _chunk_arrays(chunk, value_column):
+    """Sorted int64 nanosecond timestamps and float values of a record batch without NaN values."""
+    ts = chunk.column("timestamp")
+    if pa.types.is_timestamp(ts.type):
+        ts = ts.cast(pa.timestamp("ns")).to_numpy().view(np.int64)
+    else:
+        ts = (ts.to_numpy() * 1e9).astype(np.int64)
+    values = chunk.column(value_column).to_numpy(zero_copy_only=False).astype(np.float64, copy=False)
+    valid = ~np.isnan(values)
+    if not valid.all():
+        ts, values = ts[valid], values[valid]
+    if ts.size > 1 and np.any(ts[1:] < ts[:-1]):
+        order = np.argsort(ts, kind="stable")
+        ts, values = ts[order], values[order]
+    return ts, values
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from catalog import CATALOG_MAX_AGE
+from data import get_doocs_properties, load_parquet_data, read_month_file
+from downsampling import DEFAULT_POINTS, downsample_window
+from rollups import DEFAULT_MIN_POINTS, load_rollup_data
+
+# threads running the blocking parquet / Arrow calls of all coroutines of the process
+DEFAULT_IO_WORKERS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The process wide executor for blocking reads, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_IO_WORKERS, thread_name_prefix="parquet-io")
+        return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Awaits func(*args, **kwargs) running on the I/O executor, the event loop is free meanwhile."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
+
+
+async def load_parquet_data_async(property_path, start_dt, stop_dt, timings=None, normalize=False):
+    """
+    Awaitable load_parquet_data. Every doocs property is read by its own executor task, so a
+    coroutine loading several properties overlaps their reads. The result is the dictionary
+    load_parquet_data returns.
+    """
+    if not isinstance(property_path, list):
+        property_path = [property_path]
+    results = await asyncio.gather(*(run_blocking(load_parquet_data, p, start_dt, stop_dt, timings=timings,
+                                                  normalize=normalize) for p in property_path))
+    parquet_data = {}
+    for result in results:
+        parquet_data.update(result)
+    return parquet_data
+
+
+async def read_month_file_async(file_path, start_timestamp=None, stop_timestamp=None, normalize=False):
+    """Awaitable read_month_file."""
+    return await run_blocking(read_month_file, file_path, start_timestamp, stop_timestamp, normalize)
+
+
+async def load_rollup_data_async(property_path, start_dt, stop_dt, min_points=DEFAULT_MIN_POINTS, level=None):
+    """Awaitable load_rollup_data, one executor task per doocs property."""
+    if not isinstance(property_path, list):
+        property_path = [property_path]
+    results = await asyncio.gather(*(run_blocking(load_rollup_data, p, start_dt, stop_dt, min_points=min_points,
+                                                  level=level) for p in property_path))
+    rollup_data = {}
+    for result in results:
+        rollup_data.update(result)
+    return rollup_data
+
+
+async def downsample_window_async(property_path, start_dt=None, stop_dt=None, points=DEFAULT_POINTS):
+    """Awaitable downsampling.downsample_window."""
+    return await run_blocking(downsample_window, property_path, start_dt, stop_dt, points)
+
+
+async def get_doocs_properties_async(base_path, catalog_path=None, max_age=CATALOG_MAX_AGE):
+    """Awaitable get_doocs_properties, the archive scan of a stale catalog runs on the executor."""
+    return await run_blocking(get_doocs_properties, base_path, catalog_path=catalog_path, max_age=max_age)
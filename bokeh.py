@@ -4,7 +4,9 @@ from bokeh.io import curdoc
 from bokeh.layouts import column
 from bokeh.models import ColumnDataSource, Select
 from bokeh.plotting import figure
-from datetime import datetime
+import pyarrow as pa
+
+from data import local_time, read_month_file
 
 # main folder and subfolders path
 main_folder = "XFEL.SYNC"
@@ -14,22 +16,20 @@ subfolders = {
 }
 
 
-# load data from parquet files
+# load data from parquet files, with the timestamps converted to local time
 def load_data(subsubfolder):
-    data = pd.DataFrame(columns=["timestamp", "data"])
+    tables = []
     for root, dirs, files in os.walk(subsubfolder):
         for file in files:
             if file.endswith(".parquet"):
-                df = pd.read_parquet(str(os.path.join(root, file)))
-                data = pd.concat([data, df], ignore_index=True)
+                tables.append(read_month_file(os.path.join(root, file), normalize=True))
+    if not tables:
+        return pd.DataFrame(columns=["timestamp", "data"])
+    data = pa.concat_tables(tables).to_pandas()
+    data['timestamp'] = local_time(data['timestamp'])
     return data
 
 
-# convert timestamp to datetime
-def convert_timestamp(timestamp):
-    return datetime.fromtimestamp(timestamp / 1000)
-
-
 # Create ColumnDataSource
 source = ColumnDataSource(data=dict(timestamp=[], data=[]))
 
@@ -55,22 +55,18 @@ def update_data():
 
     if selected_ml01 != "Select ML01 folder":
         data_ml01 = load_data(selected_ml01)
-        data_ml01["timestamp"] = data_ml01["timestamp"].apply(convert_timestamp)
         plot_ml01.line(x="timestamp", y="data", source=ColumnDataSource(data_ml01))
 
     if selected_sl01 != "Select SL01 folder":
         data_sl01 = load_data(selected_sl01)
-        data_sl01["timestamp"] = data_sl01["timestamp"].apply(convert_timestamp)
         plot_sl01.line(x="timestamp", y="data", source=ColumnDataSource(data_sl01))
 
     if selected_actu != "Select Actuator folder":
         data_actu = load_data(selected_actu)
-        data_actu["timestamp"] = data_actu["timestamp"].apply(convert_timestamp)
         plot_actu.line(x="timestamp", y="data", source=ColumnDataSource(data_actu))
 
     if selected_cont != "Select Controller folder":
         data_cont = load_data(selected_cont)
-        data_cont["timestamp"] = data_cont["timestamp"].apply(convert_timestamp)
         plot_cont.line(x="timestamp", y="data", source=ColumnDataSource(data_cont))
 
 
@@ -0,0 +1,315 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from pathlib import Path
+import pyarrow.compute as pc
+from pyarrow import parquet as pq
+
+CATALOG_VERSION = 3
+# a catalog younger than this (in seconds) is used without looking at the archive at all
+CATALOG_MAX_AGE = 60
+CATALOG_DIR = Path.home().joinpath(".cache", "xfel_sync")
+MONTH_FILE_PATTERN = re.compile(r"(\d{4}-\d{2})\.parquet")
+
+
+def default_catalog_path(base_path):
+    """
+    The catalog is kept on the local disk, the archive itself may be a read only network share.
+    """
+    digest = hashlib.sha1(str(Path(base_path).resolve()).encode()).hexdigest()[:16]
+    return CATALOG_DIR.joinpath(f"catalog-{digest}.json")
+
+
+def load_catalog(base_path, catalog_path=None, max_age=CATALOG_MAX_AGE):
+    """
+    Parameters
+    ----------
+    base_path : Path
+        directory containing the facility directories (e.g. the parent of XFEL.SYNC)
+    catalog_path : Path, optional
+        location of the catalog file, defaults to a file in ~/.cache/xfel_sync
+    max_age : float
+        catalogs refreshed less than max_age seconds ago are returned as they are,
+        older ones are refreshed incrementally and written back
+
+    Returns
+    -------
+    dict
+        the property catalog, see build_catalog
+    """
+    base_path = Path(base_path)
+    catalog_path = Path(catalog_path) if catalog_path else default_catalog_path(base_path)
+
+    catalog = _read_catalog(catalog_path, base_path)
+    if catalog is not None and time.time() - catalog["refreshed"] < max_age:
+        return catalog
+
+    catalog = refresh_catalog(catalog, base_path)
+    save_catalog(catalog, catalog_path)
+    return catalog
+
+
+def build_catalog(base_path):
+    """
+    Full scan of the archive.
+
+    Returns
+    -------
+    dict
+        "properties" maps every doocs property path to its fac/dev/loc/prop names and its
+        available months. Every "YYYY-MM" entry holds the file size and mtime plus the
+        timestamp statistics of read_file_stats. "dirs" keeps the mtime and the sub
+        directories of every scanned directory for the incremental refresh.
+    """
+    return refresh_catalog(None, base_path)
+
+
+def refresh_catalog(catalog, base_path):
+    """
+    Brings the catalog up to date. Only directories whose mtime changed since the last scan
+    are listed again, for all others the stored content is reused. The newest month file of
+    every property is always checked again, since appending to it does not touch the
+    directory mtime.
+    """
+    base_path = Path(base_path)
+    old_dirs = catalog["dirs"] if catalog else {}
+    old_properties = catalog["properties"] if catalog else {}
+    dirs = {}
+    properties = {}
+
+    if base_path.is_dir():
+        for fac in _list_dir(base_path, old_dirs, dirs):
+            fac_path = base_path.joinpath(fac)
+            for dev in _list_dir(fac_path, old_dirs, dirs):
+                dev_path = fac_path.joinpath(dev)
+                for loc in _list_dir(dev_path, old_dirs, dirs):
+                    loc_path = dev_path.joinpath(loc)
+                    for prop in _list_dir(loc_path, old_dirs, dirs):
+                        prop_path = loc_path.joinpath(prop)
+                        entry = _scan_property(prop_path, old_properties.get(str(prop_path)))
+                        if entry is not None:
+                            entry.update(fac=fac, dev=dev, loc=loc, prop=prop)
+                            properties[str(prop_path)] = entry
+
+    return {
+        "version": CATALOG_VERSION,
+        "base_path": str(base_path),
+        "refreshed": time.time(),
+        "dirs": dirs,
+        "properties": properties,
+    }
+
+
+def save_catalog(catalog, catalog_path):
+    """
+    Writes the catalog atomically, a dashboard starting at the same time never sees half a file.
+    """
+    catalog_path = Path(catalog_path)
+    tmp_path = catalog_path.with_name(f"{catalog_path.name}.{os.getpid()}.tmp")
+    try:
+        catalog_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(catalog, f)
+        os.replace(tmp_path, catalog_path)
+    except OSError as e:
+        print(f"Could not write property catalog {catalog_path}: {e}")
+
+
+def catalog_properties(catalog):
+    """
+    Returns
+    -------
+    dict
+        doocs property path -> "fac/dev/loc/prop", the same mapping get_doocs_properties used to build
+    """
+    return {path: f"{e['fac']}/{e['dev']}/{e['loc']}/{e['prop']}" for path, e in catalog["properties"].items()}
+
+
+def _read_catalog(catalog_path, base_path):
+    try:
+        with open(catalog_path) as f:
+            catalog = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if catalog.get("version") != CATALOG_VERSION or catalog.get("base_path") != str(base_path):
+        return None
+    return catalog
+
+
+def _list_dir(path, old_dirs, dirs):
+    """Sub directory names of path, the directory is only listed if its mtime changed."""
+    key = str(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    old = old_dirs.get(key)
+    if old is not None and old["mtime"] == mtime:
+        names = old["children"]
+    else:
+        with os.scandir(path) as it:
+            names = sorted(e.name for e in it if e.is_dir())
+    dirs[key] = {"mtime": mtime, "children": names}
+    return names
+
+
+def _stat_month(file_path, old_month=None):
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    if old_month is not None and (old_month["size"], old_month["mtime"]) == (st.st_size, st.st_mtime_ns):
+        return old_month
+    return {"size": st.st_size, "mtime": st.st_mtime_ns, **read_file_stats(file_path)}
+
+
+def _scan_property(prop_path, old_entry):
+    try:
+        mtime = os.stat(prop_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    if old_entry is not None and old_entry["mtime"] == mtime:
+        months = dict(old_entry["months"])
+        if months:
+            latest = max(months)
+            stat = _stat_month(prop_path.joinpath(f"{latest}.parquet"), months[latest])
+            if stat is None:
+                del months[latest]
+            else:
+                months[latest] = stat
+    else:
+        old_months = old_entry["months"] if old_entry else {}
+        months = {}
+        with os.scandir(prop_path) as it:
+            for e in it:
+                match = MONTH_FILE_PATTERN.fullmatch(e.name)
+                if match and e.is_file():
+                    stat = _stat_month(e.path, old_months.get(match.group(1)))
+                    if stat is not None:
+                        months[match.group(1)] = stat
+
+    return {"mtime": mtime, "months": dict(sorted(months.items()))}
+
+
+def read_file_stats(file_path):
+    """
+    Timestamp statistics of one month file, taken from the parquet footer. Only files written
+    without column statistics have their timestamp column read (once, the result ends up in
+    the catalog or in the get_file_stats cache).
+
+    Returns
+    -------
+    dict
+        "num_rows", "min_ts" and "max_ts" (epoch seconds, None for empty files) and "row_groups",
+        a [num_rows, min_ts, max_ts] list for every row group of the file. "row_groups" is empty
+        if the footer has no timestamp statistics.
+    """
+    metadata = pq.read_metadata(file_path)
+    column = metadata.schema.names.index("timestamp")
+
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        statistics = row_group.column(column).statistics
+        if row_group.num_rows == 0:
+            row_groups.append([0, None, None])
+        elif statistics is None or not statistics.has_min_max:
+            row_groups = []
+            break
+        else:
+            row_groups.append([row_group.num_rows, _as_epoch(statistics.min), _as_epoch(statistics.max)])
+
+    if row_groups or metadata.num_rows == 0:
+        bounds = [rg for rg in row_groups if rg[0] > 0]
+        min_ts = min((rg[1] for rg in bounds), default=None)
+        max_ts = max((rg[2] for rg in bounds), default=None)
+    else:
+        min_max = pc.min_max(pq.read_table(file_path, columns=["timestamp"])["timestamp"]).as_py()
+        min_ts, max_ts = _as_epoch(min_max["min"]), _as_epoch(min_max["max"])
+
+    return {
+        "num_rows": metadata.num_rows,
+        "min_ts": min_ts,
+        "max_ts": max_ts,
+        "row_groups": row_groups,
+    }
+
+
+_file_stats = {}
+_file_stats_lock = threading.Lock()
+
+
+def get_file_stats(file_path):
+    """
+    read_file_stats with an in-process cache keyed by path, size and mtime, so every footer is
+    read only once per process. Returns None if the file does not exist.
+    """
+    key = str(file_path)
+    with _file_stats_lock:
+        old_month = _file_stats.get(key)
+    month = _stat_month(file_path, old_month)
+    with _file_stats_lock:
+        if month is None:
+            _file_stats.pop(key, None)
+        else:
+            _file_stats[key] = month
+    return month
+
+
+def file_overlaps(stats, start_timestamp, stop_timestamp):
+    """True if the file described by stats (see read_file_stats) has rows in [start, stop]."""
+    if stats["min_ts"] is None:
+        return False
+    return stats["min_ts"] <= stop_timestamp and stats["max_ts"] >= start_timestamp
+
+
+def property_time_range(catalog, prop_path):
+    """
+    Returns
+    -------
+    tuple
+        (first, last) timestamp in epoch seconds of a property, (None, None) without data
+    """
+    months = catalog["properties"].get(str(prop_path), {}).get("months", {}).values()
+    months = [m for m in months if m["min_ts"] is not None]
+    if not months:
+        return None, None
+    return min(m["min_ts"] for m in months), max(m["max_ts"] for m in months)
+
+
+def source_metadata(month_file):
+    """
+    Size and mtime of a month file as parquet schema metadata. Files derived from a month file
+    (rollups, spectrogram tiles) store it, see is_fresh.
+    """
+    st = os.stat(month_file)
+    return {b"source_size": str(st.st_size).encode(), b"source_mtime": str(st.st_mtime_ns).encode()}
+
+
+def is_fresh(metadata, source):
+    """True if the metadata of a derived file was written for the current month file (source_metadata)."""
+    return all(metadata.get(k) == v for k, v in source.items())
+
+
+def _as_epoch(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+if __name__ == "__main__":
+    # python catalog.py <archive base path> [catalog file]
+    base_path = Path(sys.argv[1])
+    catalog_path = sys.argv[2] if len(sys.argv) > 2 else default_catalog_path(base_path)
+    start = time.perf_counter()
+    catalog = load_catalog(base_path, catalog_path=catalog_path, max_age=0)
+    print(f"{len(catalog['properties'])} properties in {catalog_path}, "
+          f"refreshed in {round(time.perf_counter() - start, 2)} seconds")
@@ -0,0 +1,153 @@
+"""Rewrites the YYYY-MM.parquet month files of the archive for fast filtered reads.
+
+Every file is sorted by timestamp and written with row groups of a fixed number of rows,
+column statistics and a page index, so the timestamp filters of load_parquet_data skip
+everything outside the requested range. Optionally zstd compression, float32 storage of
+the data column and a dictionary encoded bunchID are applied. The readers cast a float32 data
+column back to float64 (see data.standard_types), so compacted and current months load together.
+
+    python compact_parquet.py <archive base path or property directory> [options]
+"""
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import parquet as pq
+
+from catalog import MONTH_FILE_PATTERN
+
+DEFAULT_ROW_GROUP_ROWS = 128 * 1024
+DEFAULT_COMPRESSION = "zstd"
+
+
+def compact_file(file_path, row_group_rows=DEFAULT_ROW_GROUP_ROWS, compression=DEFAULT_COMPRESSION,
+                 compression_level=None, float32=False, dictionary_bunchid=True, dry_run=False):
+    """
+    Parameters
+    ----------
+    file_path : Path
+        a YYYY-MM.parquet month file
+    row_group_rows : int
+        rows per row group
+    compression : str
+        parquet codec, e.g. "zstd", "snappy" or "none"
+    compression_level : int, optional
+        codec level, the codec default if not given
+    float32 : bool
+        store the data column as float32
+    dictionary_bunchid : bool
+        dictionary encode the bunchID column
+    dry_run : bool
+        write and verify the compacted file but keep the original
+
+    Returns
+    -------
+    dict
+        rows, file sizes and read times (full read and a one day filtered read) before and after
+    """
+    file_path = Path(file_path)
+    tmp_path = file_path.with_name(f"{file_path.name}.{os.getpid()}.compact")
+
+    old_size = file_path.stat().st_size
+    old_read, old_filtered_read, table = _time_reads(file_path)
+
+    if len(table) > 1 and not pc.all(pc.greater_equal(table["timestamp"][1:], table["timestamp"][:-1])).as_py():
+        table = table.take(pc.sort_indices(table["timestamp"]))
+    if float32 and "data" in table.column_names and pa.types.is_float64(table.schema.field("data").type):
+        table = table.set_column(table.column_names.index("data"), "data", table["data"].cast(pa.float32()))
+
+    try:
+        pq.write_table(
+            table, tmp_path,
+            row_group_size=row_group_rows,
+            compression=compression,
+            compression_level=compression_level,
+            use_dictionary=["bunchID"] if dictionary_bunchid and "bunchID" in table.column_names else False,
+            write_statistics=True,
+            write_page_index=True,
+        )
+        written_rows = pq.read_metadata(tmp_path).num_rows
+        if written_rows != table.num_rows:
+            raise RuntimeError(f"{file_path}: wrote {written_rows} rows, expected {table.num_rows}")
+        new_size = tmp_path.stat().st_size
+        new_read, new_filtered_read, _ = _time_reads(tmp_path)
+        if not dry_run:
+            os.replace(tmp_path, file_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    return {
+        "file": str(file_path),
+        "rows": table.num_rows,
+        "old_size": old_size,
+        "new_size": new_size,
+        "old_read": old_read,
+        "new_read": new_read,
+        "old_filtered_read": old_filtered_read,
+        "new_filtered_read": new_filtered_read,
+    }
+
+
+def month_files(path):
+    """All month files below path, which may be the archive base, any level below it or a month file."""
+    path = Path(path)
+    if path.is_file():
+        return [path]
+    return sorted(f for f in path.rglob("*.parquet") if MONTH_FILE_PATTERN.fullmatch(f.name))
+
+
+def _time_reads(file_path):
+    """Full read and a read of the first day of the file through a timestamp filter."""
+    start = time.perf_counter()
+    table = pq.read_table(file_path)
+    full_read = time.perf_counter() - start
+
+    filtered_read = 0.0
+    if len(table):
+        first = pc.min(table["timestamp"]).as_py()
+        start = time.perf_counter()
+        pq.read_table(file_path, filters=[("timestamp", ">=", first), ("timestamp", "<=", first + 86400)])
+        filtered_read = time.perf_counter() - start
+    return full_read, filtered_read, table
+
+
+def _format_report(report):
+    def gain(old, new):
+        return f"{round(old / new, 1)}x" if new > 0 else "-"
+
+    return (f"{report['file']}: {report['rows']} rows, "
+            f"{round(report['old_size'] / 1e6, 1)} -> {round(report['new_size'] / 1e6, 1)} MB, "
+            f"read {round(report['old_read'], 3)} -> {round(report['new_read'], 3)} s "
+            f"({gain(report['old_read'], report['new_read'])}), "
+            f"one day {round(report['old_filtered_read'], 3)} -> {round(report['new_filtered_read'], 3)} s "
+            f"({gain(report['old_filtered_read'], report['new_filtered_read'])})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="archive base path, a directory below it or a single month file")
+    parser.add_argument("--row-group-rows", type=int, default=DEFAULT_ROW_GROUP_ROWS)
+    parser.add_argument("--compression", default=DEFAULT_COMPRESSION)
+    parser.add_argument("--compression-level", type=int, default=None)
+    parser.add_argument("--float32", action="store_true", help="store the data column as float32")
+    parser.add_argument("--no-dictionary-bunchid", dest="dictionary_bunchid", action="store_false")
+    parser.add_argument("--dry-run", action="store_true", help="verify and report only, keep the original files")
+    args = parser.parse_args(argv)
+
+    old_total = new_total = 0
+    for file_path in month_files(args.path):
+        report = compact_file(file_path, row_group_rows=args.row_group_rows, compression=args.compression,
+                              compression_level=args.compression_level, float32=args.float32,
+                              dictionary_bunchid=args.dictionary_bunchid, dry_run=args.dry_run)
+        old_total += report["old_size"]
+        new_total += report["new_size"]
+        print(_format_report(report))
+    print(f"Total: {round(old_total / 1e6, 1)} -> {round(new_total / 1e6, 1)} MB")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,8 @@
-from data import get_doocs_properties, load_parquet_data
+from data import get_doocs_properties
+from shared_load import load_parquet_data_shared
+from online_correlation import correlate_tables
+from rollups import period_statistics
+from session_store import new_session_id, session_store
 from pathlib import Path
 from datetime import datetime
 from typing import List
@@ -22,12 +26,13 @@ from scipy import signal
 from plotly.subplots import make_subplots
 
 # Data
-online_data = {}
 doocs_properties = get_doocs_properties(Path("C:/Users/pmahad/PycharmProjects/pythonProject/Database"))
 app = DashProxy(__name__, transforms=[ServersideOutputTransform(), TriggerTransform()])
+# range of the loaded data, every callback of a click shares one load of it (see shared_load)
+start_dt, stop_dt = datetime(2023, 10, 15, 17, 30), datetime(2023, 11, 15, 17, 30)
 
 # Define your app layout
-app.layout = html.Div([
+layout = html.Div([
     dcc.Tabs(id="tabs", value='XTIN', children=[
         dcc.Tab(label='XTIN', value='XTIN'),
         dcc.Tab(label='XHEXP1', value='XHEXP1'),
@@ -47,6 +52,14 @@ app.layout = html.Div([
 ])
 
 
+def serve_layout():
+    # every page load gets a session id, the loaded data is kept per session in session_store
+    return html.Div([dcc.Store(id="session-id", data=new_session_id(), storage_type="session"), layout])
+
+
+app.layout = serve_layout
+
+
 @app.callback(
     Output('property-selecter', 'options'),
     Output('property-selecter1', 'options'),
@@ -86,9 +99,10 @@ def generate_dropdown_options(properties=None, properties1=None, properties2=Non
     State("property-selecter1", "value"),
     State("property-selecter2", "value"),
     State("container", "children"),
+    State("session-id", "data"),
     prevent_initial_call=True,
 )
-def add_graph_div(_, laser_files, link_files, climate_files, div_children: List[html.Div]):
+def add_graph_div(n_clicks, laser_files, link_files, climate_files, div_children: List[html.Div], session_id):
     selected_properties = []
     selected_properties.extend(laser_files if laser_files else [])
     selected_properties.extend(link_files if link_files else [])
@@ -98,13 +112,17 @@ def add_graph_div(_, laser_files, link_files, climate_files, div_children: List[
         raise PreventUpdate
 
     props = [Path(prop) for prop in selected_properties]
-    loaded_data = load_parquet_data(props, datetime(2023, 10, 15, 17, 30), datetime(2023, 11, 15, 17, 30))
+    # coalesced per click, see shared_load
+    loaded_data = load_parquet_data_shared(props, start_dt, stop_dt, request_id=n_clicks)
 
     # Clear previous graph divs
     div_children = []
 
     for key, item in loaded_data.items():
-        online_data[doocs_properties[str(key)]] = item
+        session_store.put(session_id, doocs_properties[str(key)], item,
+                          source=(str(key), start_dt.isoformat(), stop_dt.isoformat()))
+    # the graphs of the previous selection are gone from the container
+    session_store.retain(session_id, [doocs_properties[str(key)] for key in loaded_data])
 
     for dat in loaded_data:
         uid = doocs_properties[str(dat)]
@@ -138,11 +156,13 @@ def update_correlation_visualizations(n_clicks, laser_files, link_files, climate
         return html.Div(), html.Div()
 
     props = [Path(prop) for prop in selected_properties]
-    loaded_data = load_parquet_data(props, datetime(2023, 10, 15, 17, 30), datetime(2023, 11, 15, 17, 30))
-    combined_data = pd.concat([item.to_pandas().rename(columns={f"data": f"{doocs_properties[str(key)]}"}) for key, item in loaded_data.items()], axis=1)
-    combined_data.drop(columns=['timestamp', 'bunchID'], inplace=True, errors='ignore')
-    # Pandas correlation matrix
-    correlation_matrix = combined_data.corr()
+    # the tables of the graphs, read once per click for all callbacks (see shared_load)
+    loaded_data = load_parquet_data_shared(props, start_dt, stop_dt, request_id=n_clicks)
+    # the properties joined on a common 10s grid (last sample at most 10s old), not on row position
+    accumulator = correlate_tables(loaded_data, start_dt, stop_dt, every="10s")
+    names = [doocs_properties[str(key)] for key in props]
+    print(f"Correlation of {len(names)} properties over {accumulator.count} aligned grid points")
+    correlation_matrix = pd.DataFrame(accumulator.pearson(), index=names, columns=names)
 
     # correlation matrix map
     fig_heatmap = go.Figure(data=go.Heatmap(
@@ -204,29 +224,19 @@ def update_details(n_clicks, laser_files, link_files, climate_files):
         return html.Div()
 
     props = [Path(prop) for prop in selected_properties]
-    loaded_data = load_parquet_data(props, datetime(2023, 10, 15, 17, 30), datetime(2023, 11, 15, 17, 30))
-
-    all_stats = []  # Store statistics for all variables
-    all_names = []  # Store names of variables
-
-    for key, item in loaded_data.items():
-
-        item_df = item.to_pandas()
-        item_df.index = pd.to_datetime(item_df.index)
-        daily_data = item_df.groupby(item_df.index.date)
-
-        for date, group in daily_data:
-
-            mean_value = group['data'].mean()
-            min_value = group['data'].min()
-            max_value = group['data'].max()
-            std_dev = group['data'].std()  
-
-
-            all_stats.append([doocs_properties[str(key)], round(mean_value, 2), round(min_value, 2), round(max_value, 2), round(std_dev, 2)])
-            all_names.append(doocs_properties[str(key)])
-
-    df = pd.DataFrame(all_stats, columns=['File Name', 'Mean', 'Min', 'Max', 'Standard Deviation'])
+    # the tables of the graphs, read once per click for all callbacks (see shared_load)
+    loaded_data = load_parquet_data_shared(props, start_dt, stop_dt, request_id=n_clicks)
+    # daily statistics from the daily rollups, the partial days at the ends from the loaded tables
+    daily_stats = period_statistics(props, start_dt, stop_dt, period="1d", tables=loaded_data)
+
+    df = pd.DataFrame({
+        'File Name': [doocs_properties[str(key)] for key in daily_stats['property']],
+        'Date': daily_stats['timestamp'].dt.strftime('%Y-%m-%d'),
+        'Mean': daily_stats['data'].round(2),
+        'Min': daily_stats['min'].round(2),
+        'Max': daily_stats['max'].round(2),
+        'Standard Deviation': daily_stats['std'].round(2),
+    })
 
     # Convert DataFrame to DataTable
     datatable = dash_table.DataTable(
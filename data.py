@@ -1,12 +1,27 @@
 import polars as pl
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzlocal
+import pyarrow as pa
+import pyarrow.compute as pc
 from pyarrow import parquet as pq
 import numpy as np
+import pandas as pd
 
+from catalog import CATALOG_MAX_AGE, catalog_properties, file_overlaps, get_file_stats, load_catalog
+from table_cache import table_cache
 
-def load_parquet_data(property_path, start_dt, stop_dt):
+# worker threads used by the dashboards for the concurrent loading mode
+DEFAULT_MAX_WORKERS = 8
+# rows per record batch of iter_parquet_data
+DEFAULT_BATCH_ROWS = 64 * 1024
+
+
+def load_parquet_data(property_path, start_dt, stop_dt, max_workers=None, timings=None, normalize=False):
     """
     Parameters
     ----------
@@ -16,6 +31,13 @@ def load_parquet_data(property_path, start_dt, stop_dt):
         first datetime
     stop_dt : datetime.datetime
         last datetime
+    max_workers : int, optional
+        number of threads used to read the month files of all properties concurrently.
+        ``None`` or ``1`` reads the properties one after another.
+    timings : dict, optional
+        if given, it is filled with the loading time in seconds for every doocs property path
+    normalize : bool
+        return the timestamp column as datetime64[ns] instead of epoch seconds, see normalize_timestamps
 
     Returns
     -------
@@ -24,42 +46,456 @@ def load_parquet_data(property_path, start_dt, stop_dt):
     """
     start_timestamp = datetime.timestamp(start_dt)
     stop_timestamp = datetime.timestamp(stop_dt)
+    required_months = month_range(start_dt, stop_dt)
+
+    if not isinstance(property_path, list):
+        property_path = [property_path]
+
+    if max_workers is not None and max_workers > 1:
+        return _load_parquet_data_concurrent(property_path, required_months, start_timestamp, stop_timestamp,
+                                             max_workers, timings, normalize)
+
+    parquet_data = {}
+    for p in property_path:
+        tic = time.perf_counter()
+        batches = list(iter_parquet_data(p, start_dt, stop_dt, batch_rows=None, normalize=normalize))
+        if batches:
+            parquet_data[p] = pa.Table.from_batches(batches)
+        else:
+            parquet_data[p] = _empty_table(p, required_months, normalize)
+        if timings is not None:
+            timings[p] = time.perf_counter() - tic
+
+    return parquet_data
+
+
+def iter_parquet_data(property_path, start_dt, stop_dt, batch_rows=DEFAULT_BATCH_ROWS, columns=None, normalize=False):
+    """
+    Parameters
+    ----------
+    property_path : Path
+        path to a doocs property. That directory should contain the paruqet files
+    start_dt : datetime.datetime
+        first datetime
+    stop_dt : datetime.datetime
+        last datetime
+    batch_rows : int, optional
+        maximum number of rows per batch. Only one row group is decoded at a time, so memory use
+        does not grow with the length of the range. ``None`` yields whole months through the
+        shared table cache, which is what load_parquet_data uses.
+    columns : [str], optional
+        columns to read, "timestamp" is always included
+    normalize : bool
+        yield the timestamp column as datetime64[ns] instead of epoch seconds
+
+    Yields
+    ------
+    pyarrow.RecordBatch
+        the rows between start_dt and stop_dt in timestamp order
+    """
+    p = Path(property_path)
+    start_timestamp = datetime.timestamp(start_dt)
+    stop_timestamp = datetime.timestamp(stop_dt)
+    if columns is not None and "timestamp" not in columns:
+        columns = ["timestamp", *columns]
+
+    for file_path in _available_files(p, month_range(start_dt, stop_dt), start_timestamp, stop_timestamp):
+        if batch_rows is None or table_cache.contains(file_path):
+            table = read_month_file(file_path, start_timestamp, stop_timestamp, normalize)
+            if columns is not None:
+                table = table.select(columns)
+            yield from table.to_batches(max_chunksize=batch_rows)
+        else:
+            yield from _iter_month_batches(file_path, start_timestamp, stop_timestamp, batch_rows, columns, normalize)
+
+
+def _iter_month_batches(file_path, start_timestamp, stop_timestamp, batch_rows, columns, normalize):
+    """
+    Streams one month file row group by row group. Row groups outside of the range are
+    skipped with the footer statistics, the others are yielded in the order of their first
+    timestamp. Files whose row groups overlap in time (not written in timestamp order) can
+    only be ordered as a whole and are decoded completely.
+    """
+    row_groups = get_file_stats(file_path)["row_groups"]
+    selected = sorted((rg_min, i) for i, (num_rows, rg_min, rg_max) in enumerate(row_groups)
+                      if num_rows > 0 and rg_min <= stop_timestamp and rg_max >= start_timestamp)
+    ordered = all(row_groups[a][2] <= row_groups[b][1] for (_, a), (_, b) in zip(selected, selected[1:]))
+    if not row_groups or not ordered:
+        table = read_month_file(file_path, start_timestamp, stop_timestamp, normalize)
+        if columns is not None:
+            table = table.select(columns)
+        yield from table.to_batches(max_chunksize=batch_rows)
+        return
+
+    parquet_file = pq.ParquetFile(file_path)
+    for _, i in selected:
+        table = standard_types(parquet_file.read_row_group(i, columns=columns))
+        table = _sort_by_timestamp(_filter_range(table, start_timestamp, stop_timestamp))
+        if normalize:
+            table = normalize_timestamps(table)
+        yield from table.to_batches(max_chunksize=batch_rows)
 
+
+def month_range(start_dt, stop_dt):
+    """The "YYYY-MM" month files covering start_dt to stop_dt."""
     required_months = []
     tmp_dt = datetime(start_dt.year, start_dt.month, 1)
     while tmp_dt < stop_dt:
         file_path = tmp_dt.strftime("%Y-%m")
         required_months.append(file_path)
         tmp_dt += relativedelta(months=1)
+    return required_months
+
+
+def _available_files(p, required_months, start_timestamp, stop_timestamp):
+    """
+    Month files of a property holding rows between start and stop. Files outside of the range
+    are pruned with the timestamp statistics of their parquet footers, see catalog.get_file_stats.
+    """
+    available_files = []
+    for month in required_months:
+        file_path = p.joinpath(f"{month}.parquet")
+        stats = get_file_stats(file_path)
+        if stats is not None and file_overlaps(stats, start_timestamp, stop_timestamp):
+            available_files.append(file_path)
+    return available_files
+
+
+def _empty_table(p, required_months, normalize=False):
+    for month in required_months:
+        file_path = p.joinpath(f"{month}.parquet")
+        if file_path.is_file():
+            table = standard_types(pq.read_schema(file_path).empty_table())
+            return normalize_timestamps(table) if normalize else table
+    raise FileNotFoundError(f"no parquet files for {p} in {required_months}")
+
+
+def read_month_file(file_path, start_timestamp=None, stop_timestamp=None, normalize=False):
+    """
+    Parameters
+    ----------
+    file_path : Path
+        a YYYY-MM.parquet month file of a doocs property
+    start_timestamp : float, optional
+        first timestamp (epoch seconds)
+    stop_timestamp : float, optional
+        last timestamp (epoch seconds)
+    normalize : bool
+        return the timestamp column as datetime64[ns], see normalize_timestamps. The normalized
+        month is cached alongside the decoded one, so the conversion runs once per month file.
+
+    Returns
+    -------
+    pyarrow.Table
+        rows of the month file between start and stop in timestamp order. The decoded month
+        is served from the shared table cache, only new or changed files are read from disk.
+    """
+    if table_cache.max_bytes <= 0:
+        filters = []
+        if start_timestamp is not None:
+            filters.append(('timestamp', '>=', start_timestamp))
+        if stop_timestamp is not None:
+            filters.append(('timestamp', '<=', stop_timestamp))
+        table = _sort_by_timestamp(standard_types(pq.read_table(file_path, filters=filters or None)))
+        return normalize_timestamps(table) if normalize else table
+
+    table = table_cache.read(file_path, loader=_read_sorted)
+    result = table
+    if normalize:
+        result = table_cache.read(file_path, loader=lambda _: normalize_timestamps(table), variant="normalized")
+    if start_timestamp is None and stop_timestamp is None:
+        return result
+
+    # months lying completely inside the range are returned without copying
+    stats = get_file_stats(file_path)
+    after_start = start_timestamp is None or (stats["min_ts"] is not None and stats["min_ts"] >= start_timestamp)
+    before_stop = stop_timestamp is None or (stats["max_ts"] is not None and stats["max_ts"] <= stop_timestamp)
+    if after_start and before_stop:
+        return result
+    return result.filter(_range_mask(table, start_timestamp, stop_timestamp))
+
+
+def standard_types(table):
+    """
+    The table with a float32 data column (see compact_parquet --float32) cast to float64, so
+    compacted and not compacted month files of a property concatenate into one table.
+    """
+    index = table.schema.get_field_index("data")
+    if index < 0 or not pa.types.is_float32(table.schema.field(index).type):
+        return table
+    return table.set_column(index, "data", table["data"].cast(pa.float64()))
+
+
+def normalize_timestamps(table, column="timestamp"):
+    """
+    Parameters
+    ----------
+    table : pyarrow.Table
+        table with an epoch seconds column
+    column : str
+        name of the timestamp column
+
+    Returns
+    -------
+    pyarrow.Table
+        the table with the column converted to datetime64[ns] (naive UTC, like pd.to_datetime(unit='s'))
+        in one vectorized cast. Tables that are already normalized are returned as they are.
+    """
+    index = table.schema.get_field_index(column)
+    if pa.types.is_timestamp(table.schema.field(index).type):
+        return table
+    return table.set_column(index, column, pa.array(_epoch_to_datetime64(_contiguous(table[column]))))
+
+
+def local_time(timestamps):
+    """
+    Naive UTC datetime64 values (normalized timestamps) as naive local time, the time of the
+    datetime.fromtimestamp axes of the dashboards.
+    """
+    return pd.DatetimeIndex(timestamps).tz_localize("UTC").tz_convert(tzlocal()).tz_localize(None).to_numpy()
+
+
+def _epoch_to_datetime64(seconds):
+    x = np.empty(len(seconds), dtype="datetime64[ns]")
+    np.multiply(seconds, 1e9, out=x.view(np.int64), casting="unsafe")
+    return x
+
+
+def _filter_range(table, start_timestamp, stop_timestamp):
+    mask = _range_mask(table, start_timestamp, stop_timestamp)
+    return table if mask is None else table.filter(mask)
+
+
+def _range_mask(table, start_timestamp, stop_timestamp):
+    mask = None
+    if start_timestamp is not None:
+        mask = pc.greater_equal(table["timestamp"], start_timestamp)
+    if stop_timestamp is not None:
+        upper = pc.less_equal(table["timestamp"], stop_timestamp)
+        mask = upper if mask is None else pc.and_(mask, upper)
+    return mask
+
+
+def _read_sorted(file_path):
+    # one chunk per column, so table_to_arrays can hand the cached buffers over without a copy
+    return _sort_by_timestamp(standard_types(pq.read_table(file_path))).combine_chunks()
+
+
+def _sort_by_timestamp(table):
+    timestamps = table["timestamp"]
+    if len(timestamps) < 2 or pc.all(pc.greater_equal(timestamps[1:], timestamps[:-1])).as_py():
+        return table
+    return table.take(pc.sort_indices(timestamps))
+
+
+def _read_month_file(file_path, start_timestamp, stop_timestamp, normalize):
+    return read_month_file(file_path, start_timestamp, stop_timestamp, normalize), time.perf_counter()
+
+
+def _load_parquet_data_concurrent(property_path, required_months, start_timestamp, stop_timestamp, max_workers,
+                                  timings, normalize):
+    """
+    Submits one read per (property, month file) to a bounded thread pool, so the total
+    loading time is given by the slowest property and not by the sum of all of them.
+    """
+    tic = time.perf_counter()
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="parquet-loader") as executor:
+        for p in property_path:
+            available_files = _available_files(p, required_months, start_timestamp, stop_timestamp)
+            futures[p] = [executor.submit(_read_month_file, f, start_timestamp, stop_timestamp, normalize)
+                          for f in available_files]
+
+        parquet_data = {}
+        for p, month_futures in futures.items():
+            results = [f.result() for f in month_futures]
+            if results:
+                parquet_data[p] = pa.concat_tables([table for table, _ in results])
+            else:
+                parquet_data[p] = _empty_table(p, required_months, normalize)
+            if timings is not None:
+                timings[p] = max((done for _, done in results), default=tic) - tic
+
+    return parquet_data
+
+
+def load_downsampled_data(property_path, start_dt, stop_dt, every="6h", backend="pyarrow", timings=None):
+    """
+    Parameters
+    ----------
+    property_path : Path, [Path]
+        path to doocs property paths. That directory should contain the paruqet files
+    start_dt : datetime.datetime
+        first datetime
+    stop_dt : datetime.datetime
+        last datetime
+    every : str
+        bucket width, e.g. "1min", "10min", "6h" or "1d". Buckets are aligned to the epoch,
+        like a pd.Grouper on the converted timestamps.
+    backend : str
+        a key of DOWNSAMPLE_BACKENDS. "pyarrow" aggregates the (cached) decoded tables,
+        "polars" runs a lazy scan_parquet query with the timestamp filter and the column
+        projection pushed down into the scan, only the aggregated buckets are materialized.
+    timings : dict, optional
+        if given, it is filled with the time in seconds spent on every doocs property path
+
+    Returns
+    -------
+    dictionary
+        an Arrow table for every doocs property path with one row per non empty bucket: the
+        bucket start as "timestamp" (epoch seconds), "count", "min", "max", the mean as "data"
+        and the sample standard deviation "std".
+    """
+    width = duration_seconds(every)
+    downsample = DOWNSAMPLE_BACKENDS[backend]
+    start_timestamp = datetime.timestamp(start_dt)
+    stop_timestamp = datetime.timestamp(stop_dt)
+    required_months = month_range(start_dt, stop_dt)
 
     if not isinstance(property_path, list):
         property_path = [property_path]
 
-    parquet_data = {}
+    downsampled_data = {}
     for p in property_path:
-        parquet_files = [p.joinpath(f"{i}.parquet") for i in required_months]
-        available_files = [i for i in parquet_files if i.is_file()]
-        pq_dataset = pq.ParquetDataset(available_files, filters=[('timestamp', '>=', start_timestamp),
-                                                                 ('timestamp', '<=', stop_timestamp)])
+        tic = time.perf_counter()
+        available_files = _available_files(Path(p), required_months, start_timestamp, stop_timestamp)
+        downsampled_data[p] = downsample(available_files, start_timestamp, stop_timestamp, width)
+        if timings is not None:
+            timings[p] = time.perf_counter() - tic
 
-        parquet_data[p] = pq_dataset.read()
-    
-    return parquet_data
+    return downsampled_data
+
+
+def duration_seconds(every):
+    """Duration strings like "10min", "6h" or "1d" in seconds."""
+    match = re.fullmatch(r"(\d+)\s*(s|min|m|h|d|D|w)", str(every))
+    if match is None:
+        raise ValueError(f"unknown duration {every!r}")
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
 
 
-def get_doocs_properties(base_path):
-    properties2paths = {}
-    if base_path.is_dir():
-        for fac_path in base_path.iterdir():
-            fac = fac_path.name
-            for dev_path in fac_path.iterdir():
-                dev = dev_path.name
-                for loc_path in dev_path.iterdir():
-                    loc = loc_path.name
-                    for prop_path in loc_path.iterdir():
-                        prop = prop_path.name
-                        properties2paths[str(prop_path)] = f"{fac}/{dev}/{loc}/{prop}"
-    return properties2paths
+_DURATION_UNITS = {"s": 1, "m": 60, "min": 60, "h": 3600, "d": 86400, "D": 86400, "w": 7 * 86400}
+_DOWNSAMPLED_SCHEMA = pa.schema([("timestamp", pa.float64()), ("count", pa.int64()), ("min", pa.float64()),
+                                 ("max", pa.float64()), ("data", pa.float64()), ("std", pa.float64())])
+
+
+def _downsample_pyarrow(available_files, start_timestamp, stop_timestamp, width):
+    tables = [read_month_file(f, start_timestamp, stop_timestamp).select(["timestamp", "data"])
+              for f in available_files]
+    if not tables:
+        return _DOWNSAMPLED_SCHEMA.empty_table()
+    table = pa.concat_tables(tables)
+    bucket = pc.multiply(pc.floor(pc.divide(table["timestamp"], width)), width)
+    grouped = table.append_column("bucket", bucket).group_by("bucket").aggregate([
+        ("data", "count"),
+        ("data", "min"),
+        ("data", "max"),
+        ("data", "mean"),
+        ("data", "stddev", pc.VarianceOptions(ddof=1)),
+    ])
+    grouped = grouped.sort_by("bucket")
+    return pa.table([grouped["bucket"], grouped["data_count"], grouped["data_min"], grouped["data_max"],
+                     grouped["data_mean"], grouped["data_stddev"]], schema=_DOWNSAMPLED_SCHEMA)
+
+
+def _downsample_polars(available_files, start_timestamp, stop_timestamp, width):
+    if not available_files:
+        return _DOWNSAMPLED_SCHEMA.empty_table()
+    # one scan per month, the data column of compacted months may be stored as float32
+    query = (
+        pl.concat([pl.scan_parquet(str(f)).select([pl.col("timestamp"), pl.col("data").cast(pl.Float64)])
+                   for f in available_files])
+        .filter((pl.col("timestamp") >= start_timestamp) & (pl.col("timestamp") <= stop_timestamp))
+        .with_columns(((pl.col("timestamp") / width).floor() * width).alias("bucket"))
+        .group_by("bucket")
+        .agg([
+            pl.col("data").count().alias("count"),
+            pl.col("data").min().alias("min"),
+            pl.col("data").max().alias("max"),
+            pl.col("data").mean().alias("data"),
+            pl.col("data").std(ddof=1).alias("std"),
+        ])
+        .sort("bucket")
+        .rename({"bucket": "timestamp"})
+    )
+    return query.collect().to_arrow().cast(_DOWNSAMPLED_SCHEMA)
+
+
+# downsampling backends of load_downsampled_data, name -> function(files, start, stop, width)
+DOWNSAMPLE_BACKENDS = {
+    "pyarrow": _downsample_pyarrow,
+    "polars": _downsample_polars,
+}
+
+
+def table_to_arrays(table, value_column="data", timestamp_column="timestamp", dtype=np.float64):
+    """
+    Parameters
+    ----------
+    table : pyarrow.Table
+        data of one doocs property, as returned by load_parquet_data
+    value_column : str
+        column for the y values
+    timestamp_column : str
+        column with the epoch seconds
+    dtype : numpy dtype
+        np.float64 or np.float32 for the y values
+
+    Returns
+    -------
+    tuple
+        (x, y) contiguous numpy arrays, x as datetime64[ns], ready for FigureResampler.add_trace(hf_x=x, hf_y=y).
+        Single chunk columns without nulls are handed over from the Arrow buffers without a copy,
+        the timestamps take one vectorized cast and no Python objects are created.
+    """
+    y = _contiguous(table[value_column])
+    if y.dtype != dtype:
+        y = y.astype(dtype)
+
+    timestamps = table[timestamp_column]
+    if pa.types.is_timestamp(timestamps.type):
+        return _contiguous(timestamps.cast(pa.timestamp("ns"))), y
+    return _epoch_to_datetime64(_contiguous(timestamps)), y
+
+
+def load_trace_arrays(property_path, start_dt, stop_dt, dtype=np.float64, max_workers=None):
+    """
+    load_parquet_data with table_to_arrays applied to every property.
+
+    Returns
+    -------
+    dictionary
+        (x, y) numpy arrays for every doocs property path
+    """
+    loaded_data = load_parquet_data(property_path, start_dt, stop_dt, max_workers=max_workers)
+    return {p: table_to_arrays(table, dtype=dtype) for p, table in loaded_data.items()}
+
+
+def _contiguous(column):
+    """One numpy array for a (chunked) Arrow column, zero copy if it is a single chunk without nulls."""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    return column.to_numpy(zero_copy_only=False)
+
+
+def get_doocs_properties(base_path, catalog_path=None, max_age=CATALOG_MAX_AGE):
+    """
+    Parameters
+    ----------
+    base_path : Path
+        directory containing the facility directories (e.g. the parent of XFEL.SYNC)
+    catalog_path : Path, optional
+        location of the persistent property catalog, see catalog.load_catalog
+    max_age : float
+        seconds a catalog is used without checking the archive for changes
+
+    Returns
+    -------
+    dict
+        doocs property path -> "fac/dev/loc/prop"
+    """
+    catalog = load_catalog(base_path, catalog_path=catalog_path, max_age=max_age)
+    return catalog_properties(catalog)
 
 
 if __name__ == "__main__":
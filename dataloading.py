@@ -1,18 +1,23 @@
 import datetime
 import os
 import time
-import pandas as pd
 import plotly.graph_objects as go
 import dash
 from dateutil.relativedelta import relativedelta
 from dash import dcc
 from dash import html
+from dash import ctx
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output
 from dash_bootstrap_templates import load_figure_template
-import pyarrow.parquet as pq
+import pyarrow as pa
 from pathlib import Path
 
+from async_data import downsample_window_async, load_rollup_data_async
+from data import normalize_timestamps, read_month_file
+from downsampling import DEFAULT_POINTS, relayout_range
+from rollups import ROLLUP_LEVELS
+
 
 def load_parquet_data(property_path, start_dt=None, stop_dt=None):
     start_timestamp = datetime.datetime.timestamp(start_dt) if start_dt else None
@@ -32,10 +37,7 @@ def load_parquet_data(property_path, start_dt=None, stop_dt=None):
     for p in property_path:
         parquet_files = [Path(p).joinpath(f"{i}.parquet") for i in required_months]
         available_files = [i for i in parquet_files if i.is_file()]
-        pq_dataset = pq.ParquetDataset(available_files, filters=[('timestamp', '>=', start_timestamp),
-                                                                 ('timestamp', '<=', stop_timestamp)])
-
-        pq_table = pq_dataset.read()
+        pq_table = pa.concat_tables([read_month_file(f, start_timestamp, stop_timestamp) for f in available_files])
         df = pq_table.to_pandas()
 
         parquet_data[str(p)] = df
@@ -58,33 +60,35 @@ def get_dropdown_options(main_folders, sub_folders, subsub_folder):
     return [{'label': folder, 'value': folder} for folder in subsubsubfolders]
 
 
-def convert_timestamp(df):
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-    return df
-
-
-def downsample_data(df, timestamp_col='timestamp', value_col='data'):
-    df_resampled = df.groupby(pd.Grouper(key=timestamp_col, freq='6h'))[value_col].mean().reset_index()
-    return df_resampled
-
-
-def update_line_plot(selected_subfolder, main_folders, sub_folders, subsub_folder, start_dt, stop_dt):
+async def update_line_plot(selected_subfolder, main_folders, sub_folders, subsub_folder, start_dt, stop_dt,
+                           relayout_data=None):
     if selected_subfolder is None:
         return go.Figure()
+    x_range = relayout_range(relayout_data) if relayout_data else (None, None)
+    if x_range is None:
+        return dash.no_update
+    if x_range != (None, None):
+        start_dt, stop_dt = x_range
     start = time.perf_counter()
     now = datetime.datetime.now().strftime("%H:%M:%S")
     print("Read Parquet started : ", now)
 
-    subfolder_path = os.path.join(main_folders, sub_folders, subsub_folder, selected_subfolder)
-    parquet_data = load_parquet_data(subfolder_path, start_dt, stop_dt)
-    df = parquet_data[selected_subfolder]  # Use selected_subfolder directly as the key
+    subfolder_path = Path(main_folders, sub_folders, subsub_folder, selected_subfolder)
+    # the reads run on the I/O executor of async_data, the event loop is free for other callbacks meanwhile
+    if (stop_dt - start_dt).total_seconds() / ROLLUP_LEVELS['1min'] >= DEFAULT_POINTS:
+        # precomputed rollup at the coarsest level that still gives enough points for the range
+        rollup_data = await load_rollup_data_async(subfolder_path, start_dt, stop_dt, min_points=DEFAULT_POINTS)
+        df = normalize_timestamps(rollup_data[subfolder_path]).to_pandas()
+    else:
+        # zoomed in below the finest rollup, the raw rows of the visible window
+        df = await downsample_window_async(subfolder_path, start_dt, stop_dt)
     now = datetime.datetime.now().strftime("%H:%M:%S")
     print("Read Parquet completed at : ", now)
-    df = convert_timestamp(df)
-    df = downsample_data(df)
 
     fig = go.Figure()
     fig.add_trace(go.Scatter(x=df['timestamp'], y=df['data'], mode='lines'))
+    # keeps the user's zoom while the data is replaced
+    fig.update_layout(uirevision=str(subfolder_path))
     end = time.perf_counter()
     print(f'Update Line Plot Function Completed in {round(end - start, 2)} seconds')
 
@@ -163,14 +167,19 @@ app.layout = create_layout(main_folder, sub_folder, subsub_folder_1, sub_folder2
 
 
 @app.callback(Output('line-plot-1', 'figure'),
-              [Input('subfolder-dropdown', 'value')])
-def update_graph_1(selected_subfolder):
+              [Input('subfolder-dropdown', 'value'),
+               Input('line-plot-1', 'relayoutData')])
+async def update_graph_1(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-1':
+        relayout_data = None
     start = time.perf_counter()
 
     start_dt = datetime.datetime(2023, 1, 1)
     stop_dt = datetime.datetime(2023, 12, 31)
 
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1, start_dt, stop_dt)
+    fig = await update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1, start_dt, stop_dt,
+                                 relayout_data)
 
     end = time.perf_counter()
     print(f'Update Graph1 Plot Function Completed in {round(end - start, 2)} seconds')
@@ -179,14 +188,19 @@ def update_graph_1(selected_subfolder):
 
 
 @app.callback(Output('line-plot-2', 'figure'),
-              [Input('subfolder-dropdown-2', 'value')])
-def update_graph_2(selected_subfolder):
+              [Input('subfolder-dropdown-2', 'value'),
+               Input('line-plot-2', 'relayoutData')])
+async def update_graph_2(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-2':
+        relayout_data = None
     start = time.perf_counter()
 
     start_dt = datetime.datetime(2023, 1, 1)
     stop_dt = datetime.datetime(2023, 12, 31)
 
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2, start_dt, stop_dt)
+    fig = await update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2, start_dt, stop_dt,
+                                 relayout_data)
 
     end = time.perf_counter()
     print(f'Update Graph2 Plot Function Completed in {round(end - start, 2)} seconds')
@@ -195,14 +209,19 @@ def update_graph_2(selected_subfolder):
 
 
 @app.callback(Output('line-plot-3', 'figure'),
-              [Input('subfolder-dropdown-3', 'value')])
-def update_graph_3(selected_subfolder):
+              [Input('subfolder-dropdown-3', 'value'),
+               Input('line-plot-3', 'relayoutData')])
+async def update_graph_3(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-3':
+        relayout_data = None
     start = time.perf_counter()
 
     start_dt = datetime.datetime(2023, 1, 1)
     stop_dt = datetime.datetime(2023, 12, 31)
 
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3, start_dt, stop_dt)
+    fig = await update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3, start_dt, stop_dt,
+                                 relayout_data)
 
     end = time.perf_counter()
     print(f'Update Graph3 Plot Function Completed in {round(end - start, 2)} seconds')
@@ -211,14 +230,19 @@ def update_graph_3(selected_subfolder):
 
 
 @app.callback(Output('line-plot-4', 'figure'),
-              [Input('subfolder-dropdown-4', 'value')])
-def update_graph_4(selected_subfolder):
+              [Input('subfolder-dropdown-4', 'value'),
+               Input('line-plot-4', 'relayoutData')])
+async def update_graph_4(selected_subfolder, relayout_data):
+    # a newly selected property starts with its whole time range, zooming only reads the visible window
+    if ctx.triggered_id != 'line-plot-4':
+        relayout_data = None
     start = time.perf_counter()
 
     start_dt = datetime.datetime(2023, 1, 1)
     stop_dt = datetime.datetime(2023, 12, 31)
 
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4, start_dt, stop_dt)
+    fig = await update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4, start_dt, stop_dt,
+                                 relayout_data)
 
     end = time.perf_counter()
     print(f'Update Graph4 Plot Function Completed in {round(end - start, 2)} seconds')
@@ -227,4 +251,5 @@ def update_graph_4(selected_subfolder):
 
 
 if __name__ == '__main__':
-    app.run_server(debug=True)
+    # async callbacks need Dash >= 3.1 with the "async" extra, where app.run replaces app.run_server
+    app.run(debug=True)
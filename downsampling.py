@@ -0,0 +1,301 @@
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from catalog import get_file_stats
+from data import duration_seconds, iter_parquet_data
+
+# statistics aggregate_bins can compute, all of them in one pass over the sorted samples
+AGGREGATES = ("mean", "min", "max", "count", "first", "last")
+# points per graph for zoom-driven downsampling, about the pixel width of a dashboard graph
+DEFAULT_POINTS = 1000
+# bin widths downsample_window chooses from, fixed steps keep the bins stable while panning
+BIN_WIDTHS = ("1s", "2s", "5s", "10s", "30s", "1min", "2min", "5min", "10min", "30min", "1h", "2h", "3h", "6h",
+              "12h", "1d", "2d", "7d")
+
+
+def aggregate_bins(timestamps, values, every="6h", aggregates=AGGREGATES, fill_empty=False):
+    """
+    Parameters
+    ----------
+    timestamps : array-like
+        datetime64 values or epoch seconds
+    values : array-like
+        the samples, NaN values are ignored
+    every : str
+        bin width, e.g. "10min", "6h" or "1d". Bins are aligned to multiples of the width since the epoch
+        (for widths dividing a day the same bins as pd.Grouper).
+    aggregates : tuple
+        any of AGGREGATES
+    fill_empty : bool
+        return every bin from the first to the last timestamp, bins without a value with NaN (count 0),
+        like pd.Grouper
+
+    Returns
+    -------
+    dict
+        "timestamp" with the bin starts (same kind as the input timestamps) and a numpy array for every
+        aggregate. Bin indices come from the int64 nanoseconds with integer arithmetic and all aggregates
+        are reduceat kernels over the bin boundaries, no pandas groupby is built.
+    """
+    return _finish(_partial(timestamps, values, _width_ns(every)), aggregates, fill_empty,
+                   np.issubdtype(np.asarray(timestamps).dtype, np.datetime64))
+
+
+def aggregate_chunks(chunks, every="6h", aggregates=AGGREGATES, fill_empty=False, timestamp_column="timestamp",
+                     value_column="data"):
+    """
+    aggregate_bins over chunked input, e.g. the record batches of data.iter_parquet_data. Only the
+    partial aggregates of every chunk are kept, so memory does not grow with the number of samples.
+    Chunks must come in timestamp order (for "first" and "last").
+
+    Parameters
+    ----------
+    chunks : iterable
+        pyarrow RecordBatches / Tables, pandas DataFrames or (timestamps, values) tuples
+    """
+    width = _width_ns(every)
+    partials = []
+    is_datetime = False
+    for chunk in chunks:
+        if isinstance(chunk, tuple):
+            timestamps, values = chunk
+        elif isinstance(chunk, pd.DataFrame):
+            timestamps, values = chunk[timestamp_column].to_numpy(), chunk[value_column].to_numpy()
+        else:
+            timestamps = chunk.column(timestamp_column).to_numpy()
+            values = chunk.column(value_column).to_numpy()
+        timestamps = np.asarray(timestamps)
+        is_datetime = np.issubdtype(timestamps.dtype, np.datetime64)
+        partials.append(_partial(timestamps, values, width))
+    return _finish(_merge(partials), aggregates, fill_empty, is_datetime)
+
+
+def downsample_data(df, timestamp_col='timestamp', value_col='data', every='6h', aggregates=("mean",)):
+    """
+    Drop-in replacement of df.groupby(pd.Grouper(key=timestamp_col, freq=every))[value_col].mean().reset_index().
+    The mean ends up in value_col, further aggregates in columns of their own name.
+    """
+    result = aggregate_bins(df[timestamp_col].to_numpy(), df[value_col].to_numpy(), every, aggregates,
+                            fill_empty=True)
+    columns = {timestamp_col: result.pop("timestamp")}
+    if "mean" in result:
+        columns[value_col] = result.pop("mean")
+    columns.update(result)
+    return pd.DataFrame(columns)
+
+
+def downsample_window(property_path, start_dt=None, stop_dt=None, points=DEFAULT_POINTS):
+    """
+    Parameters
+    ----------
+    property_path : Path
+        path to a doocs property
+    start_dt : datetime.datetime, optional
+        first datetime of the visible window, the first sample of the property if not given
+    stop_dt : datetime.datetime, optional
+        last datetime of the visible window, the last sample of the property if not given
+    points : int
+        number of bins the window should be shown with, e.g. the graph width in pixels
+
+    Returns
+    -------
+    pandas.DataFrame
+        "timestamp" (datetime64[ns], naive UTC), the mean as "data" plus "min" and "max" of every bin.
+        Only the row groups overlapping the window are read, the bin width is the smallest of BIN_WIDTHS
+        giving at most `points` bins, so the result size depends on the graph, not on the archive.
+    """
+    if start_dt is None or stop_dt is None:
+        first, last = _property_span(property_path)
+        if first is None:
+            return downsample_data(pd.DataFrame({"timestamp": np.empty(0, "datetime64[ns]"), "data": []}),
+                                   aggregates=("mean", "min", "max"))
+        start_dt = start_dt or first
+        stop_dt = stop_dt or last
+    every = bin_width(start_dt, stop_dt, points)
+    batches = iter_parquet_data(property_path, start_dt, stop_dt, columns=["data"], normalize=True)
+    result = aggregate_chunks(batches, every, aggregates=("mean", "min", "max"), fill_empty=True)
+    result["timestamp"] = result["timestamp"].astype("datetime64[ns]")
+    result["data"] = result.pop("mean")
+    return pd.DataFrame(result)
+
+
+def bin_width(start_dt, stop_dt, points=DEFAULT_POINTS):
+    """The smallest of BIN_WIDTHS giving at most `points` bins between start_dt and stop_dt."""
+    span = datetime.timestamp(stop_dt) - datetime.timestamp(start_dt)
+    for every in BIN_WIDTHS:
+        if span / duration_seconds(every) <= points:
+            return every
+    return BIN_WIDTHS[-1]
+
+
+def relayout_range(relayout_data):
+    """
+    The visible x-range of a dcc.Graph from its relayoutData.
+
+    Returns
+    -------
+    tuple or None
+        (start, stop) as naive local datetimes like the rest of the loaders take them, after a zoom or pan.
+        (None, None) after an autorange (double click, reset axes) and None if the x-axis did not change.
+    """
+    if not relayout_data:
+        return None
+    if relayout_data.get("xaxis.autorange"):
+        return None, None
+    if "xaxis.range[0]" in relayout_data and "xaxis.range[1]" in relayout_data:
+        x_range = relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]
+    elif "xaxis.range" in relayout_data:
+        x_range = relayout_data["xaxis.range"]
+    else:
+        return None
+    return axis_datetime(x_range[0]), axis_datetime(x_range[1])
+
+
+def axis_datetime(value):
+    """
+    A date axis value (the graphs show normalized timestamps, i.e. naive UTC) as the naive local
+    datetime the loaders take.
+    """
+    return pd.Timestamp(value).tz_localize("UTC").to_pydatetime().astimezone().replace(tzinfo=None)
+
+
+def _property_span(property_path):
+    stats = [get_file_stats(f) for f in Path(property_path).glob("????-??.parquet")]
+    stats = [s for s in stats if s is not None and s["min_ts"] is not None]
+    if not stats:
+        return None, None
+    return (datetime.fromtimestamp(min(s["min_ts"] for s in stats)),
+            datetime.fromtimestamp(max(s["max_ts"] for s in stats)))
+
+
+def _width_ns(every):
+    return int(duration_seconds(every)) * 1_000_000_000
+
+
+def _partial(timestamps, values, width):
+    """Per bin sum, count, min, max, first and last of one chunk, bins in ascending order."""
+    timestamps = np.asarray(timestamps)
+    values = np.asarray(values, dtype=np.float64)
+    if not np.issubdtype(timestamps.dtype, np.datetime64):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        # a NaN anywhere makes the sum NaN, cheaper than a full isnan pass for the common case
+        if np.isnan(np.add.reduce(timestamps)):
+            valid = ~np.isnan(timestamps)
+            timestamps, values = timestamps[valid], values[valid]
+        ns = (timestamps * 1e9).astype(np.int64)
+    elif timestamps.dtype == np.dtype("datetime64[ns]"):
+        ns = timestamps.view(np.int64)
+    else:
+        ns = timestamps.astype("datetime64[ns]").view(np.int64)
+
+    # bins spanned by the timestamps, samples without a value still extend the filled range (as pd.Grouper)
+    span = (ns.min() // width, ns.max() // width) if ns.size else None
+    if np.isnan(np.add.reduce(values)):
+        valid = ~np.isnan(values)
+        ns, values = ns[valid], values[valid]
+    if ns.size == 0:
+        return _empty_partial(width, span)
+    if ns.size > 1 and np.any(ns[1:] < ns[:-1]):
+        order = np.argsort(ns, kind="stable")
+        ns, values = ns[order], values[order]
+
+    first_bin, last_bin = ns[0] // width, ns[-1] // width
+    if last_bin - first_bin < ns.size:
+        # sorted samples: the bin boundaries are a binary search away, no division per sample
+        bins = np.arange(first_bin, last_bin + 1)
+        starts = np.searchsorted(ns, bins * width)
+        ends = np.append(starts[1:], ns.size)
+        non_empty = ends > starts
+        bins, starts, ends = bins[non_empty], starts[non_empty], ends[non_empty]
+    else:
+        bins = ns // width
+        starts = _bin_starts(bins)
+        ends = np.append(starts[1:], bins.size)
+        bins = bins[starts]
+    return {
+        "bin": bins,
+        "sum": np.add.reduceat(values, starts),
+        "count": ends - starts,
+        "min": np.minimum.reduceat(values, starts),
+        "max": np.maximum.reduceat(values, starts),
+        "first": values[starts],
+        "last": values[ends - 1],
+        "width": width,
+        "span": span,
+    }
+
+
+def _merge(partials):
+    """Combines the partials of consecutive chunks, a bin may be split over two chunks."""
+    if not partials:
+        return _empty_partial(1)
+    width = partials[0]["width"]
+    spans = [p["span"] for p in partials if p["span"] is not None]
+    span = (min(lo for lo, _ in spans), max(hi for _, hi in spans)) if spans else None
+    merged = {k: np.concatenate([p[k] for p in partials]) for k in _PARTIAL_KEYS}
+    merged.update(width=width, span=span)
+    bins = merged["bin"]
+    if bins.size == 0:
+        return merged
+    starts = _bin_starts(bins)
+    if starts.size == bins.size:
+        return merged
+    ends = np.append(starts[1:], bins.size)
+    return {
+        "bin": bins[starts],
+        "sum": np.add.reduceat(merged["sum"], starts),
+        "count": np.add.reduceat(merged["count"], starts),
+        "min": np.minimum.reduceat(merged["min"], starts),
+        "max": np.maximum.reduceat(merged["max"], starts),
+        "first": merged["first"][starts],
+        "last": merged["last"][ends - 1],
+        "width": width,
+        "span": span,
+    }
+
+
+def _empty_partial(width, span=None):
+    empty = np.empty(0)
+    return {"bin": np.empty(0, dtype=np.int64), "sum": empty, "count": np.empty(0, dtype=np.int64), "min": empty,
+            "max": empty, "first": empty, "last": empty, "width": width, "span": span}
+
+
+def _bin_starts(bins):
+    return np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+
+
+_PARTIAL_KEYS = ("bin", "sum", "count", "min", "max", "first", "last")
+
+
+def _finish(partial, aggregates, fill_empty, is_datetime):
+    unknown = set(aggregates) - set(AGGREGATES)
+    if unknown:
+        raise ValueError(f"unknown aggregates {sorted(unknown)}, use any of {AGGREGATES}")
+
+    bins, width, count = partial["bin"], partial["width"], partial["count"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats = {
+            "mean": partial["sum"] / count,
+            "min": partial["min"],
+            "max": partial["max"],
+            "count": count,
+            "first": partial["first"],
+            "last": partial["last"],
+        }
+    stats = {name: stats[name] for name in aggregates}
+
+    span = partial["span"]
+    if fill_empty and span is not None:
+        index = bins - span[0]
+        dense = np.arange(span[0], span[1] + 1)
+        for name, values in stats.items():
+            filled = np.zeros(dense.size, dtype=np.int64) if name == "count" else np.full(dense.size, np.nan)
+            filled[index] = values
+            stats[name] = filled
+        bins = dense
+
+    starts = bins * width
+    timestamp = starts.astype("datetime64[ns]") if is_datetime else starts / 1e9
+    return {"timestamp": timestamp, **stats}
@@ -1,7 +1,13 @@
 import os
+import numpy as np
 import pandas as pd
 import holoviews as hv
-from datetime import datetime
+
+from data import local_time, read_month_file, table_to_arrays
+from rasterize import DEFAULT_HEIGHT, DEFAULT_WIDTH, rasterize
+
+# density images binned on the server instead of one scatter glyph per point
+RASTERIZE = True
 
 
 # Function to read parquet files from subsubsubfolders
@@ -14,9 +20,36 @@ def read_parquet_files(folder_path):
     return parquet_files
 
 
-# Function to convert timestamp to normal date time
-def convert_timestamp(timestamp):
-    return datetime.fromtimestamp(timestamp)
+def load_points(folder_path):
+    """x (local time datetime64, ascending) and y arrays of all parquet files below folder_path."""
+    xs, ys = [], []
+    for subfolder in os.listdir(folder_path):
+        for file in read_parquet_files(os.path.join(folder_path, subfolder)):
+            x, y = table_to_arrays(read_month_file(file, normalize=True))
+            xs.append(local_time(x))
+            ys.append(y)
+    x = np.concatenate(xs) if xs else np.empty(0, dtype="datetime64[ns]")
+    y = np.concatenate(ys) if ys else np.empty(0)
+    order = np.argsort(x, kind="stable")
+    return x[order], y[order]
+
+
+def density_plot(x, y, title):
+    """Points per pixel of the visible window, rasterized again on every zoom or pan (RangeXY stream)."""
+    def image(x_range, y_range):
+        raster = rasterize(x, y, DEFAULT_WIDTH, DEFAULT_HEIGHT, x_range, y_range, x_sorted=True)
+        return hv.Image((raster["x"], raster["y"], raster["counts"]), kdims=['timestamp', 'data'], vdims=['count'])
+
+    return hv.DynamicMap(image, streams=[hv.streams.RangeXY()]).opts(
+        hv.opts.Image(width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, cmap='fire', logz=True, colorbar=True,
+                      xlabel='Timestamp', ylabel='Data', title=title))
+
+
+def create_raster_dashboard():
+    # arrays of the two panels, the server keeps them to rasterize the zoomed windows
+    ml01_x, ml01_y = load_points(os.path.join("XFEL.SYNC", "LASER.LOCK.XLO", "XTIN.MLO1"))
+    sl01_x, sl01_y = load_points(os.path.join("XFEL.SYNC", "LASER.LOCK.XLO", "XHEXP1.SLO1"))
+    return (density_plot(ml01_x, ml01_y, 'ML01') + density_plot(sl01_x, sl01_y, 'SL01')).cols(1)
 
 
 # Main function to create dashboard
@@ -37,8 +70,8 @@ def create_dashboard():
         for subfolder in subsubsubfolders:
             parquet_files = read_parquet_files(os.path.join(main_folder, "LASER.LOCK.XLO", folder, subfolder))
             for file in parquet_files:
-                df = pd.read_parquet(str(file))
-                df['timestamp'] = df['timestamp'].apply(convert_timestamp)
+                df = read_month_file(file, normalize=True).to_pandas()
+                df['timestamp'] = local_time(df['timestamp'])
                 ml01_data.append(df)
 
     for folder in sl01_folders:
@@ -46,8 +79,8 @@ def create_dashboard():
         for subfolder in subsubsubfolders:
             parquet_files = read_parquet_files(os.path.join(main_folder, "LASER.LOCK.XLO", folder, subfolder))
             for file in parquet_files:
-                df = pd.read_parquet(str(file))
-                df['timestamp'] = df['timestamp'].apply(convert_timestamp)
+                df = read_month_file(file, normalize=True).to_pandas()
+                df['timestamp'] = local_time(df['timestamp'])
                 sl01_data.append(df)
 
     # Concatenate dataframes
@@ -67,11 +100,19 @@ def create_dashboard():
     return dashboard1
 
 
-# Execute create_dashboard() function and assign the result to a variable
-dashboard = create_dashboard()
-
-# Display the dashboard
-hv.extension('bokeh')
-hv.renderer('bokeh').theme = 'caliber'
-hv.save(dashboard, 'dashboard.html')
-hv.show(dashboard)
+if RASTERIZE:
+    hv.extension('bokeh')
+    hv.renderer('bokeh').theme = 'caliber'
+    dashboard = create_raster_dashboard()
+    # the saved file holds the initial images only, the bokeh server re-rasterizes on zoom
+    hv.save(dashboard, 'dashboard.html')
+    hv.renderer('bokeh').app(dashboard, show=True)
+else:
+    # Execute create_dashboard() function and assign the result to a variable
+    dashboard = create_dashboard()
+
+    # Display the dashboard
+    hv.extension('bokeh')
+    hv.renderer('bokeh').theme = 'caliber'
+    hv.save(dashboard, 'dashboard.html')
+    hv.show(dashboard)
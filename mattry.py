@@ -1,8 +1,5 @@
 import os
 import time
-import pandas as pd
-import matplotlib.pyplot as plt
-from io import BytesIO
 import base64
 import datetime
 import dash
@@ -10,12 +7,19 @@ from dash import dcc
 from dash import html
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output
+import pyarrow as pa
+
+from data import read_month_file
+from downsampling import downsample_data
+from renderer import data_version, renderer
+
+LINE_STYLE = {'xlabel': 'Timestamp', 'ylabel': 'Data', 'title': 'Line Plot'}
 
 
 def read_parquet_files(subfolder_path):
     files = [f for f in os.listdir(subfolder_path) if f.endswith('.parquet')]
-    tables = [pd.read_parquet(os.path.join(subfolder_path, f)) for f in files]
-    concatenated_df = pd.concat(tables)
+    tables = [read_month_file(os.path.join(subfolder_path, f), normalize=True) for f in files]
+    concatenated_df = pa.concat_tables(tables).to_pandas()
     return concatenated_df
 
 
@@ -34,40 +38,27 @@ def get_dropdown_options(main_folders, sub_folders, subsub_folder):
     return [{'label': folder, 'value': folder} for folder in subsubsubfolders]
 
 
-def convert_timestamp(df):
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-    return df
-
-
-def downsample_data(df, timestamp_col='timestamp', value_col='data'):
-    df_resampled = df.groupby(pd.Grouper(key=timestamp_col, freq='6h'))[value_col].mean().reset_index()
-    return df_resampled
-
-
 def update_line_plot(selected_subfolder, main_folders, sub_folders, subsub_folder):
     if selected_subfolder is None:
         return None
 
     start = time.perf_counter()
-    print("Read Parquet started : ", datetime.datetime.now().strftime("%H:%M:%S"))
-
     subfolder_path = os.path.join(main_folders, sub_folders, subsub_folder, selected_subfolder)
-    df = read_parquet_files(subfolder_path)
-    print("Read Parquet completed at : ", datetime.datetime.now().strftime("%H:%M:%S"))
 
-    df = convert_timestamp(df)
-    df = downsample_data(df)
+    def load():
+        print("Read Parquet started : ", datetime.datetime.now().strftime("%H:%M:%S"))
+        df = read_parquet_files(subfolder_path)
+        print("Read Parquet completed at : ", datetime.datetime.now().strftime("%H:%M:%S"))
+        df = downsample_data(df)
+        return df['timestamp'].to_numpy(), df['data'].to_numpy()
 
-    fig, ax = plt.subplots()
-    ax.plot(df['timestamp'], df['data'])
-    ax.set_xlabel('Timestamp')
-    ax.set_ylabel('Data')
-    ax.set_title('Line Plot')
+    # rendered by the Agg worker processes, or served from the image cache while the month files are unchanged
+    image = renderer.render_line((subfolder_path, data_version(subfolder_path)), load, style=LINE_STYLE)
 
     end = time.perf_counter()
     print(f'Update Line Plot Function Completed in {round(end - start, 2)} seconds')
 
-    return fig
+    return image
 
 
 def create_layout(main_folders, sub_folders, subsub_folders_1, sub_folders2, subsub_folders_2, subsub_folders_3,
@@ -127,10 +118,8 @@ def create_layout(main_folders, sub_folders, subsub_folders_1, sub_folders2, sub
     ], style={'width': '80%', 'margin': 'auto', 'display': 'block'})
 
 
-def encode_image(fig):
-    img = BytesIO()
-    fig.savefig(img, format='png')
-    encoded_img = base64.b64encode(img.getvalue()).decode('utf-8')
+def encode_image(image):
+    encoded_img = base64.b64encode(image).decode('utf-8')
     return encoded_img
 
 
@@ -150,9 +139,9 @@ app.layout = create_layout(main_folder, sub_folder, subsub_folder_1, sub_folder2
 @app.callback(Output('line-plot-1', 'children'), [Input('subfolder-dropdown', 'value')])
 def update_graph_1(selected_subfolder):
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1)
-    if fig:
-        encoded_img = encode_image(fig)
+    image = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_1)
+    if image:
+        encoded_img = encode_image(image)
         end = time.perf_counter()
         print(f'Update Graph1 Plot Function Completed in {round(end - start, 2)} seconds')
         return html.Img(src='data:image/png;base64,{}'.format(encoded_img))
@@ -161,9 +150,9 @@ def update_graph_1(selected_subfolder):
 @app.callback(Output('line-plot-2', 'children'), [Input('subfolder-dropdown-2', 'value')])
 def update_graph_2(selected_subfolder):
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2)
-    if fig:
-        encoded_img = encode_image(fig)
+    image = update_line_plot(selected_subfolder, main_folder, sub_folder, subsub_folder_2)
+    if image:
+        encoded_img = encode_image(image)
         end = time.perf_counter()
         print(f'Update Graph2 Plot Function Completed in {round(end - start, 2)} seconds')
         return html.Img(src='data:image/png;base64,{}'.format(encoded_img))
@@ -172,9 +161,9 @@ def update_graph_2(selected_subfolder):
 @app.callback(Output('line-plot-3', 'children'), [Input('subfolder-dropdown-3', 'value')])
 def update_graph_3(selected_subfolder):
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3)
-    if fig:
-        encoded_img = encode_image(fig)
+    image = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_3)
+    if image:
+        encoded_img = encode_image(image)
         end = time.perf_counter()
         print(f'Update Graph3 Plot Function Completed in {round(end - start, 2)} seconds')
         return html.Img(src='data:image/png;base64,{}'.format(encoded_img))
@@ -183,9 +172,9 @@ def update_graph_3(selected_subfolder):
 @app.callback(Output('line-plot-4', 'children'), [Input('subfolder-dropdown-4', 'value')])
 def update_graph_4(selected_subfolder):
     start = time.perf_counter()
-    fig = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4)
-    if fig:
-        encoded_img = encode_image(fig)
+    image = update_line_plot(selected_subfolder, main_folder, sub_folder2, subsub_folder_4)
+    if image:
+        encoded_img = encode_image(image)
         end = time.perf_counter()
         print(f'Update Graph4 Plot Function Completed in {round(end - start, 2)} seconds')
         return html.Img(src='data:image/png;base64,{}'.format(encoded_img))
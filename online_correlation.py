@@ -0,0 +1,173 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from dateutil.relativedelta import relativedelta
+import numpy as np
+import pyarrow as pa
+
+from alignment import DEFAULT_EVERY, align_chunks, time_grid
+from data import duration_seconds, iter_parquet_data
+
+# aligned rows folded into the accumulator at once, bounds the temporary of the centered block
+DEFAULT_BLOCK_ROWS = 64 * 1024
+
+
+class CorrelationAccumulator:
+    """
+    One-pass covariance / Pearson correlation of k variables. Keeps the row count, the means and
+    the k x k co-moment matrix only, blocks of rows are folded in with the pairwise update of
+    Chan et al. (centered per block, then merged), which stays stable where naive sums of squares
+    cancel. Accumulators of different month files or workers are combined with merge.
+    Rows with a NaN in any variable are skipped.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        k = len(self.names)
+        self.count = 0
+        self.mean = np.zeros(k)
+        self.comoment = np.zeros((k, k))
+
+    def update(self, matrix, block_rows=DEFAULT_BLOCK_ROWS):
+        """Folds the rows of a (rows x k) matrix in."""
+        matrix = np.asarray(matrix)
+        for start in range(0, matrix.shape[0], block_rows):
+            block = matrix[start:start + block_rows].astype(np.float64, copy=False)
+            complete = ~np.isnan(block).any(axis=1)
+            if not complete.all():
+                block = block[complete]
+            if block.shape[0] == 0:
+                continue
+            mean = block.mean(axis=0)
+            centered = block - mean
+            self._combine(block.shape[0], mean, centered.T @ centered)
+        return self
+
+    def merge(self, other):
+        """Adds the rows seen by other, the variables must be the same."""
+        if other.names != self.names:
+            raise ValueError("accumulators of different variables can not be merged")
+        if other.count:
+            self._combine(other.count, other.mean, other.comoment)
+        return self
+
+    def covariance(self, ddof=1):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.comoment / (self.count - ddof) if self.count > ddof else np.full_like(self.comoment, np.nan)
+
+    def pearson(self):
+        """The correlation matrix, NaN for variables without variance."""
+        std = np.sqrt(np.diag(self.comoment))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            correlation = self.comoment / np.outer(std, std)
+        return np.clip(correlation, -1.0, 1.0)
+
+    def _combine(self, count, mean, comoment):
+        total = self.count + count
+        delta = mean - self.mean
+        self.comoment += comoment + np.outer(delta, delta) * (self.count * count / total)
+        self.mean += delta * (count / total)
+        self.count = total
+
+
+def correlate_properties(property_path, start_dt, stop_dt, every=DEFAULT_EVERY, tolerance=None, method="asof",
+                         max_workers=None):
+    """
+    Parameters
+    ----------
+    property_path : [Path]
+        paths to doocs properties
+    start_dt : datetime.datetime
+        first datetime
+    stop_dt : datetime.datetime
+        last datetime
+    every, tolerance, method :
+        the common time grid the properties are joined on, see alignment.align_properties
+    max_workers : int, optional
+        number of threads accumulating month windows concurrently
+
+    Returns
+    -------
+    CorrelationAccumulator
+        of the aligned rows between start_dt and stop_dt, see its pearson and covariance. The range
+        is processed one calendar month after the other, only the aligned matrix of one month per
+        worker is held in memory.
+    """
+    if not isinstance(property_path, list):
+        property_path = [property_path]
+
+    def read(window_start, window_stop):
+        return {p: iter_parquet_data(Path(p), window_start, window_stop, columns=["data"]) for p in property_path}
+
+    return _correlate_windows(property_path, read, start_dt, stop_dt, every, tolerance, method, max_workers)
+
+
+def correlate_tables(tables, start_dt, stop_dt, every=DEFAULT_EVERY, tolerance=None, method="asof"):
+    """
+    correlate_properties for data that is already loaded, e.g. the dictionary of
+    load_parquet_data or shared_load.load_parquet_data_shared, so a dashboard correlates the
+    tables it shows instead of reading the month files again. The tables are fed in month by
+    month as zero copy slices, only the aligned matrix of one month is held in memory.
+    """
+    timestamps = {p: _timestamps_ns(t) for p, t in tables.items()}
+
+    def read(window_start, window_stop):
+        lo_ns, hi_ns = int(datetime.timestamp(window_start) * 1e9), int(datetime.timestamp(window_stop) * 1e9)
+        batches = {}
+        for p, t in tables.items():
+            lo = np.searchsorted(timestamps[p], lo_ns, side="left")
+            hi = np.searchsorted(timestamps[p], hi_ns, side="right")
+            batches[p] = t.slice(lo, hi - lo).to_batches()
+        return batches
+
+    return _correlate_windows(list(tables), read, start_dt, stop_dt, every, tolerance, method)
+
+
+def _correlate_windows(names, read, start_dt, stop_dt, every, tolerance, method, max_workers=None):
+    """
+    Accumulates the aligned rows of every calendar month window, read(start, stop) returns the
+    record batches of every property between start and stop.
+    """
+    grid = time_grid(datetime.timestamp(start_dt), datetime.timestamp(stop_dt), every)
+    windows = _month_windows(start_dt, stop_dt)
+    # the reads start earlier by the tolerance, so an as-of join has the sample before the window
+    lookback = timedelta(seconds=duration_seconds(tolerance or every))
+
+    def accumulate(window):
+        window_start, window_stop, last = window
+        lo = np.searchsorted(grid, int(datetime.timestamp(window_start) * 1e9))
+        hi = np.searchsorted(grid, int(datetime.timestamp(window_stop) * 1e9), side="right" if last else "left")
+        aligned = align_chunks(read(window_start - lookback, window_stop), grid[lo:hi], every, tolerance, method,
+                               how="inner")
+        return CorrelationAccumulator(names).update(aligned["matrix"])
+
+    if max_workers is not None and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            accumulators = list(executor.map(accumulate, windows))
+    else:
+        accumulators = [accumulate(window) for window in windows]
+
+    result = CorrelationAccumulator(names)
+    for accumulator in accumulators:
+        result.merge(accumulator)
+    return result
+
+
+def _timestamps_ns(table):
+    """int64 nanoseconds of the (epoch seconds or normalized) timestamp column of a table in timestamp order."""
+    timestamps = table["timestamp"]
+    if pa.types.is_timestamp(timestamps.type):
+        return timestamps.cast(pa.timestamp("ns")).to_numpy().view(np.int64)
+    return (timestamps.to_numpy() * 1e9).astype(np.int64)
+
+
+def _month_windows(start_dt, stop_dt):
+    """(start, stop, is last) of the calendar months between start_dt and stop_dt."""
+    windows = []
+    window_start = start_dt
+    while window_start < stop_dt:
+        next_month = datetime(window_start.year, window_start.month, 1) + relativedelta(months=1)
+        window_stop = min(next_month, stop_dt)
+        windows.append((window_start, window_stop, window_stop == stop_dt))
+        window_start = window_stop
+    return windows
@@ -0,0 +1,194 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from dateutil.relativedelta import relativedelta
+from pyarrow import parquet as pq
+
+from catalog import file_overlaps, get_file_stats
+from data import month_range, read_month_file
+from table_cache import table_cache
+
+# decoded bytes a single prefetch round may add to the table cache
+DEFAULT_PREFETCH_BYTES = 512 * 1024 ** 2
+# month files a single prefetch round may read
+DEFAULT_PREFETCH_FILES = 32
+# background threads doing the reads, kept low so they do not compete with user requests
+DEFAULT_PREFETCH_WORKERS = 2
+
+
+class Prefetcher:
+    """
+    Warms the table cache after every load with the month files the operator is likely to
+    ask for next: the months before and after the loaded range of the selected properties,
+    then the sibling properties under the same location (e.g. XTIN.MLO1/*) for the loaded range.
+
+    Rounds are kept per session: every call of prefetch starts a new round of its session and
+    cancels what is left of the previous one of that session, the rounds of other users go on.
+    The candidates of a round are found by the background threads as well, the footers of the
+    sibling months are not read on the request thread.
+    record_request keeps hit statistics, see stats.
+    """
+
+    def __init__(self, cache=table_cache, max_bytes=DEFAULT_PREFETCH_BYTES, max_files=DEFAULT_PREFETCH_FILES,
+                 max_workers=DEFAULT_PREFETCH_WORKERS, months_around=1, siblings=True):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.months_around = months_around
+        self.siblings = siblings
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._rounds = {}  # session -> (generation, futures) of its current round
+        self._prefetched = set()  # cache keys of the month files read by the prefetcher
+        self.requested = 0
+        self.hits = 0
+        self.evicted = 0
+        self.prefetched = 0
+        self.cancelled = 0
+        self.bytes = 0
+
+    def record_request(self, property_path, start_dt, stop_dt):
+        """
+        Call before a user load. Counts the month files of the request that were prefetched and
+        are still cached (hits) or were prefetched but evicted in the meantime.
+        """
+        if not isinstance(property_path, list):
+            property_path = [property_path]
+        for p in property_path:
+            for file_path in _month_files(Path(p), month_range(start_dt, stop_dt), start_dt, stop_dt):
+                key = self.cache.key(file_path)
+                with self._lock:
+                    self.requested += 1
+                    if key in self._prefetched:
+                        self._prefetched.discard(key)
+                        if self.cache.contains(file_path):
+                            self.hits += 1
+                        else:
+                            self.evicted += 1
+
+    def prefetch(self, property_path, start_dt, stop_dt, session=None):
+        """
+        Schedules the background reads for a load of property_path between start_dt and stop_dt.
+        Returns immediately, the previous round of the session is cancelled.
+        """
+        if not isinstance(property_path, list):
+            property_path = [property_path]
+        property_path = [Path(p) for p in property_path]
+
+        with self._lock:
+            self._cancel_locked(session)
+            # rounds that are done are forgotten, sessions that went away leave nothing behind
+            self._rounds = {s: r for s, r in self._rounds.items() if not all(f.done() for f in r[1])}
+            self._generation += 1
+            generation = self._generation
+            futures = []
+            self._rounds[session] = (generation, futures)
+            futures.append(self._executor.submit(self._plan, property_path, start_dt, stop_dt, session, generation))
+
+    def cancel(self, session=None):
+        """Stops the current round of a session, e.g. when the operator navigates to another tab."""
+        with self._lock:
+            self._cancel_locked(session)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requested": self.requested,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.requested if self.requested else 0.0,
+                "evicted": self.evicted,
+                "prefetched": self.prefetched,
+                # share of the prefetched files that were asked for afterwards
+                "accuracy": (self.hits + self.evicted) / self.prefetched if self.prefetched else 0.0,
+                "cancelled": self.cancelled,
+                "bytes": self.bytes,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            for session in list(self._rounds):
+                self._cancel_locked(session)
+        self._executor.shutdown(wait=False)
+
+    def _cancel_locked(self, session):
+        _, futures = self._rounds.pop(session, (None, []))
+        self.cancelled += sum(f.cancel() for f in futures)
+
+    def _current(self, session, generation):
+        return self._rounds.get(session, (None,))[0] == generation
+
+    def _candidates(self, property_path, start_dt, stop_dt):
+        """Month files to prefetch, most likely first, skipping everything already cached."""
+        before = start_dt - relativedelta(months=self.months_around)
+        after = stop_dt + relativedelta(months=self.months_around)
+        files = []
+        for p in property_path:
+            files += _month_files(p, month_range(before, start_dt), before, start_dt)
+            files += _month_files(p, month_range(stop_dt, after), stop_dt, after)
+        if self.siblings:
+            selected = set(property_path)
+            for location in dict.fromkeys(p.parent for p in property_path):
+                for sibling in _sub_directories(location):
+                    if sibling not in selected:
+                        files += _month_files(sibling, month_range(start_dt, stop_dt), start_dt, stop_dt)
+        return [f for f in dict.fromkeys(files) if not self.cache.contains(f)]
+
+    def _plan(self, property_path, start_dt, stop_dt, session, generation):
+        """First task of a round, finds the candidates and submits their reads to the round."""
+        with self._lock:
+            if not self._current(session, generation):
+                return
+        candidates = self._candidates(property_path, start_dt, stop_dt)
+        with self._lock:
+            if not self._current(session, generation):
+                return
+            budget = {"bytes": self.max_bytes}
+            self._rounds[session][1].extend(self._executor.submit(self._read, file_path, session, generation, budget)
+                                            for file_path in candidates[:self.max_files])
+
+    def _read(self, file_path, session, generation, budget):
+        with self._lock:
+            if not self._current(session, generation):
+                return
+        size = _decoded_size(file_path)
+        with self._lock:
+            if not self._current(session, generation):
+                return
+            # neither exceed the round budget nor push the user's tables out of the cache
+            if size > budget["bytes"] or self.cache.bytes + size > self.cache.max_bytes:
+                return
+            budget["bytes"] -= size
+        table = read_month_file(file_path)
+        with self._lock:
+            self._prefetched.add(self.cache.key(file_path))
+            self.prefetched += 1
+            self.bytes += table.nbytes
+
+
+def _month_files(p, months, start_dt, stop_dt):
+    start_timestamp = datetime.timestamp(start_dt)
+    stop_timestamp = datetime.timestamp(stop_dt)
+    files = []
+    for month in months:
+        file_path = p.joinpath(f"{month}.parquet")
+        stats = get_file_stats(file_path)
+        if stats is not None and file_overlaps(stats, start_timestamp, stop_timestamp):
+            files.append(file_path)
+    return files
+
+
+def _sub_directories(path):
+    try:
+        with os.scandir(path) as it:
+            return sorted(path.joinpath(e.name) for e in it if e.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+def _decoded_size(file_path):
+    """Uncompressed size of a month file from its footer, an estimate of the decoded table."""
+    metadata = pq.read_metadata(file_path)
+    return sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups))
@@ -0,0 +1,73 @@
+import numpy as np
+
+# image grid of the rasterized graphs, about their size in pixels
+DEFAULT_WIDTH = 600
+DEFAULT_HEIGHT = 400
+
+
+def rasterize(x, y, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, x_range=None, y_range=None, x_sorted=False):
+    """
+    Parameters
+    ----------
+    x : numpy.ndarray
+        datetime64 or numeric x values
+    y : numpy.ndarray
+        the y values, NaN values are skipped
+    width, height : int
+        size of the image grid
+    x_range, y_range : tuple, optional
+        (start, end) of the visible window, the extent of the data if not given. x_range may be
+        given as datetime, numpy.datetime64 or pandas.Timestamp for datetime64 x values.
+    x_sorted : bool
+        x is in ascending order, the visible window is then found with a binary search
+
+    Returns
+    -------
+    dict
+        "counts" (float32 [height x width], points per pixel, NaN for empty pixels), "x" and "y" with
+        the pixel centers (x of the same kind as the input). The points are binned with integer pixel
+        indices and one np.bincount, a 2D histogram whose cost is linear in the points of the window
+        and whose result size only depends on width x height.
+    """
+    x = np.asarray(x)
+    is_datetime = np.issubdtype(x.dtype, np.datetime64)
+    xs = x.astype("datetime64[ns]").view(np.int64) if is_datetime else np.asarray(x, dtype=np.float64)
+    ys = np.asarray(y, dtype=np.float64)
+
+    x0, x1 = _range(xs, x_range, is_datetime)
+    if x_sorted:
+        lo, hi = np.searchsorted(xs, x0, side="left"), np.searchsorted(xs, x1, side="right")
+        xs, ys = xs[lo:hi], ys[lo:hi]
+    else:
+        inside = (xs >= x0) & (xs <= x1)
+        xs, ys = xs[inside], ys[inside]
+    valid = ~np.isnan(ys)
+    if not valid.all():
+        xs, ys = xs[valid], ys[valid]
+    y0, y1 = _range(ys, y_range, False)
+    inside = (ys >= y0) & (ys <= y1)
+    if not inside.all():
+        xs, ys = xs[inside], ys[inside]
+
+    # pixel indices, the end of a range belongs to the last pixel
+    column = np.minimum(((xs - x0) * (width / max(x1 - x0, 1e-300))).astype(np.int64), width - 1)
+    row = np.minimum(((ys - y0) * (height / max(y1 - y0, 1e-300))).astype(np.int64), height - 1)
+    counts = np.bincount(row * width + column, minlength=width * height).reshape(height, width).astype(np.float32)
+    counts[counts == 0] = np.nan
+
+    x_centers = x0 + (np.arange(width) + 0.5) * (x1 - x0) / width
+    if is_datetime:
+        x_centers = x_centers.astype(np.int64).view("datetime64[ns]")
+    return {"counts": counts, "x": x_centers, "y": y0 + (np.arange(height) + 0.5) * (y1 - y0) / height}
+
+
+def _range(values, value_range, is_datetime):
+    if value_range is None or value_range[0] is None or value_range[1] is None:
+        if values.size == 0:
+            return 0, 1
+        if is_datetime:
+            return values.min(), values.max()
+        return np.nanmin(values), np.nanmax(values)
+    if is_datetime:
+        return tuple(np.datetime64(v, "ns").astype(np.int64) for v in value_range)
+    return float(value_range[0]), float(value_range[1])
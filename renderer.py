@@ -0,0 +1,157 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+# processes rendering images, every one keeps its own figures
+DEFAULT_RENDER_PROCESSES = min(4, os.cpu_count() or 1)
+# memory budget of the rendered images
+DEFAULT_IMAGE_CACHE_BYTES = 256 * 1024 ** 2
+# size in inches and resolution of the rendered graphs, matplotlib's defaults
+DEFAULT_SIZE = (6.4, 4.8)
+DEFAULT_DPI = 100
+IMAGE_FORMATS = ("png", "webp")
+
+
+class ImageCache:
+    """Byte-budgeted LRU cache of rendered images, keyed by (property, data version, size, style)."""
+
+    def __init__(self, max_bytes=DEFAULT_IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        if len(image) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._images:
+                self.bytes -= len(self._images.pop(key))
+            self._images[key] = image
+            self.bytes += len(image)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._images), "bytes": self.bytes,
+                    "max_bytes": self.max_bytes}
+
+
+class Renderer:
+    """
+    Renders line graphs to images with matplotlib's Agg backend in a pool of worker processes.
+
+    The workers do not use pyplot: every process keeps one Figure with its Agg canvas per size and
+    clears and redraws it for the next graph, so no figure is leaked and no global pyplot lock is
+    held. Rendered images are cached, a repeated view of the same data is not rendered again.
+    """
+
+    def __init__(self, processes=DEFAULT_RENDER_PROCESSES, cache=None):
+        self.processes = processes
+        self.cache = ImageCache() if cache is None else cache
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def render_line(self, key, load, size=DEFAULT_SIZE, dpi=DEFAULT_DPI, style=None, image_format="png"):
+        """
+        Parameters
+        ----------
+        key : tuple
+            identifies the data, e.g. (property path, data_version(property path))
+        load : callable
+            returns the (x, y) arrays to draw, only called if the image is not cached
+        size : tuple
+            (width, height) in inches
+        dpi : int
+            resolution
+        style : dict, optional
+            title, xlabel, ylabel, color and linewidth of the graph
+        image_format : str
+            "png" or "webp" (needs Pillow)
+
+        Returns
+        -------
+        bytes
+            the encoded image
+        """
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"unknown image format {image_format!r}, use one of {IMAGE_FORMATS}")
+        style = style or {}
+        cache_key = (key, tuple(size), dpi, tuple(sorted(style.items())), image_format)
+        image = self.cache.get(cache_key)
+        if image is None:
+            x, y = load()
+            image = self._get_executor().submit(_render_line, x, y, tuple(size), dpi, style, image_format).result()
+            self.cache.put(cache_key, image)
+        return image
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _get_executor(self):
+        # started on first use, not when a dashboard module is imported (e.g. by the spawned workers)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processes)
+            return self._executor
+
+
+def data_version(property_path):
+    """(month file, size, mtime) of all month files of a property, changes when the data changes."""
+    files = sorted(Path(property_path).glob("????-??.parquet"))
+    return tuple((f.name, st.st_size, st.st_mtime_ns) for f, st in ((f, f.stat()) for f in files))
+
+
+# figures of the worker process by (size, dpi)
+_figures = {}
+
+
+def _render_line(x, y, size, dpi, style, image_format):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = _figures.get((size, dpi))
+    if figure is None:
+        figure = Figure(figsize=size, dpi=dpi)
+        FigureCanvasAgg(figure)
+        figure.add_subplot()
+        _figures[(size, dpi)] = figure
+    ax = figure.axes[0]
+    ax.clear()
+    ax.plot(x, y, color=style.get("color"), linewidth=style.get("linewidth"))
+    ax.set_xlabel(style.get("xlabel", ""))
+    ax.set_ylabel(style.get("ylabel", ""))
+    ax.set_title(style.get("title", ""))
+
+    image = BytesIO()
+    figure.savefig(image, format=image_format)
+    return image.getvalue()
+
+
+# renderer shared by the matplotlib dashboards
+renderer = Renderer()
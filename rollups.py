@@ -0,0 +1,320 @@
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import parquet as pq
+
+from catalog import file_overlaps, get_file_stats, is_fresh, load_catalog, source_metadata
+from data import duration_seconds, iter_parquet_data, month_range, read_month_file, standard_types
+
+# rollup levels from fine to coarse, name -> bucket width in seconds
+ROLLUP_LEVELS = {
+    "1min": 60,
+    "10min": 600,
+    "1h": 3600,
+    "6h": 6 * 3600,
+    "1d": 24 * 3600,
+}
+# a rollup is only used if it has at least that many buckets in the requested range
+DEFAULT_MIN_POINTS = 500
+# rollups are stored next to the month file, e.g. 2023-10.parquet -> 2023-10.rollup-1h.pq.
+# The suffix keeps them out of every "*.parquet" listing of the property directories.
+ROLLUP_FILE = "{month}.rollup-{level}.pq"
+ROLLUP_COLUMNS = ["timestamp", "count", "min", "max", "data", "std"]
+
+
+def compute_rollup(timestamps, values, width):
+    """
+    Parameters
+    ----------
+    timestamps : array-like
+        epoch seconds
+    values : array-like
+        the data column
+    width : float
+        bucket width in seconds, buckets are aligned to multiples of width since the epoch
+
+    Returns
+    -------
+    pyarrow.Table
+        one row per non empty bucket: the bucket start as "timestamp", the sample "count",
+        "min", "max", the mean as "data" and the sample standard deviation "std"
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~(np.isnan(timestamps) | np.isnan(values))
+    timestamps, values = timestamps[valid], values[valid]
+
+    buckets = np.floor(timestamps / width) * width
+    order = np.argsort(buckets, kind="stable")
+    buckets, values = buckets[order], values[order]
+
+    if buckets.size == 0:
+        empty = np.empty(0)
+        return _rollup_table(empty, np.empty(0, dtype=np.int64), empty, empty, empty, empty)
+
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    count = np.diff(np.append(starts, buckets.size))
+    mean = np.add.reduceat(values, starts) / count
+    deviation = values - np.repeat(mean, count)
+    m2 = np.add.reduceat(deviation * deviation, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.sqrt(m2 / (count - 1))
+    return _rollup_table(buckets[starts], count, np.minimum.reduceat(values, starts),
+                         np.maximum.reduceat(values, starts), mean, std)
+
+
+def merge_rollups(tables):
+    """
+    Concatenates rollup tables. Buckets split over two month files (month boundaries are not
+    aligned to the buckets) are combined into one, with the pooled mean and standard deviation.
+    """
+    table = pa.concat_tables(tables) if tables else compute_rollup([], [], 1)
+    bucket = table["timestamp"].to_numpy()
+    if bucket.size < 2 or np.all(bucket[1:] > bucket[:-1]):
+        return table
+
+    order = np.argsort(bucket, kind="stable")
+    bucket = bucket[order]
+    count, minimum, maximum, mean, std = (table[c].to_numpy()[order] for c in ROLLUP_COLUMNS[1:])
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+
+    total = np.add.reduceat(count, starts)
+    merged_mean = np.add.reduceat(count * mean, starts) / total
+    sizes = np.diff(np.append(starts, bucket.size))
+    m2 = np.nan_to_num(std ** 2 * (count - 1)) + count * (mean - np.repeat(merged_mean, sizes)) ** 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        merged_std = np.sqrt(np.add.reduceat(m2, starts) / (total - 1))
+    return _rollup_table(bucket[starts], total, np.minimum.reduceat(minimum, starts),
+                         np.maximum.reduceat(maximum, starts), merged_mean, merged_std)
+
+
+def pick_rollup_level(start_dt, stop_dt, min_points=DEFAULT_MIN_POINTS):
+    """The coarsest rollup level with at least min_points buckets between start and stop."""
+    span = datetime.timestamp(stop_dt) - datetime.timestamp(start_dt)
+    for level, width in reversed(ROLLUP_LEVELS.items()):
+        if span / width >= min_points:
+            return level
+    return next(iter(ROLLUP_LEVELS))
+
+
+def load_rollup_data(property_path, start_dt, stop_dt, min_points=DEFAULT_MIN_POINTS, level=None):
+    """
+    Parameters
+    ----------
+    property_path : Path, [Path]
+        path to doocs property paths. That directory should contain the paruqet files
+    start_dt : datetime.datetime
+        first datetime
+    stop_dt : datetime.datetime
+        last datetime
+    min_points : int
+        the coarsest level giving at least that many buckets is used, see pick_rollup_level
+    level : str, optional
+        a key of ROLLUP_LEVELS, overrides min_points
+
+    Returns
+    -------
+    dictionary
+        a rollup table (see compute_rollup) for every doocs property path, with all buckets
+        overlapping the range (the first and last one cover their full width). Precomputed
+        rollups are used where they are up to date, the others are computed from the month files.
+    """
+    level = level or pick_rollup_level(start_dt, stop_dt, min_points)
+    width = ROLLUP_LEVELS[level]
+    start_timestamp = datetime.timestamp(start_dt)
+    stop_timestamp = datetime.timestamp(stop_dt)
+
+    if not isinstance(property_path, list):
+        property_path = [property_path]
+
+    rollup_data = {}
+    for p in property_path:
+        p = Path(p)
+        tables = []
+        for month in month_range(start_dt, stop_dt):
+            stats = get_file_stats(p.joinpath(f"{month}.parquet"))
+            if stats is not None and file_overlaps(stats, start_timestamp, stop_timestamp):
+                tables.append(read_rollup(p, month, level))
+        table = merge_rollups(tables)
+        bucket = table["timestamp"].to_numpy()
+        in_range = (bucket + width > start_timestamp) & (bucket < stop_timestamp)
+        rollup_data[p] = table.filter(pa.array(in_range))
+
+    return rollup_data
+
+
+def period_statistics(property_path, start_dt, stop_dt, period="1d", tables=None):
+    """
+    Parameters
+    ----------
+    property_path : Path, [Path]
+        path to doocs property paths
+    start_dt : datetime.datetime
+        first datetime
+    stop_dt : datetime.datetime
+        last datetime
+    period : str
+        length of the periods, e.g. "1h", "1d" or "1w". Periods are aligned to multiples of it since
+        the epoch, so days are UTC days.
+    tables : dict, optional
+        the samples of the properties between start_dt and stop_dt if they are loaded already (e.g. by
+        load_parquet_data), the partial periods are then computed from them instead of the month files
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per property and non empty period: "property", the period start as "timestamp"
+        (datetime64[ns], naive UTC) and the rollup columns "count", "min", "max", "data" (the mean)
+        and "std". The full periods come from the coarsest rollup level dividing the period, merged
+        with merge_rollups, only the partial periods at the ends of the range are computed from
+        the samples.
+    """
+    width = duration_seconds(period)
+    divisors = [level for level, level_width in ROLLUP_LEVELS.items() if width % level_width == 0]
+    start_timestamp = datetime.timestamp(start_dt)
+    stop_timestamp = datetime.timestamp(stop_dt)
+    # the whole periods inside the range
+    inner_start = np.ceil(start_timestamp / width) * width
+    inner_stop = np.floor(stop_timestamp / width) * width
+
+    if not isinstance(property_path, list):
+        property_path = [property_path]
+
+    loaded_tables = {str(p): t for p, t in (tables or {}).items()}
+    frames = []
+    for p in property_path:
+        p = Path(p)
+        loaded = loaded_tables.get(str(p))
+        tables = []
+        edges = [(start_timestamp, stop_timestamp)]
+        if divisors and inner_start < inner_stop:
+            rollup = load_rollup_data(p, datetime.fromtimestamp(inner_start), datetime.fromtimestamp(inner_stop),
+                                      level=divisors[-1])[p]
+            bucket = rollup["timestamp"].to_numpy()
+            rollup = rollup.filter(pa.array((bucket >= inner_start) & (bucket < inner_stop)))
+            bucket = np.floor(rollup["timestamp"].to_numpy() / width) * width
+            tables.append(rollup.set_column(0, "timestamp", pa.array(bucket, pa.float64())))
+            edges = [(start_timestamp, inner_start), (inner_stop, stop_timestamp)]
+        for edge_start, edge_stop in edges:
+            if edge_stop > edge_start:
+                tables.append(_edge_rollup(p, edge_start, edge_stop, width, edge_stop == stop_timestamp, loaded))
+        table = merge_rollups(tables).to_pandas()
+        table.insert(0, "property", p)
+        frames.append(table)
+
+    statistics = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["property", *ROLLUP_COLUMNS])
+    statistics["timestamp"] = pd.to_datetime(statistics["timestamp"], unit="s")
+    return statistics
+
+
+def _edge_rollup(p, start_timestamp, stop_timestamp, width, include_stop, loaded=None):
+    """
+    compute_rollup of the samples in [start, stop), or [start, stop] at the end of the range,
+    taken from the loaded table of the property if there is one.
+    """
+    if loaded is not None:
+        # the loaded tables are in timestamp order, the edge is a slice of them
+        loaded_timestamps = loaded["timestamp"].to_numpy()
+        lo = np.searchsorted(loaded_timestamps, start_timestamp, side="left")
+        hi = np.searchsorted(loaded_timestamps, stop_timestamp, side="right")
+        batches = loaded.slice(lo, hi - lo).select(["timestamp", "data"]).to_batches()
+    else:
+        batches = iter_parquet_data(p, datetime.fromtimestamp(start_timestamp), datetime.fromtimestamp(stop_timestamp),
+                                    columns=["data"])
+    timestamps, values = [], []
+    for batch in batches:
+        timestamps.append(batch.column("timestamp").to_numpy())
+        values.append(batch.column("data").to_numpy(zero_copy_only=False))
+    timestamps = np.concatenate(timestamps) if timestamps else np.empty(0)
+    values = np.concatenate(values) if values else np.empty(0)
+    if not include_stop:
+        keep = timestamps < stop_timestamp
+        timestamps, values = timestamps[keep], values[keep]
+    return compute_rollup(timestamps, values, width)
+
+
+def read_rollup(prop_path, month, level):
+    """The rollup of one month file, computed from the month file if missing or out of date."""
+    month_file = Path(prop_path).joinpath(f"{month}.parquet")
+    source = source_metadata(month_file)
+    try:
+        table = pq.read_table(_rollup_path(prop_path, month, level))
+        if table.schema.metadata and is_fresh(table.schema.metadata, source):
+            return table.replace_schema_metadata(None)
+    except FileNotFoundError:
+        pass
+
+    table = read_month_file(month_file)
+    return compute_rollup(table["timestamp"].to_numpy(), table["data"].to_numpy(), ROLLUP_LEVELS[level])
+
+
+def build_rollups(prop_path, months=None, force=False):
+    """
+    Writes all rollup levels for the month files of a property. Up to date rollups are
+    skipped unless force is given.
+
+    Returns
+    -------
+    list
+        the months whose rollups were (re)written
+    """
+    prop_path = Path(prop_path)
+    if months is None:
+        months = sorted(f.name[:-len(".parquet")] for f in prop_path.glob("????-??.parquet"))
+
+    written = []
+    for month in months:
+        month_file = prop_path.joinpath(f"{month}.parquet")
+        source = source_metadata(month_file)
+        if not force and all(_rollup_is_fresh(prop_path, month, level, source) for level in ROLLUP_LEVELS):
+            continue
+
+        table = standard_types(pq.read_table(month_file, columns=["timestamp", "data"]))
+        timestamps = table["timestamp"].to_numpy()
+        values = table["data"].to_numpy()
+        for level, width in ROLLUP_LEVELS.items():
+            rollup = compute_rollup(timestamps, values, width).replace_schema_metadata(source)
+            _write_atomic(rollup, _rollup_path(prop_path, month, level))
+        written.append(month)
+    return written
+
+
+def _rollup_table(bucket, count, minimum, maximum, mean, std):
+    return pa.table([pa.array(bucket, pa.float64()), pa.array(count, pa.int64()), pa.array(minimum, pa.float64()),
+                     pa.array(maximum, pa.float64()), pa.array(mean, pa.float64()), pa.array(std, pa.float64())],
+                    names=ROLLUP_COLUMNS)
+
+
+def _rollup_path(prop_path, month, level):
+    return Path(prop_path).joinpath(ROLLUP_FILE.format(month=month, level=level))
+
+
+def _rollup_is_fresh(prop_path, month, level, source):
+    try:
+        return is_fresh(pq.read_schema(_rollup_path(prop_path, month, level)).metadata or {}, source)
+    except FileNotFoundError:
+        return False
+
+
+def _write_atomic(table, path):
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    # python rollups.py <archive base path> [--force]
+    base_path = Path(sys.argv[1])
+    force = "--force" in sys.argv[2:]
+    catalog = load_catalog(base_path, max_age=0)
+    start = time.perf_counter()
+    for prop_path in catalog["properties"]:
+        written = build_rollups(prop_path, force=force)
+        if written:
+            print(f"{prop_path}: {', '.join(written)}")
+    print(f"Rollups completed in {round(time.perf_counter() - start, 2)} seconds")
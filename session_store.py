@@ -0,0 +1,227 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import pyarrow as pa
+
+from shared_tables import shared_tables
+
+# memory budget of all sessions together
+DEFAULT_STORE_BYTES = 4 * 1024 ** 3
+# memory budget of a single browser session
+DEFAULT_SESSION_BYTES = 1024 ** 3
+# seconds an entry is kept after it was last used
+DEFAULT_SESSION_TTL = 3600
+
+
+class SessionStore:
+    """
+    Loaded data of the dashboard graphs, keyed by (session id, graph uid).
+
+    Entries expire ttl seconds after their last use. Beyond that the least recently used entries
+    of a session are evicted once the session is over session_bytes, and the least recently used
+    entries of all sessions once the store is over max_bytes, so one user loading a year of data
+    can not push everybody else out. The dashboards release the entries of the graphs they
+    remove from their container.
+
+    With a shared store (see shared_tables) the tables put with a source are kept in a segment
+    every server process can map, one per content: sessions showing the same property and range
+    share it, and a callback routed to another worker finds the data of the session too. The
+    limits above apply to the tables each process holds, an entry leaving the store drops its
+    reference to the segment, and the segment goes with the last reference. Entries this process
+    dropped are not taken from the shared store again for ttl seconds.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_STORE_BYTES, session_bytes=DEFAULT_SESSION_BYTES, ttl=DEFAULT_SESSION_TTL,
+                 shared=None):
+        self.max_bytes = max_bytes
+        self.session_bytes = session_bytes
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()  # (session, uid) -> [value, bytes, last use, segment]
+        self._session_usage = {}  # session -> bytes
+        self._dropped = OrderedDict()  # (session, uid) -> time it was evicted, expired or released
+        self._detached = []  # (key, segment) of removed entries, detached outside the lock
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def put(self, session, uid, value, source=None):
+        """
+        Parameters
+        ----------
+        session : str
+            session id
+        uid : str
+            graph uid
+        value : pyarrow.Table or anything else with nbytes
+            the loaded data of the graph
+        source : tuple, optional
+            identifies the content of value, e.g. (property path, start, stop). Only tables with a
+            source are shared with the other sessions and processes.
+        """
+        size = getattr(value, "nbytes", 0)
+        if size > self.session_bytes or size > self.max_bytes:
+            return
+        key = (session, uid)
+        segment = None
+        if self.shared is not None and source is not None and isinstance(value, pa.Table):
+            # the mapped segment replaces the table, the pages are shared instead of copied.
+            # A table that could not be written (e.g. /dev/shm is full) stays in the process.
+            source = source if isinstance(source, tuple) else (source,)
+            attached = self.shared.attach(key, (*source, value.num_rows), value)
+            if attached is not None:
+                segment, value = attached
+        with self._lock:
+            self._expire()
+            self._dropped.pop(key, None)
+            if key in self._entries:
+                # the reference of the same segment is kept
+                self._remove(key, detach=self._entries[key][3] != segment)
+            self._insert(key, [value, size, time.monotonic(), segment])
+        self._detach()
+
+    def get(self, session, uid):
+        """The value of a graph, None if it was never stored, released, expired or evicted."""
+        key = (session, uid)
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2] = time.monotonic()
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            # only data this process never held is taken from the other workers
+            shared = self.shared is not None and key not in self._dropped
+        self._detach()
+        if entry is not None:
+            if entry[3] is not None:
+                self.shared.touch(key, entry[3])
+            return entry[0]
+        found = self.shared.find(key) if shared else None
+        if found is None:
+            return None
+        segment, value = found
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and key not in self._dropped and value.nbytes <= min(self.session_bytes, self.max_bytes):
+                self._insert(key, [value, value.nbytes, time.monotonic(), segment])
+            else:
+                # put, found or released by another thread meanwhile
+                if entry is None or entry[3] != segment:
+                    self._detached.append((key, segment))
+                value = entry[0] if entry is not None else None
+        self._detach()
+        return value
+
+    def release(self, session, uids=None):
+        """Drops the given graphs of a session, or all of its graphs."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == session and (uids is None or k[1] in uids)]:
+                self._drop(key)
+        self._detach()
+
+    def retain(self, session, uids):
+        """Drops the graphs of a session that are not in uids, e.g. after its container was replaced."""
+        uids = set(uids)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == session and k[1] not in uids]:
+                self._drop(key)
+        self._detach()
+
+    def usage(self, session=None):
+        """Entries and bytes of one session, or of every session by session id."""
+        with self._lock:
+            self._expire()
+            if session is not None:
+                return self._usage(session)
+            return {s: self._usage(s) for s in self._session_usage}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._session_usage),
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+        self._detach()
+
+    def _detach(self):
+        # the file system work of removed entries is done outside the lock
+        with self._lock:
+            detached, self._detached = self._detached, []
+        for key, segment in detached:
+            self.shared.detach(key, segment)
+
+    def _usage(self, session):
+        return {
+            "entries": sum(k[0] == session for k in self._entries),
+            "bytes": self._session_usage.get(session, 0),
+            "max_bytes": self.session_bytes,
+        }
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._session_usage[key[0]] = self._session_usage.get(key[0], 0) + entry[1]
+        self.bytes += entry[1]
+        self._evict(key[0])
+
+    def _drop(self, key):
+        self._remove(key)
+        # in order of removal, the old ones are pruned with the expired entries
+        self._dropped.pop(key, None)
+        self._dropped[key] = time.monotonic()
+
+    def _remove(self, key, detach=True):
+        _, size, _, segment = self._entries.pop(key)
+        if detach and segment is not None:
+            self._detached.append((key, segment))
+        session = key[0]
+        self._session_usage[session] -= size
+        if not any(k[0] == session for k in self._entries):
+            del self._session_usage[session]
+        self.bytes -= size
+
+    def _expire(self):
+        # entries are in order of last use, the expired ones are at the front
+        deadline = time.monotonic() - self.ttl
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[2] > deadline:
+                break
+            self._drop(key)
+            self.expirations += 1
+        while self._dropped and next(iter(self._dropped.values())) <= deadline:
+            self._dropped.popitem(last=False)
+
+    def _evict(self, session):
+        while self._session_usage.get(session, 0) > self.session_bytes:
+            self._drop(next(k for k in self._entries if k[0] == session))
+            self.evictions += 1
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+
+# store of all dashboards of the process, backed by the segments shared with the other workers
+session_store = SessionStore(shared=shared_tables)
+
+
+def new_session_id():
+    """Id of a browser session, kept by the dashboards in a dcc.Store with storage_type="session"."""
+    return uuid.uuid4().hex
@@ -0,0 +1,92 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from data import load_parquet_data
+
+# completed loads are kept that long, so callbacks of the same click arriving one after another share them too
+DEFAULT_KEEP_SECONDS = 30
+
+
+class SingleFlight:
+    """
+    Coalesces calls with the same key into one execution: the first caller runs the function,
+    callers arriving while it runs (or up to keep_seconds after it finished) wait for and share
+    its result. Failed calls are not kept.
+    """
+
+    def __init__(self, keep_seconds=DEFAULT_KEEP_SECONDS):
+        self.keep_seconds = keep_seconds
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> [future, finish time or None while running]
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            self._expire()
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = [Future(), None]
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        future = flight[0]
+        if leader:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+                with self._lock:
+                    self._flights.pop(key, None)
+            else:
+                with self._lock:
+                    flight[1] = time.monotonic()
+        return future.result()
+
+    def forget(self, key=None):
+        """Drops the kept result of key, or all kept results."""
+        with self._lock:
+            if key is None:
+                self._flights = {k: f for k, f in self._flights.items() if f[1] is None}
+            elif key in self._flights and self._flights[key][1] is not None:
+                del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "coalesced_rate": self.coalesced / self.calls if self.calls else 0.0,
+                "in_flight": sum(f[1] is None for f in self._flights.values()),
+            }
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [k for k, f in self._flights.items() if f[1] is not None and now - f[1] > self.keep_seconds]
+        for k in expired:
+            del self._flights[k]
+
+
+# shared by all callbacks of the process
+shared_loads = SingleFlight()
+
+
+def load_parquet_data_shared(property_path, start_dt, stop_dt, request_id=None, max_workers=None):
+    """
+    load_parquet_data through shared_loads, keyed by (request_id, property set, start, stop).
+    Callbacks fired by the same user action (e.g. the n_clicks of a button as request_id) read
+    and decode the data once. The returned tables are shared, callers must not modify them.
+    """
+    if not isinstance(property_path, list):
+        property_path = [property_path]
+    key = (request_id, frozenset(str(p) for p in property_path), start_dt, stop_dt)
+    loaded_data = shared_loads.do(key, load_parquet_data, property_path, start_dt, stop_dt, max_workers=max_workers)
+    # in the caller's order and with the caller's keys
+    by_name = {str(p): table for p, table in loaded_data.items()}
+    return {p: by_name[str(p)] for p in property_path}
@@ -0,0 +1,234 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+import pyarrow as pa
+
+# tmpfs on Linux, so the segments are shared memory; the temp directory elsewhere
+DEFAULT_SHARED_DIR = Path("/dev/shm/visualization") if Path("/dev/shm").is_dir() else \
+    Path(tempfile.gettempdir()).joinpath("visualization_tables")
+# size of all segments together, the least recently used ones are removed beyond it
+DEFAULT_SHARED_BYTES = 8 * 1024 ** 3
+# seconds a reference is kept after its last use, the TTL of the session store
+DEFAULT_REF_TTL = 3600
+SEGMENT_SUFFIX = ".arrow"
+REF_SUFFIX = ".ref"
+
+
+class SharedTableStore:
+    """
+    Arrow tables shared by all server processes of the machine (e.g. gunicorn workers).
+
+    Every table is an Arrow IPC file ("segment") in directory, named by a digest of its content
+    key, e.g. (property path, start, stop, rows): all holders of the same data share one segment.
+    Segments are written to a temporary file and renamed, so readers never see a partial one,
+    and read with a memory map: a worker attaching to a table maps the same pages instead of
+    copying them or reading the parquet months again.
+
+    Every process records the holders (e.g. (session, graph uid)) of a segment as empty
+    reference files "<holder>.<segment>.<pid>.ref" next to it. A segment is removed with its last
+    reference, references not used for ref_ttl seconds are dropped by cleanup. The modification
+    time of a segment is its last use, the byte budget is enforced across processes with it.
+    Write errors (e.g. a /dev/shm smaller than the budget running full) leave neither a reference
+    nor a temporary file behind, they are counted in stats and the table is not shared.
+    """
+
+    def __init__(self, directory=DEFAULT_SHARED_DIR, max_bytes=DEFAULT_SHARED_BYTES, ref_ttl=DEFAULT_REF_TTL):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ref_ttl = ref_ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def attach(self, holder, key, table=None):
+        """
+        Parameters
+        ----------
+        holder : tuple
+            the user of the table, e.g. (session, graph uid)
+        key : tuple
+            identifies the content of the table, e.g. (property path, start, stop, rows)
+        table : pyarrow.Table, optional
+            written as the segment of key if there is none yet
+
+        Returns
+        -------
+        tuple
+            (segment, table): the segment name to detach the holder with and the mapped table,
+            None if there is neither a segment of key nor a table, or the segment could not be
+            written (e.g. a full /dev/shm), the caller then keeps its table in the process
+        """
+        segment = segment_name(key)
+        ref_path = self._ref_path(holder, segment)
+        try:
+            # referenced before it is mapped or written, a concurrent detach of the last other holder keeps it
+            self._touch(ref_path)
+            mapped = self._get(segment)
+            if mapped is None and table is not None:
+                mapped = self._put(segment, table)
+        except OSError:
+            with self._lock:
+                self.errors += 1
+            mapped = None
+        if mapped is None:
+            self._unlink(ref_path)
+            return None
+        return segment, mapped
+
+    def find(self, holder):
+        """(segment, table) another process attached holder to, None if it has none."""
+        prefix = f"{_digest(holder)}."
+        for name in self._names(REF_SUFFIX):
+            if not name.startswith(prefix):
+                continue
+            segment = name.split(".")[1]
+            try:
+                self._touch(self._ref_path(holder, segment))
+                table = self._get(segment)
+            except OSError:
+                table = None
+            if table is not None:
+                return segment, table
+            self.detach(holder, segment)
+        return None
+
+    def touch(self, holder, segment):
+        """Marks the reference of holder and the segment as used."""
+        try:
+            self._touch(self._ref_path(holder, segment))
+            os.utime(self.directory.joinpath(f"{segment}{SEGMENT_SUFFIX}"))
+        except OSError:
+            pass
+
+    def detach(self, holder, segment):
+        """Drops the reference of holder, the segment goes with the last reference of any process."""
+        self._unlink(self._ref_path(holder, segment))
+        if not any(name.split(".")[1] == segment for name in self._names(REF_SUFFIX)):
+            # workers that mapped it keep their mapping
+            self._unlink(self.directory.joinpath(f"{segment}{SEGMENT_SUFFIX}"))
+
+    def cleanup(self, max_bytes=None):
+        """
+        Drops the references not used for ref_ttl seconds (e.g. of stopped workers) and the segments
+        without references, then the least recently used segments until all of them fit into max_bytes.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        deadline = time.time() - self.ref_ttl
+        referenced = set()
+        for path, st in self._files(REF_SUFFIX):
+            if st.st_mtime < deadline:
+                self._unlink(path)
+            else:
+                referenced.add(Path(path).name.split(".")[1])
+
+        segments = []
+        for path, st in self._files(SEGMENT_SUFFIX):
+            if Path(path).name[:-len(SEGMENT_SUFFIX)] in referenced:
+                segments.append((path, st))
+            else:
+                self._unlink(path)
+        total = sum(st.st_size for _, st in segments)
+        for path, st in sorted(segments, key=lambda s: s[1].st_mtime_ns):
+            if total <= max_bytes:
+                break
+            self._unlink(path)
+            total -= st.st_size
+
+    def usage(self):
+        segments = self._files(SEGMENT_SUFFIX)
+        return {"segments": len(segments), "references": len(self._names(REF_SUFFIX)),
+                "bytes": sum(st.st_size for _, st in segments), "max_bytes": self.max_bytes,
+                "directory": str(self.directory)}
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "errors": self.errors,
+                    **self.usage()}
+
+    def _put(self, segment, table):
+        path = self.directory.joinpath(f"{segment}{SEGMENT_SUFFIX}")
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with pa.OSFile(str(tmp_path), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        finally:
+            self._unlink(tmp_path)
+        with self._lock:
+            self.writes += 1
+        table = self._map(path)
+        self.cleanup()
+        return table
+
+    def _get(self, segment):
+        path = self.directory.joinpath(f"{segment}{SEGMENT_SUFFIX}")
+        try:
+            table = self._map(path)
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return table
+
+    def _ref_path(self, holder, segment):
+        return self.directory.joinpath(f"{_digest(holder)}.{segment}.{os.getpid()}{REF_SUFFIX}")
+
+    def _touch(self, path):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        Path(path).touch()
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _names(self, suffix):
+        try:
+            return [name for name in os.listdir(self.directory) if name.endswith(suffix)]
+        except FileNotFoundError:
+            return []
+
+    def _files(self, suffix):
+        files = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(suffix):
+                        try:
+                            files.append((entry.path, entry.stat()))
+                        except FileNotFoundError:
+                            pass
+        except FileNotFoundError:
+            pass
+        return files
+
+    @staticmethod
+    def _map(path):
+        with pa.memory_map(str(path), "r") as source:
+            return pa.ipc.open_file(source).read_all()
+
+
+def segment_name(key):
+    """Name of the segment of a key (a string or a tuple of strings, numbers, dates or paths)."""
+    return _digest(key)
+
+
+def _digest(key):
+    if not isinstance(key, tuple):
+        key = (key,)
+    return hashlib.sha1("\x1f".join(str(part) for part in key).encode()).hexdigest()
+
+
+# segments shared by all processes of the dashboards, see session_store
+shared_tables = SharedTableStore()
@@ -0,0 +1,394 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+from numpy.lib.stride_tricks import sliding_window_view
+from pyarrow import parquet as pq
+from scipy import fft, signal
+
+from catalog import file_overlaps, get_file_stats, is_fresh, load_catalog, source_metadata
+from data import load_trace_arrays, month_range, read_month_file, table_to_arrays
+
+# segment length of the STFT when the dashboards do not choose one
+DEFAULT_NPERSEG = 256
+# frames transformed at once, bounds the temporary complex block
+DEFAULT_CHUNK_FRAMES = 4096
+# cells of the heatmap sent to the browser, about the pixel size of a dashboard graph
+DEFAULT_TIME_BINS = 1000
+DEFAULT_FREQ_BINS = 256
+# memory budget of the cached STFT frames
+DEFAULT_SPECTROGRAM_CACHE_BYTES = 512 * 1024 ** 2
+# tile pyramid levels: STFT frames averaged into one tile row, level 1 holds the frames themselves
+SPECTROGRAM_LEVELS = (1, 8, 64, 512)
+# tile rows per row group, the unit read from disk for a visible window
+TILE_ROWS = 1024
+# tiles are stored next to the month file like the rollups, e.g. 2023-10.parquet -> 2023-10.spectrogram-256-8.pq
+SPECTROGRAM_FILE = "{month}.spectrogram-{nperseg}-{level}.pq"
+
+
+class SpectrogramCache:
+    """
+    Byte-budgeted LRU cache of computed STFT frames (see spectrogram_frames), keyed by
+    (property, first and last timestamp, samples, nperseg, noverlap, fs). Re-rendering a graph,
+    another screen size or a zoom reduces the cached frames instead of transforming again.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_SPECTROGRAM_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            frames = self._frames.get(key)
+            if frames is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frames
+
+    def put(self, key, frames):
+        size = _frames_bytes(frames)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._frames:
+                self.bytes -= _frames_bytes(self._frames.pop(key))
+            self._frames[key] = frames
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.bytes -= _frames_bytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._frames), "bytes": self.bytes,
+                    "max_bytes": self.max_bytes}
+
+
+# cache shared by all spectrogram graphs of the process
+spectrogram_cache = SpectrogramCache()
+
+
+def spectrogram(timestamps, values, nperseg=DEFAULT_NPERSEG, noverlap=None, fs=None, key=None,
+                time_bins=DEFAULT_TIME_BINS, freq_bins=DEFAULT_FREQ_BINS):
+    """
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        datetime64[ns] of the samples, e.g. from data.table_to_arrays
+    values : numpy.ndarray
+        the samples
+    nperseg : int
+        STFT segment length in samples
+    noverlap : int, optional
+        samples shared by consecutive segments, nperseg // 8 by default (as scipy.signal.spectrogram)
+    fs : float, optional
+        sampling frequency in Hz, estimated from the timestamps if not given
+    key : hashable, optional
+        the property the samples belong to. With a key the frames are cached in spectrogram_cache.
+    time_bins, freq_bins : int
+        size of the returned matrix
+
+    Returns
+    -------
+    tuple
+        (power in dB as float32 [freq bins x time bins], frequencies in Hz, datetime64 times), like
+        10 * log10 of scipy.signal.spectrogram reduced to at most time_bins x freq_bins by averaging
+        the power of neighbouring frames and frequencies.
+    """
+    frames = spectrogram_frames(timestamps, values, nperseg, noverlap, fs, key)
+    return reduce_spectrogram(frames, time_bins, freq_bins)
+
+
+def load_spectrogram(property_path, start_dt, stop_dt, nperseg=DEFAULT_NPERSEG, noverlap=None,
+                     time_bins=DEFAULT_TIME_BINS, freq_bins=DEFAULT_FREQ_BINS):
+    """spectrogram of a doocs property between start_dt and stop_dt, cached under the property path."""
+    timestamps, values = load_trace_arrays(property_path, start_dt, stop_dt, dtype=np.float32)[property_path]
+    return spectrogram(timestamps, values, nperseg, noverlap, key=str(property_path), time_bins=time_bins,
+                       freq_bins=freq_bins)
+
+
+def spectrogram_frames(timestamps, values, nperseg=DEFAULT_NPERSEG, noverlap=None, fs=None, key=None,
+                       chunk_frames=DEFAULT_CHUNK_FRAMES):
+    """
+    The one-sided power spectral density of every STFT frame (Tukey window, constant detrend, as
+    scipy.signal.spectrogram), computed in float32 blocks of chunk_frames frames.
+
+    Returns
+    -------
+    dict
+        "power" (float32 [frames x frequencies]), "freqs" (Hz), "times" (datetime64[ns] of the
+        frame centers, taken from the timestamps so gaps in the data stay visible) and "fs"
+    """
+    timestamps = np.asarray(timestamps)
+    values = np.asarray(values, dtype=np.float32)
+    valid = ~np.isnan(values)
+    if not valid.all():
+        timestamps, values = timestamps[valid], values[valid]
+    nperseg = max(1, min(nperseg, values.size))
+    noverlap = nperseg // 8 if noverlap is None else min(noverlap, nperseg - 1)
+
+    cache_key = None
+    if key is not None and values.size:
+        cache_key = (key, timestamps[0], timestamps[-1], values.size, nperseg, noverlap, fs)
+        frames = spectrogram_cache.get(cache_key)
+        if frames is not None:
+            return frames
+
+    fs = fs or sample_rate(timestamps)
+    step = nperseg - noverlap
+    n_frames = (values.size - nperseg) // step + 1 if values.size else 0
+    window = signal.get_window(("tukey", 0.25), nperseg).astype(np.float32)
+    power = np.empty((n_frames, nperseg // 2 + 1), dtype=np.float32)
+    segments = sliding_window_view(values, nperseg)[::step] if values.size else np.empty((0, nperseg), np.float32)
+    for start in range(0, n_frames, chunk_frames):
+        block = segments[start:start + chunk_frames]
+        block = (block - block.mean(axis=1, keepdims=True)) * window
+        spectrum = fft.rfft(block, axis=1)
+        power[start:start + block.shape[0]] = spectrum.real ** 2 + spectrum.imag ** 2
+
+    # density scaling, one-sided: everything but DC (and the Nyquist frequency of even segments) counts twice
+    power *= np.float32(1.0 / (fs * np.sum(window * window)))
+    power[:, 1:power.shape[1] - (nperseg % 2 == 0)] *= 2
+    frames = {
+        "power": power,
+        "freqs": fft.rfftfreq(nperseg, 1 / fs),
+        "times": timestamps[np.arange(n_frames) * step + nperseg // 2],
+        "fs": np.float64(fs),
+    }
+    if cache_key is not None:
+        spectrogram_cache.put(cache_key, frames)
+    return frames
+
+
+def reduce_spectrogram(frames, time_bins=DEFAULT_TIME_BINS, freq_bins=DEFAULT_FREQ_BINS):
+    """Averages cached frames down to at most time_bins x freq_bins, see spectrogram for the result."""
+    power, freqs, times = frames["power"], frames["freqs"], frames["times"]
+    if power.size == 0:
+        return np.empty((freqs.size, 0), dtype=np.float32), freqs, times
+    time_edges = _bin_edges(power.shape[0], time_bins)
+    freq_edges = _bin_edges(power.shape[1], freq_bins)
+    reduced = _mean_reduce(_mean_reduce(power, time_edges, axis=0), freq_edges, axis=1)
+    # the frame in the middle of every time bin, the mean frequency of every frequency bin
+    reduced_times = times[(time_edges[:-1] + time_edges[1:] - 1) // 2]
+    reduced_freqs = _mean_reduce(freqs, freq_edges, axis=0)
+    with np.errstate(divide="ignore"):
+        db = 10 * np.log10(np.maximum(reduced, np.finfo(np.float32).tiny))
+    return db.T, reduced_freqs, reduced_times
+
+
+def spectrogram_window(property_path, start_dt, stop_dt, nperseg=DEFAULT_NPERSEG, freq_range=None,
+                       time_bins=DEFAULT_TIME_BINS, freq_bins=DEFAULT_FREQ_BINS):
+    """
+    Parameters
+    ----------
+    property_path : Path
+        path to a doocs property
+    start_dt : datetime.datetime
+        first datetime of the visible window
+    stop_dt : datetime.datetime
+        last datetime of the visible window
+    nperseg : int
+        STFT segment length of the tiles
+    freq_range : tuple, optional
+        (lowest, highest) visible frequency in Hz, all frequencies if not given
+    time_bins, freq_bins : int
+        size of the returned matrix, e.g. the graph size in pixels
+
+    Returns
+    -------
+    tuple
+        (power in dB [freq bins x time bins], frequencies in Hz, datetime64 times (naive UTC)) like
+        spectrogram. Only the tiles overlapping the window are read, from the coarsest pyramid level
+        that still has time_bins rows in it, so zooming in on an event shows its frames at full
+        resolution and a month-wide view reads a few hundred rows.
+    """
+    p = Path(property_path)
+    start_timestamp = datetime.timestamp(start_dt)
+    stop_timestamp = datetime.timestamp(stop_dt)
+    months = []
+    for month in month_range(start_dt, stop_dt):
+        stats = get_file_stats(p.joinpath(f"{month}.parquet"))
+        if stats is not None and file_overlaps(stats, start_timestamp, stop_timestamp):
+            months.append(month)
+
+    def read_level(level):
+        tiles = [read_spectrogram_tiles(p, month, level, nperseg, start_timestamp, stop_timestamp) for month in months]
+        tiles = [t for t in tiles if t["power"].shape[0]] or [_empty_tiles(nperseg)]
+        return {"power": np.concatenate([t["power"] for t in tiles]),
+                "times": np.concatenate([t["times"] for t in tiles]),
+                "freqs": tiles[0]["freqs"]}
+
+    # the coarsest level tells how many frames the window has, then the level giving time_bins rows is read
+    coarsest = SPECTROGRAM_LEVELS[-1]
+    tiles = read_level(coarsest)
+    frames_in_window = tiles["power"].shape[0] * coarsest
+    level = max([lv for lv in SPECTROGRAM_LEVELS if frames_in_window / lv >= time_bins], default=SPECTROGRAM_LEVELS[0])
+    if level != coarsest:
+        tiles = read_level(level)
+
+    if freq_range is not None:
+        visible = (tiles["freqs"] >= freq_range[0]) & (tiles["freqs"] <= freq_range[1])
+        if visible.any():
+            tiles["power"], tiles["freqs"] = tiles["power"][:, visible], tiles["freqs"][visible]
+    tiles["times"] = (tiles["times"] * 1e9).astype(np.int64).view("datetime64[ns]")
+    return reduce_spectrogram(tiles, time_bins, freq_bins)
+
+
+def read_spectrogram_tiles(prop_path, month, level, nperseg=DEFAULT_NPERSEG, start_timestamp=None,
+                           stop_timestamp=None):
+    """
+    The tile rows of one month and pyramid level between start and stop (epoch seconds): "power"
+    (float32 [rows x frequencies]), "times" (epoch seconds) and "freqs". Up to date tile files are
+    read with row group pruning, otherwise the level is computed from the (cached) frames of the month file.
+    """
+    month_file = Path(prop_path).joinpath(f"{month}.parquet")
+    source = source_metadata(month_file)
+    filters = []
+    if start_timestamp is not None:
+        filters.append(("timestamp", ">=", start_timestamp))
+    if stop_timestamp is not None:
+        filters.append(("timestamp", "<=", stop_timestamp))
+    try:
+        path = _tiles_path(prop_path, month, nperseg, level)
+        metadata = pq.read_schema(path).metadata
+        if metadata and is_fresh(metadata, source):
+            table = pq.read_table(path, filters=filters or None)
+            return _tiles_from_table(table, float(metadata[b"fs"]), nperseg)
+    except FileNotFoundError:
+        pass
+
+    table = _tile_table(_month_frames(month_file, nperseg, cache=True), level)
+    timestamps = table["timestamp"].to_numpy()
+    in_range = np.ones(timestamps.size, dtype=bool)
+    if start_timestamp is not None:
+        in_range &= timestamps >= start_timestamp
+    if stop_timestamp is not None:
+        in_range &= timestamps <= stop_timestamp
+    fs = float(table.schema.metadata[b"fs"])
+    return _tiles_from_table(table.filter(pa.array(in_range)), fs, nperseg)
+
+
+def build_spectrogram_tiles(prop_path, months=None, nperseg=DEFAULT_NPERSEG, force=False):
+    """
+    Writes the tile pyramid (all SPECTROGRAM_LEVELS) for the month files of a property. Up to
+    date tiles are skipped unless force is given.
+
+    Returns
+    -------
+    list
+        the months whose tiles were (re)written
+    """
+    prop_path = Path(prop_path)
+    if months is None:
+        months = sorted(f.name[:-len(".parquet")] for f in prop_path.glob("????-??.parquet"))
+
+    written = []
+    for month in months:
+        month_file = prop_path.joinpath(f"{month}.parquet")
+        source = source_metadata(month_file)
+        if not force and all(_tiles_are_fresh(prop_path, month, nperseg, level, source) for level in SPECTROGRAM_LEVELS):
+            continue
+        frames = _month_frames(month_file, nperseg)
+        for level in SPECTROGRAM_LEVELS:
+            table = _tile_table(frames, level)
+            table = table.replace_schema_metadata({**table.schema.metadata, **source})
+            path = _tiles_path(prop_path, month, nperseg, level)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            pq.write_table(table, tmp_path, row_group_size=TILE_ROWS)
+            os.replace(tmp_path, path)
+        written.append(month)
+    return written
+
+
+def _month_frames(month_file, nperseg, cache=False):
+    timestamps, values = table_to_arrays(read_month_file(month_file), dtype=np.float32)
+    return spectrogram_frames(timestamps, values, nperseg, key=str(month_file) if cache else None)
+
+
+def _tile_table(frames, level):
+    """One pyramid level of the frames of a month: the mean power of every `level` consecutive frames."""
+    power, times, freqs = frames["power"], frames["times"], frames["freqs"]
+    edges = np.append(np.arange(0, power.shape[0], level), power.shape[0])
+    if power.shape[0]:
+        power = _mean_reduce(power, edges, axis=0)
+        times = times[(edges[:-1] + edges[1:] - 1) // 2]
+    timestamps = times.astype("datetime64[ns]").view(np.int64) / 1e9
+    column = pa.FixedSizeListArray.from_arrays(pa.array(power.ravel(), pa.float32()), freqs.size)
+    return pa.table([pa.array(timestamps, pa.float64()), column], names=["timestamp", "power"],
+                    metadata={b"fs": repr(float(frames["fs"])).encode()})
+
+
+def _tiles_from_table(table, fs, nperseg):
+    freqs = fft.rfftfreq(nperseg, 1 / fs)
+    power = table["power"].combine_chunks().flatten().to_numpy(zero_copy_only=False)
+    return {"power": power.reshape(-1, freqs.size), "times": table["timestamp"].to_numpy(), "freqs": freqs}
+
+
+def _empty_tiles(nperseg):
+    freqs = fft.rfftfreq(nperseg)
+    return {"power": np.empty((0, freqs.size), dtype=np.float32), "times": np.empty(0), "freqs": freqs}
+
+
+def _tiles_path(prop_path, month, nperseg, level):
+    return Path(prop_path).joinpath(SPECTROGRAM_FILE.format(month=month, nperseg=nperseg, level=level))
+
+
+def _tiles_are_fresh(prop_path, month, nperseg, level, source):
+    try:
+        return is_fresh(pq.read_schema(_tiles_path(prop_path, month, nperseg, level)).metadata or {}, source)
+    except FileNotFoundError:
+        return False
+
+
+def sample_rate(timestamps):
+    """Sampling frequency in Hz from the median interval of datetime64 timestamps (1 Hz if unknown)."""
+    timestamps = np.asarray(timestamps)
+    if timestamps.size < 2:
+        return 1.0
+    interval = np.median(np.diff(timestamps.astype("datetime64[ns]").view(np.int64))) / 1e9
+    return 1.0 / interval if interval > 0 else 1.0
+
+
+def _bin_edges(n, bins):
+    return np.unique(np.linspace(0, n, min(bins, n) + 1).astype(np.int64))
+
+
+def _mean_reduce(array, edges, axis):
+    sums = np.add.reduceat(array, edges[:-1], axis=axis)
+    counts = np.diff(edges).astype(array.dtype)
+    shape = [1] * array.ndim
+    shape[axis] = counts.size
+    return sums / counts.reshape(shape)
+
+
+def _frames_bytes(frames):
+    return sum(v.nbytes for v in frames.values())
+
+
+if __name__ == "__main__":
+    # python spectrogram.py <archive base path> [--force]
+    base_path = Path(sys.argv[1])
+    force = "--force" in sys.argv[2:]
+    catalog = load_catalog(base_path, max_age=0)
+    start = time.perf_counter()
+    for prop_path in catalog["properties"]:
+        written = build_spectrogram_tiles(prop_path, force=force)
+        if written:
+            print(f"{prop_path}: {', '.join(written)}")
+    print(f"Spectrogram tiles completed in {round(time.perf_counter() - start, 2)} seconds")
@@ -0,0 +1,122 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from pyarrow import parquet as pq
+
+# memory budget of the shared cache of decoded month tables
+DEFAULT_CACHE_BYTES = 2 * 1024 ** 3
+
+
+class TableCache:
+    """
+    Byte-budgeted LRU cache of decoded month files (Arrow tables).
+
+    Entries are keyed by (property path, month file name, variant, file mtime), so a month file
+    that is rewritten or appended to is decoded again while all other months are served
+    from memory. The least recently used tables are evicted once the budget is exceeded.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._tables = OrderedDict()
+        self._keys = {}  # (property path, month file, variant) -> key of the cached mtime
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def read(self, file_path, loader=pq.read_table, variant=None):
+        """
+        Parameters
+        ----------
+        file_path : Path
+            month file of a doocs property, e.g. .../CTRL0.OUT.MEAN.RD/2023-10.parquet
+        loader : callable
+            decodes the file on a cache miss
+        variant : str, optional
+            name of a derived form of the month (e.g. with normalized timestamps) that is
+            cached alongside the decoded table
+
+        Returns
+        -------
+        pyarrow.Table
+            the complete decoded month file
+        """
+        key = self.key(file_path, variant)
+        table = self.get(key)
+        if table is None:
+            table = loader(file_path)
+            self.put(key, table)
+        return table
+
+    def contains(self, file_path, variant=None):
+        """True if the current version of the month file is cached, without touching the LRU order or the counters."""
+        key = self.key(file_path, variant)
+        with self._lock:
+            return key in self._tables
+
+    @staticmethod
+    def key(file_path, variant=None):
+        file_path = Path(file_path)
+        return str(file_path.parent), file_path.name, variant, os.stat(file_path).st_mtime_ns
+
+    def get(self, key):
+        with self._lock:
+            table = self._tables.get(key)
+            if table is None:
+                self.misses += 1
+                return None
+            self._tables.move_to_end(key)
+            self.hits += 1
+            return table
+
+    def put(self, key, table):
+        if table.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old_key = self._keys.get(key[:3])
+            if old_key is not None:
+                self._remove(old_key)
+            self._tables[key] = table
+            self._keys[key[:3]] = key
+            self.bytes += table.nbytes
+            self._evict(self.max_bytes)
+
+    def resize(self, max_bytes):
+        """Changes the memory budget, evicting tables if the cache is above the new one."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict(max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._keys.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._tables),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, key):
+        table = self._tables.pop(key)
+        del self._keys[key[:3]]
+        self.bytes -= table.nbytes
+
+    def _evict(self, max_bytes):
+        while self._tables and self.bytes > max_bytes:
+            self._remove(next(iter(self._tables)))
+            self.evictions += 1
+
+
+# cache shared by all loaders of the process
+table_cache = TableCache()
@@ -0,0 +1,128 @@
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import parquet as pq
+
+from data import normalize_timestamps, standard_types, table_to_arrays
+
+# data shown when a property is followed for the first time
+DEFAULT_HISTORY = timedelta(hours=1)
+# points kept in a live graph, older ones are dropped by plotly when new ones are pushed
+DEFAULT_MAX_POINTS = 100_000
+
+
+class TailFollower:
+    """
+    Incremental reader of the current month file of doocs properties, for live monitoring.
+
+    What a graph has already seen is kept in a cursor owned by the caller (e.g. a dcc.Store per
+    graph): the followed property, month file, the number of row groups already read and the
+    last timestamp. Every graph, tab and user follows with its own cursor and gets all new
+    rows, and any server process can continue it. A poll only stats the file and, if it
+    changed, reads the footer and the newly appended row groups, so its cost does not grow as
+    the month fills up.
+    """
+
+    def __init__(self, history=DEFAULT_HISTORY):
+        self.history = history
+
+    def poll(self, property_path, cursor=None, now=None):
+        """
+        Parameters
+        ----------
+        property_path : Path
+            path to a doocs property
+        cursor : dict, optional
+            the cursor returned by the previous poll. Without one, or with the cursor of another
+            property, the poll starts again with the history window.
+        now : datetime.datetime, optional
+            current time, selects the month file to follow
+
+        Returns
+        -------
+        tuple
+            (table, cursor): the rows appended since the cursor in timestamp order with normalized
+            timestamps (None if there are none) and the cursor for the next poll, JSON serializable.
+            The first poll of a property returns the last `history` of data.
+        """
+        p = Path(property_path)
+        now = now or datetime.now()
+        if cursor is None or cursor.get("property") != str(p):
+            cursor = {"property": str(p), "month": None, "file": None, "row_groups": 0, "last_rows": 0,
+                      "last_ts": datetime.timestamp(now - self.history)}
+        else:
+            cursor = dict(cursor)
+
+        tables = []
+        month = now.strftime("%Y-%m")
+        if cursor["month"] is not None and cursor["month"] != month:
+            # the rest of the previous month before switching to the new file
+            tables.append(self._read_new(p.joinpath(f"{cursor['month']}.parquet"), cursor))
+            cursor.update(file=None, row_groups=0, last_rows=0)
+        cursor["month"] = month
+        tables.append(self._read_new(p.joinpath(f"{month}.parquet"), cursor))
+
+        tables = [t for t in tables if t is not None]
+        if not tables:
+            return None, cursor
+        return normalize_timestamps(pa.concat_tables(tables)), cursor
+
+    def _read_new(self, file_path, cursor):
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        # a string, the nanosecond mtime does not survive a round trip through JavaScript numbers
+        signature = f"{st.st_size}:{st.st_mtime_ns}"
+        if cursor["file"] == signature:
+            return None
+
+        parquet_file = pq.ParquetFile(file_path)
+        metadata = parquet_file.metadata
+        first = cursor["row_groups"]
+        if first > metadata.num_row_groups:
+            # rewritten (e.g. compacted) file, start over and rely on the last timestamp
+            first = 0
+        elif first > 0 and metadata.row_group(first - 1).num_rows != cursor["last_rows"]:
+            # the last row group read was still growing
+            first -= 1
+        if first == 0 and cursor["row_groups"] == 0:
+            first = _first_row_group(metadata, cursor["last_ts"])
+
+        cursor["file"] = signature
+        cursor["row_groups"] = metadata.num_row_groups
+        if metadata.num_row_groups:
+            cursor["last_rows"] = metadata.row_group(metadata.num_row_groups - 1).num_rows
+        if first >= metadata.num_row_groups:
+            return None
+
+        table = standard_types(parquet_file.read_row_groups(range(first, metadata.num_row_groups)))
+        table = table.filter(pc.greater(table["timestamp"], cursor["last_ts"]))
+        if len(table) == 0:
+            return None
+        table = table.take(pc.sort_indices(table["timestamp"]))
+        cursor["last_ts"] = table["timestamp"][-1].as_py()
+        return table
+
+
+def extend_data(table, max_points=DEFAULT_MAX_POINTS, trace=0):
+    """The extendData value of a dcc.Graph appending the rows of table to one of its traces."""
+    x, y = table_to_arrays(table)
+    return dict(x=[x], y=[y]), [trace], max_points
+
+
+def _first_row_group(metadata, since):
+    """First row group with rows after since, from the footer statistics (0 without statistics)."""
+    column = metadata.schema.names.index("timestamp")
+    for i in range(metadata.num_row_groups):
+        statistics = metadata.row_group(i).column(column).statistics
+        if statistics is None or not statistics.has_min_max:
+            return 0
+        maximum = statistics.max
+        if isinstance(maximum, datetime):
+            maximum = maximum.timestamp()
+        if maximum > since:
+            return i
+    return metadata.num_row_groups
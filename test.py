@@ -12,13 +12,13 @@ actual plotly-resampler graph and cache it on the server side. These two callbac
 chained together using the dcc.Interval component.
 
 """
-from data2 import get_doocs_properties, load_parquet_data
+from data import get_doocs_properties, load_parquet_data, local_time, table_to_arrays
+from spectrogram import spectrogram as compute_spectrogram
+from session_store import new_session_id, session_store
 from pathlib import Path
 from datetime import datetime
 
 from typing import List
-from scipy.signal import spectrogram
-import numpy as np
 import plotly.graph_objects as go
 from dash import MATCH, Input, Output, State, dcc, html, no_update
 from dash_extensions.enrich import (
@@ -33,15 +33,12 @@ from trace_updater import TraceUpdater
 from plotly_resampler import FigureResampler
 from plotly_resampler.aggregation import MinMaxLTTB
 
-# Data that will be used for the plotly-resampler figures
-online_data = {}
-
 doocs_properties = get_doocs_properties(Path("C:/Users/pmahad/Desktop/Project/XFEL.SYNC"))
 
 # --------------------------------------Globals ---------------------------------------
 app = DashProxy(__name__, transforms=[ServersideOutputTransform(), TriggerTransform()])
 
-app.layout = html.Div(
+layout = html.Div(
     [
         html.Div(children=[
             dcc.Dropdown(doocs_properties, id="property-selecter", multi=True),
@@ -58,6 +55,14 @@ app.layout = html.Div(
 )
 
 
+def serve_layout():
+    # every page load gets a session id, the loaded data is kept per session in session_store
+    return html.Div([dcc.Store(id="session-id", data=new_session_id(), storage_type="session"), layout])
+
+
+app.layout = serve_layout
+
+
 # ------------------------------------ DASH logic -------------------------------------
 @app.callback(
     Output("container", "children"),
@@ -65,16 +70,22 @@ app.layout = html.Div(
     State("property-selecter", "value"),
     State("container", "children"),
     State("coarse-tuning-selector", "value"),
+    State("session-id", "data"),
     prevent_initial_call=True,
 )
-def add_graph_div(_, selected_properties, div_children: List[html.Div], coarse_tuning):
+def add_graph_div(_, selected_properties, div_children: List[html.Div], coarse_tuning, session_id):
     if selected_properties is None:
+        session_store.release(session_id)
         return []
     else:
         props = [Path(prop) for prop in selected_properties]
-        loaded_data = load_parquet_data(props, datetime(2023, 10, 15, 17, 30), datetime(2023, 11, 15, 17, 30))
+        start_dt, stop_dt = datetime(2023, 10, 15, 17, 30), datetime(2023, 11, 15, 17, 30)
+        loaded_data = load_parquet_data(props, start_dt, stop_dt)
         for key, item in loaded_data.items():
-            online_data[doocs_properties[str(key)]] = item
+            session_store.put(session_id, doocs_properties[str(key)], item,
+                              source=(str(key), start_dt.isoformat(), stop_dt.isoformat()))
+        # the graphs of the previous selection are gone from the container
+        session_store.retain(session_id, [doocs_properties[str(key)] for key in loaded_data])
 
         div_children = []
         # make the plots here
@@ -118,11 +129,13 @@ def add_graph_div(_, selected_properties, div_children: List[html.Div], coarse_t
         State("property-selecter", "value"),
         State({"type": "dynamic-graph", "index": MATCH}, "id"),
         State('window-size-slider', 'value'),
-        State("coarse-tuning-selector", "value")
+        State("coarse-tuning-selector", "value"),
+        State("session-id", "data")
     ],
     prevent_initial_call=True,
 )
-def construct_display_graph(n_clicks, _, selected_properties, analysis, window_size, coarse_tuning) -> FigureResampler:
+def construct_display_graph(n_clicks, _, selected_properties, analysis, window_size, coarse_tuning,
+                            session_id) -> FigureResampler:
     print("Coarse Tuning Value:", coarse_tuning)
     file_figures = []
     spec_figures = []
@@ -136,23 +149,26 @@ def construct_display_graph(n_clicks, _, selected_properties, analysis, window_s
         default_downsampler=MinMaxLTTB(parallel=True),
     )
 
-    data = online_data[analysis['index']]
+    data = session_store.get(session_id, analysis['index'])
+    if data is None:
+        # released or evicted (expired, session or store memory limit), the user loads again
+        return no_update, no_update, no_update
 
     sigma = n_clicks * 1e-6
-    fig.add_trace(dict(name="new"),
-                  hf_x=[datetime.fromtimestamp(timestamp) for timestamp in data["timestamp"]],
-                  hf_y=data["data"])
+    timestamps, values = table_to_arrays(data)
+    fig.add_trace(dict(name="new"), hf_x=local_time(timestamps), hf_y=values)
     if 'include_coarse_tuning' in coarse_tuning:
         # Include coarse tuning
         if 'include_coarse_tuning' in coarse_tuning:
             # Include coarse tuning
-            fig.add_trace(dict(name="coarse tuning"),
-                          hf_x=[datetime.fromtimestamp(timestamp) for timestamp in data["coarse_tuning_timestamp"]],
-                          hf_y=data["coarse_tuning_data"])
+            coarse_timestamps, coarse_values = table_to_arrays(data, value_column="coarse_tuning_data",
+                                                               timestamp_column="coarse_tuning_timestamp")
+            fig.add_trace(dict(name="coarse tuning"), hf_x=local_time(coarse_timestamps),
+                          hf_y=coarse_values)
         fig.update_layout(title=f"<b>{analysis['index']}</b>", title_x=0.5)
 
-    spec_data, freqs, times = get_spectrogram(data["data"], fs=1, window_size=window_size)
-    spec_fig = go.Figure(go.Heatmap(z=spec_data, x=times, y=freqs, colorscale='Viridis'))
+    spec_data, freqs, times = get_spectrogram(timestamps, values, window_size=window_size, key=analysis['index'])
+    spec_fig = go.Figure(go.Heatmap(z=spec_data, x=local_time(times), y=freqs, colorscale='Viridis'))
 
     file_figures.append(fig)
     spec_figures.append(spec_fig)
@@ -161,10 +177,9 @@ def construct_display_graph(n_clicks, _, selected_properties, analysis, window_s
     return file_figures, spec_figures, store_data
 
 
-def get_spectrogram(data, fs, window_size):
-    """Function to calculate spectrogram."""
-    f, t, Sxx = spectrogram(data, fs, nperseg=window_size)
-    return 10 * np.log10(Sxx), f, t
+def get_spectrogram(timestamps, values, window_size, key=None):
+    """Function to calculate spectrogram, sample rate from the timestamps and reduced to the graph size."""
+    return compute_spectrogram(timestamps, values, nperseg=window_size, key=key)
 
 
 def sync_zoom(relayoutdata: dict, children: List[html.Div]):
@@ -5,6 +5,8 @@ from dateutil.relativedelta import relativedelta
 import time
 import pandas as pd
 
+from data import get_doocs_properties
+
 def load_parquet_data(property_path, start_dt, stop_dt):
     """
     Parameters
@@ -57,36 +59,6 @@ def load_parquet_data(property_path, start_dt, stop_dt):
     print("Data loading time:", loading_runtime, "seconds")
     return parquet_data
 
-def get_doocs_properties(base_path):
-    """
-    Collects DOOCS properties and their corresponding paths.
-
-    Parameters
-    ----------
-    base_path : Path
-        The base directory path where DOOCS properties are stored.
-
-    Returns
-    -------
-    dict
-        A dictionary mapping property paths to their corresponding DOOCS hierarchy.
-    """
-    properties2paths = {}
-
-    if base_path.is_dir():
-        for fac_path in base_path.iterdir():
-            fac = fac_path.name
-            for dev_path in fac_path.iterdir():
-                dev = dev_path.name
-                for loc_path in dev_path.iterdir():
-                    loc = loc_path.name
-                    for prop_path in loc_path.iterdir():
-                        prop = prop_path.name
-                        properties2paths[str(prop_path)] = f"{fac}/{dev}/{loc}/{prop}"
-
-    return properties2paths
-
-
 base_path_str = "C:/Users/pmahad/Desktop/Project/XFEL.SYNC"
 base_path = Path(base_path_str)  # Convert the string path to a Path object
 properties_dict = get_doocs_properties(base_path)
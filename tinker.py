@@ -6,6 +6,8 @@ from tkinter import filedialog
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import time
 
+from downsampling import downsample_data
+
 
 def read_parquet_files(subfolder_path):
     files = [f for f in os.listdir(subfolder_path) if f.endswith('.parquet')]
@@ -19,11 +21,6 @@ def convert_timestamp(df):
     return df
 
 
-def downsample_data(df, timestamp_col='timestamp', value_col='data'):
-    df_resampled = df.groupby(pd.Grouper(key=timestamp_col, freq='6h'))[value_col].mean().reset_index()
-    return df_resampled
-
-
 def update_line_plot():
     start_time = time.time()  # Start timer
     selected_subfolder = selected_subfolder_var.get()